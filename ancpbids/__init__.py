@@ -1,42 +1,75 @@
+import importlib
 import logging
 import os
 import sys
+import dataclasses
 from dataclasses import dataclass
 from typing import Union, List, Optional
 
 from ancpbids import plugins
 from ancpbids import utils
-from . import model_v1_8_0
-from . import model_v1_9_0
-from . import model_v1_10_0
-# latest stable supported BIDS schema
-from ancpbids import model_v1_10_0 as model_latest
 
 from .plugin import get_plugins, load_plugins_by_package, DatasetPlugin, WritingPlugin, ValidationPlugin, SchemaPlugin, \
-    FileHandlerPlugin
+    FileHandlerPlugin, patch_schema
 from .query import BoolExpr, Select, EqExpr, AnyExpr, AllExpr, ReExpr, CustomOpExpr, \
-    EntityExpr
+    EntityExpr, Range, gt, ge, lt, le, between
 
 LOGGER = logging.getLogger("ancpbids")
 
+# supported BIDS schema modules, imported and patched by SchemaPlugins on first use
+SCHEMA_MODULES = ['model_v1_8_0', 'model_v1_9_0', 'model_v1_10_0']
+# latest stable supported BIDS schema
+LATEST_SCHEMA_MODULE = 'model_v1_10_0'
+
+
+def _get_schema_module(module_name):
+    """Imports the given schema module (if not done yet) and executes all SchemaPlugins on it exactly once."""
+    schema = sys.modules.get(f'{__name__}.{module_name}') or importlib.import_module(f'.{module_name}', __name__)
+    return patch_schema(schema)
+
+
+# asynchronous API, see ancpbids.aio
+_ASYNC_API = ['aload_dataset', 'aquery', 'aget_metadata', 'acontents']
+# multi-dataset API, see ancpbids.catalog
+_CATALOG_API = ['Catalog', 'CatalogMatch']
+
+
+def __getattr__(name):
+    # schema modules are resolved lazily to keep `import ancpbids` cheap
+    if name == 'model_latest':
+        return _get_schema_module(LATEST_SCHEMA_MODULE)
+    if name in SCHEMA_MODULES:
+        return _get_schema_module(name)
+    if name in _ASYNC_API:
+        # asyncio is imported only if the async API is used
+        from . import aio
+        return getattr(aio, name)
+    if name in _CATALOG_API:
+        from . import catalog
+        return getattr(catalog, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # ENTITIES_PATTERN = regex.compile(r'(([^\W_]+)-([^\W_]+)_)+([^\W_]+)((\.[^\W_]+)+)')
 
 @dataclass
 class DatasetOptions(dict):
     """All options that can be set to influence handling of reading/writing a dataset from/to file system."""
-    infer_artifact_datatype: bool = False
+    infer_artifact_datatype: bool = True
     """If True, will determine the datatype an Artifact is contained in, either directly or within a sub-directory.
         For example, given the path "sub-02/func/sub-02_task-mixedgamblestask_run-01_bold.nii.gz", the datatype will be "func".
-        
-        By default, this option is set to False as it may have a negative performance impact.
+        The datatype is assigned while the dataset is traversed, i.e. at virtually no cost.
+
+        By default, this option is set to True, which allows filtering by datatype, e.g. ``query(datatype='func')``.
     """
 
     ignore: Union[bool, List[str]] = False
     """If a .bidsignore file is available at the root, all resources (files/folders) matching the filters
-        in that file will not be added to the in-memory graph. Alternatively, a list of fnmatch patterns can be provided.
+        in that file will not be added to the in-memory graph. Alternatively, a list of patterns can be provided.
+        Patterns follow the gitignore semantics (comments, negation with '!', anchoring with '/', '**'),
+        see :func:`ancpbids.utils.compile_ignore_patterns`. Ignored folders are not traversed at all.
 
-        By default, this option is set to False as it may have a negative performance impact."""
+        By default, this option is set to False."""
 
     load_contents: bool = False
     """If ``True``, JSON and TSV files are read eagerly when calling
@@ -45,8 +78,52 @@ class DatasetOptions(dict):
         contents are cached only via weak references so memory can be reclaimed
         when they are no longer used."""
 
+    lazy_subtrees: bool = False
+    """If ``True``, subject and derivative folders are not scanned when calling :func:`load_dataset`
+        but on first access of their members (for example ``files``, ``folders`` or ``sessions``)
+        or when a query needs to search within them. Queries filtering by subject, e.g. ``sub='042'``,
+        only scan the matching subject folders, which keeps loading time independent of the cohort size
+        for jobs processing single subjects.
+
+        By default, this option is set to False, i.e. the whole dataset is scanned up front."""
+
+    subjects: Optional[List[str]] = None
+    """If set, only the subject folders with the given labels (with or without the "sub-" prefix) are loaded.
+        Dataset-level content is not subject-scoped and always loaded: top-level files (for example
+        dataset_description.json, participants.tsv or inherited sidecars) and folders (for example code, phenotype,
+        stimuli or sourcedata).
 
-def load_dataset(base_dir: str, options: Optional[DatasetOptions] = None):
+        By default, this option is set to None, i.e. all subjects are loaded."""
+
+    sessions: Optional[List[str]] = None
+    """If set, only the session folders with the given labels (with or without the "ses-" prefix) are loaded.
+
+        By default, this option is set to None, i.e. all sessions are loaded."""
+
+    datatypes: Optional[List[str]] = None
+    """If set, only the datatype folders (for example "anat" or "func") with the given names are loaded.
+
+        By default, this option is set to None, i.e. all datatypes are loaded."""
+
+    include_derivatives: Union[bool, List[str]] = True
+    """Whether to load the derivatives folder or a list of names of the derivative (pipeline) folders to load.
+        The subjects, sessions and datatypes options apply to the folders within derivatives as well.
+
+        By default, this option is set to True, i.e. all derivatives are loaded."""
+
+    query_cache_size: int = 0
+    """The maximum number of query results to cache per dataset, see :class:`ancpbids.query.QueryCache`.
+        Cached results are dropped whenever the graph is modified via its API (for example ``create_artifact()``,
+        ``remove_file()``, ``add_entity()`` or assigning the name, suffix, extension or entities of a file).
+        Call ``mark_modified()`` on any node after modifying member lists in-place, for example
+        ``artifact.entities.append(...)``.
+
+        By default, this option is set to 0, i.e. query results are not cached."""
+
+
+def load_dataset(base_dir: str, options: Optional[DatasetOptions] = None, subjects: Optional[List[str]] = None,
+                 sessions: Optional[List[str]] = None, datatypes: Optional[List[str]] = None,
+                 include_derivatives: Optional[Union[bool, List[str]]] = None):
     """Loads a dataset given its directory path on the file system.
 
     .. code-block::
@@ -54,6 +131,8 @@ def load_dataset(base_dir: str, options: Optional[DatasetOptions] = None):
         from ancpbids import load_dataset, validate_dataset
         dataset_path = 'path/to/your/dataset'
         dataset = load_dataset(dataset_path, DatasetOptions(ignore=False, infer_artifact_datatype=True))
+        # load a slice of the dataset only
+        dataset = load_dataset(dataset_path, subjects=['01', '02'], datatypes=['func'], include_derivatives=False)
 
     Parameters
     ----------
@@ -61,6 +140,14 @@ def load_dataset(base_dir: str, options: Optional[DatasetOptions] = None):
         the dataset path to load from
     options:
         the options to use, see :py:class:`DatasetOptions` class for available options
+    subjects:
+        shortcut to set :attr:`DatasetOptions.subjects`, i.e. the labels of the subjects to load
+    sessions:
+        shortcut to set :attr:`DatasetOptions.sessions`, i.e. the labels of the sessions to load
+    datatypes:
+        shortcut to set :attr:`DatasetOptions.datatypes`, i.e. the datatypes to load
+    include_derivatives:
+        shortcut to set :attr:`DatasetOptions.include_derivatives`, i.e. whether or which derivatives to load
 
     Returns
     -------
@@ -75,6 +162,11 @@ def load_dataset(base_dir: str, options: Optional[DatasetOptions] = None):
     ds.options = options
     if ds.options is None:
         ds.options = DatasetOptions()
+    slice_options = dict(subjects=subjects, sessions=sessions, datatypes=datatypes,
+                         include_derivatives=include_derivatives)
+    slice_options = {key: value for key, value in slice_options.items() if value is not None}
+    if slice_options:
+        ds.options = dataclasses.replace(ds.options, **slice_options)
     ds.name = os.path.basename(base_dir)
     ds.base_dir_ = base_dir
     dataset_plugins = get_plugins(DatasetPlugin)
@@ -89,7 +181,8 @@ def load_schema(base_dir):
     As per BIDS spec, a BIDS compliant dataset must have a BIDSVersion field in the dataset_description.json
     file at the top level. This field is used to determine which BIDS schema to load.
 
-    In case the BIDSVersion field is missing or not supported, the earliest supported schema will be returned.
+    In case the BIDSVersion field is missing or not supported, the latest supported schema will be returned.
+    The schema module is imported (and patched by any registered SchemaPlugin) on first use only.
 
     Parameters
     ----------
@@ -107,12 +200,11 @@ def load_schema(base_dir):
         if isinstance(ds_descr, dict) and 'BIDSVersion' in ds_descr:
             schema_version = ds_descr['BIDSVersion']
             schema_version = schema_version.replace('.', '_')
-            schema_name = f'ancpbids.model_v{schema_version}'
-            if schema_name in sys.modules:
-                schema = sys.modules[schema_name]
-                return schema
+            schema_name = f'model_v{schema_version}'
+            if schema_name in SCHEMA_MODULES:
+                return _get_schema_module(schema_name)
     # assume using the latest supported schema
-    return model_latest
+    return _get_schema_module(LATEST_SCHEMA_MODULE)
 
 
 def save_dataset(ds: object, target_dir: str, context_folder=None):
@@ -189,11 +281,6 @@ def write_derivative(ds, derivative):
 # load system plugins using lowest rank value
 load_plugins_by_package(plugins, ranking=0, system=True)
 
-# execute all SchemaPlugins, these plugins may monkey-patch the schema
-for pl in get_plugins(SchemaPlugin):
-    for schema in [model_v1_8_0, model_v1_9_0, model_v1_10_0]:
-        pl.execute(schema)
-
 # load file handler plugins
 for pl in get_plugins(FileHandlerPlugin):
     pl.execute(utils.FILE_READERS, utils.FILE_WRITERS)
@@ -0,0 +1,103 @@
+"""Asynchronous (asyncio) counterparts of the blocking dataset API.
+
+Directory scans and file reads are executed in a dedicated thread pool, i.e. the event loop is never blocked
+by file system I/O. The number of worker threads limits how many datasets are scanned and files are read
+concurrently, see :func:`configure`.
+
+.. code-block::
+
+    from ancpbids import aio
+
+    async def handle_request(dataset_path):
+        dataset = await aio.aload_dataset(dataset_path)
+        bold_files = await aio.aquery(dataset, suffix='bold', extension='.nii.gz')
+        metadata = await aio.aget_metadata(bold_files[0])
+        events = await aio.acontents(bold_files[0].sidecar(suffix='events', extension='.tsv')[0])
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Optional
+
+DEFAULT_MAX_WORKERS = 8
+
+_EXECUTOR = None
+_OWNS_EXECUTOR = False
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _create_executor(max_workers):
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ancpbids-aio')
+
+
+def configure(max_workers: int = DEFAULT_MAX_WORKERS, executor: Optional[Executor] = None):
+    """Sets the executor to run the blocking operations in.
+
+    Parameters
+    ----------
+    max_workers:
+        the maximum number of concurrent blocking operations (threads) if no executor is provided
+    executor:
+        optional executor to use instead of a dedicated thread pool, its lifecycle is managed by the caller
+    """
+    global _EXECUTOR, _OWNS_EXECUTOR
+    with _EXECUTOR_LOCK:
+        previous, owned = _EXECUTOR, _OWNS_EXECUTOR
+        _EXECUTOR = executor or _create_executor(max_workers)
+        _OWNS_EXECUTOR = executor is None
+    if previous is not None and owned:
+        # let pending operations finish in the background
+        previous.shutdown(wait=False)
+
+
+def get_executor() -> Executor:
+    """
+    Returns
+    -------
+        the executor running the blocking operations, a thread pool of DEFAULT_MAX_WORKERS threads if not configured
+    """
+    global _EXECUTOR, _OWNS_EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = _create_executor(DEFAULT_MAX_WORKERS)
+            _OWNS_EXECUTOR = True
+        return _EXECUTOR
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs the given blocking function in the executor and returns its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def aload_dataset(base_dir: str, options=None, **kwargs):
+    """Asynchronous variant of :func:`ancpbids.load_dataset`, accepts the same parameters."""
+    from . import load_dataset
+    return await run_blocking(load_dataset, base_dir, options, **kwargs)
+
+
+def _query(folder, **kwargs):
+    from .query import query
+    result = query(folder, **kwargs)
+    # a stream is consumed within the executor as well, iterating it would traverse the graph on the event loop
+    return list(result) if kwargs.get('stream') else result
+
+
+async def aquery(folder, **kwargs):
+    """Asynchronous variant of :func:`ancpbids.query.query`, accepts the same parameters.
+    Note that the result is fully evaluated within the executor, i.e. a list or set is returned
+    (also if `stream` is set)."""
+    return await run_blocking(_query, folder, **kwargs)
+
+
+async def aget_metadata(artifact, include_entities=False) -> dict:
+    """Asynchronous variant of ``Artifact.get_metadata()``, i.e. reads all sidecar files applying the inheritance
+    principle without blocking the event loop."""
+    return await run_blocking(artifact.get_metadata, include_entities=include_entities)
+
+
+async def acontents(file):
+    """Asynchronous variant of accessing the ``contents`` property of a JSON/TSV file (or ``load_contents()``
+    of any other file), i.e. the file is read within the executor."""
+    return await run_blocking(lambda: file.contents if 'contents' in file else file.load_contents())
@@ -0,0 +1,281 @@
+"""A registry of many datasets which can be queried at once using a combined in-memory index.
+
+.. code-block::
+
+    from ancpbids import Catalog
+
+    catalog = Catalog('path/to/ds001', 'path/to/ds002', max_workers=8)
+    for match in catalog.query(suffix='bold', extension='.nii.gz', task='rest'):
+        print(match.dataset, match.artifact.get_absolute_path())
+"""
+import os
+import re
+from fnmatch import fnmatch
+from typing import List, Union, NamedTuple, Dict, Optional
+
+from .query import FIXED_COLUMNS, Range, is_glob, normalize_criteria
+
+_SCOPE_COLUMN = 'scope_'
+_DATASET_COLUMN = 'dataset_'
+_RAW_SCOPE = 'raw'
+
+
+class CatalogMatch(NamedTuple):
+    """An artifact matched by :meth:`Catalog.query` along with the name of the dataset it is contained in."""
+    dataset: str
+    artifact: object
+
+
+class Catalog:
+    """Loads the given datasets in parallel and indexes their artifacts to allow querying all of them at once.
+
+    The criteria of a query are processed using the schema of each dataset. The index is rebuilt on next use
+    once a registered dataset was modified (see ``mark_modified()``).
+
+    Parameters
+    ----------
+    dataset_paths:
+        the paths of the datasets to load, each dataset is registered by its directory name
+    options:
+        the options to load the datasets with, see :class:`DatasetOptions <ancpbids.DatasetOptions>`
+    max_workers:
+        the maximum number of datasets to load concurrently, defaults to the number of datasets (at most 32)
+    """
+
+    def __init__(self, *dataset_paths: str, options=None, max_workers: int = None):
+        self.options = options
+        self._datasets = {}
+        # the generation of each dataset when it was indexed
+        self._generations = {}
+        # the index: one row per artifact and per column (suffix, extension, datatype, scope and entities)
+        # a dict of value to the list of rows having that value
+        self._rows = []
+        self._columns = {}
+        if dataset_paths:
+            self.add_all(dataset_paths, max_workers=max_workers)
+
+    def __len__(self):
+        self._refresh()
+        return len(self._rows)
+
+    @property
+    def datasets(self) -> Dict[str, object]:
+        """The registered datasets by their names."""
+        return dict(self._datasets)
+
+    def _get_name(self, dataset_path, name):
+        name = name or os.path.basename(os.path.normpath(dataset_path))
+        if name in self._datasets:
+            raise ValueError("A dataset named '%s' is already registered" % name)
+        return name
+
+    def add(self, dataset_path: str, name: str = None):
+        """Loads the dataset at the given path and adds it to the catalog.
+
+        Parameters
+        ----------
+        dataset_path:
+            the path of the dataset to load
+        name:
+            the name to register the dataset with, defaults to the directory name
+
+        Returns
+        -------
+            the loaded dataset
+        """
+        from . import load_dataset
+        name = self._get_name(dataset_path, name)
+        dataset = load_dataset(dataset_path, self.options)
+        self.add_dataset(dataset, name)
+        return dataset
+
+    def add_all(self, dataset_paths: List[str], max_workers: int = None):
+        """Loads the datasets at the given paths in parallel and adds them to the catalog (in the given order)."""
+        from concurrent.futures import ThreadPoolExecutor
+        from . import load_dataset
+        names = []
+        for dataset_path in dataset_paths:
+            name = self._get_name(dataset_path, None)
+            if name in names:
+                raise ValueError("A dataset named '%s' is already registered" % name)
+            names.append(name)
+        max_workers = max_workers or min(32, len(dataset_paths)) or 1
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ancpbids-catalog') as executor:
+            datasets = list(executor.map(lambda path: load_dataset(path, self.options), dataset_paths))
+        for name, dataset in zip(names, datasets):
+            self.add_dataset(dataset, name)
+
+    def add_dataset(self, dataset, name: str = None):
+        """Adds an already loaded dataset to the catalog and indexes its artifacts."""
+        name = self._get_name(dataset.base_dir_, name or dataset.name)
+        self._refresh()
+        self._datasets[name] = dataset
+        self._index_dataset(name, dataset)
+
+    def _refresh(self):
+        """Rebuilds the index if any of the datasets was modified since it was indexed."""
+        if all(getattr(dataset, 'generation_', 0) == self._generations[name]
+               for name, dataset in self._datasets.items()):
+            return
+        self._rows = []
+        self._columns = {}
+        for name, dataset in self._datasets.items():
+            self._index_dataset(name, dataset)
+
+    def _index_dataset(self, name, dataset):
+        from .query import query
+        self._generations[name] = getattr(dataset, 'generation_', 0)
+        schema = dataset.get_schema()
+
+        contexts = [(_RAW_SCOPE, dataset, _RAW_SCOPE)]
+        if dataset.derivatives:
+            contexts += [(folder.name, folder, 'all') for folder in dataset.derivatives.folders]
+        for scope, context, context_scope in contexts:
+            for artifact in query(context, scope=context_scope):
+                if not isinstance(artifact, schema.Artifact):
+                    continue
+                row = len(self._rows)
+                self._rows.append((name, artifact))
+                self._index(_DATASET_COLUMN, name, row)
+                self._index(_SCOPE_COLUMN, scope, row)
+                self._index('suffix', artifact.suffix, row)
+                self._index('extension', artifact.extension, row)
+                self._index('datatype', artifact.datatype, row)
+                for entity in artifact.entities:
+                    self._index(entity.key, entity.value, row)
+
+    def _index(self, column, value, row):
+        if value is None:
+            return
+        # values are compared as strings, the same as done by the fnmatch based query
+        value = str(value)
+        values = self._columns.get(column)
+        if values is None:
+            values = self._columns[column] = {}
+        rows = values.get(value)
+        if rows is None:
+            values[value] = rows = []
+        rows.append(row)
+
+    def get_columns(self) -> List[str]:
+        """
+        Returns
+        -------
+        list
+            the names of the indexed columns, i.e. suffix, extension, datatype and all found entity keys
+        """
+        self._refresh()
+        return [column for column in self._columns.keys() if column not in (_SCOPE_COLUMN, _DATASET_COLUMN)]
+
+    def _match_rows(self, schema, column, pattern, regex_search):
+        """Returns the set of rows having a value in the given column matching the pattern (or list of patterns)."""
+        values = self._columns.get(column, {})
+        if pattern is None:
+            # the value must not exist
+            matched = set()
+            for rows in values.values():
+                matched.update(rows)
+            return set(range(len(self._rows))) - matched
+        patterns = pattern if isinstance(pattern, list) else [pattern]
+        ranges = [p for p in patterns if isinstance(p, Range)]
+        patterns = [str(p) for p in patterns if not isinstance(p, Range)]
+        rows = set()
+        if ranges:
+            # the values are indexed as strings, ranges are matched against the processed (numeric) values
+            for value, value_rows in values.items():
+                value = schema.process_entity_value(column, value)
+                if any(r.contains(value) for r in ranges):
+                    rows.update(value_rows)
+            if not patterns:
+                return rows
+        if regex_search:
+            patterns = [re.compile(p) for p in patterns]
+            matches = lambda value: any(p.search(value) for p in patterns)
+        elif not any(is_glob(p) for p in patterns):
+            # plain values, use the index directly
+            for p in patterns:
+                rows.update(values.get(p, []))
+            return rows
+        else:
+            matches = lambda value: any(fnmatch(value, p) for p in patterns)
+        for value, value_rows in values.items():
+            if matches(value):
+                rows.update(value_rows)
+        return rows
+
+    def _scope_rows(self, scope):
+        if scope == 'all':
+            return None
+        values = self._columns.get(_SCOPE_COLUMN, {})
+        if scope == 'derivatives':
+            return {row for value, rows in values.items() if value != _RAW_SCOPE for row in rows}
+        return set(values.get(scope, []))
+
+    def query(self, return_type: str = 'object', target: str = None, scope: str = _RAW_SCOPE,
+              extension: Union[str, List[str]] = None, suffix: Union[str, List[str]] = None,
+              regex_search=False, datasets: Optional[List[str]] = None,
+              **entities) -> Union[List[CatalogMatch], List[str]]:
+        """Queries all datasets of the catalog at once using the same filter semantics as
+        :func:`ancpbids.query.query`.
+
+        Parameters
+        ----------
+        return_type:
+            Either 'object' to return :class:`CatalogMatch` tuples (dataset name and artifact),
+            'files' to return the absolute paths of matched artifacts
+            or 'id' to return the unique values of the target column
+        target:
+            the column (suffix, extension, datatype or entity) to return the unique values of, requires return_type='id'
+        scope:
+            'raw' (default) to search in raw data only, 'derivatives' to search in all derivatives,
+            'all' to search everywhere or the name of a derivatives folder (pipeline)
+        extension:
+            criterion to match any files containing the provided extension only
+        suffix:
+            criterion to match any files containing the provided suffix only
+        regex_search:
+            whether to interpret the criteria as regular expressions instead of fnmatch patterns
+        datasets:
+            optional names of the datasets to search in, defaults to all datasets
+        entities
+            a list of key-values to match the entities of interest, example: subj='02',task='lang'
+
+        Returns
+        -------
+            depending on the return_type either a list of matches, paths or unique values
+        """
+        self._refresh()
+        # the datasets to search grouped by their schema, the criteria depend on it
+        schemas = {}
+        for name, dataset in self._datasets.items():
+            if datasets is None or name in datasets:
+                schemas.setdefault(dataset.get_schema(), []).append(name)
+
+        rows = set()
+        values = set()
+        for schema, names in schemas.items():
+            criteria, schema_target = normalize_criteria(schema, return_type, target, extension, suffix, **entities)
+            row_sets = [self._match_rows(schema, column, pattern, regex_search)
+                        for column, pattern in criteria.items()]
+            scope_rows = self._scope_rows(scope)
+            if scope_rows is not None:
+                row_sets.append(scope_rows)
+            dataset_rows = self._columns.get(_DATASET_COLUMN, {})
+            row_sets.append({row for name in names for row in dataset_rows.get(name, [])})
+            schema_rows = set.intersection(*sorted(row_sets, key=len))
+            if return_type == 'id':
+                for row in schema_rows:
+                    artifact = self._rows[row][1]
+                    if schema_target in FIXED_COLUMNS:
+                        values.add(getattr(artifact, schema_target))
+                    else:
+                        values.update(entity.value for entity in artifact.entities if entity.key == schema_target)
+            else:
+                rows.update(schema_rows)
+
+        if return_type == 'id':
+            return sorted(values)
+        matches = [self._rows[row] for row in sorted(rows)]
+        if return_type and return_type.startswith('file'):
+            return [artifact.get_absolute_path() for _, artifact in matches]
+        return [CatalogMatch(name, artifact) for name, artifact in matches]
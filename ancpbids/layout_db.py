@@ -0,0 +1,375 @@
+"""A persistent SQLite index of a dataset, used by :class:`BIDSLayout <ancpbids.pybids_compat.BIDSLayout>`
+if a ``database_path`` is provided.
+
+When a dataset is indexed for the first time, its files, entities and metadata (after applying the
+inheritance principle) are written to a database file. Later layouts of the same dataset open the database
+instead of scanning the file system: ``get()`` and ``get_metadata()`` are then answered by indexed SQL queries.
+The modification times of all directories and JSON files are stored as well. If any of them changed, i.e.
+files were added, removed or edited, the database is considered stale and rebuilt.
+
+.. code-block::
+
+    layout = BIDSLayout('path/to/your/dataset', database_path='path/to/index')
+    # later, for example in another process, no directory scan is involved
+    layout = BIDSLayout('path/to/your/dataset', database_path='path/to/index')
+    bold_files = layout.get(sub='01', suffix='bold', return_type='files')
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from fnmatch import fnmatch
+from typing import Union, List, Optional, Iterator
+
+from .query import Range, is_glob, normalize_criteria, normalize_target
+
+DATABASE_FILE_NAME = 'layout_index.sqlite'
+# the number of rows fetched at once when streaming query results
+_STREAM_PAGE_SIZE = 1000
+_FORMAT_VERSION = '2'
+
+_CREATE_TABLES = """
+DROP TABLE IF EXISTS info;
+DROP TABLE IF EXISTS files;
+DROP TABLE IF EXISTS entities;
+DROP TABLE IF EXISTS metadata;
+DROP TABLE IF EXISTS mtimes;
+CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, artifact INTEGER, raw INTEGER,
+                    suffix TEXT, extension TEXT, datatype TEXT);
+CREATE TABLE entities (file_id INTEGER, key TEXT, value TEXT, first INTEGER);
+CREATE TABLE metadata (file_id INTEGER, key TEXT, value TEXT);
+CREATE TABLE mtimes (path TEXT PRIMARY KEY, mtime_ns INTEGER);
+CREATE INDEX files_suffix ON files (suffix);
+CREATE INDEX files_extension ON files (extension);
+CREATE INDEX entities_file ON entities (file_id);
+CREATE INDEX entities_key_value ON entities (key, value);
+CREATE INDEX metadata_file ON metadata (file_id);
+"""
+
+
+def get_database_file(database_path: str) -> str:
+    """Returns the path of the database file: the given path itself if it has a file extension,
+    else the path is considered a directory (same as pybids does) containing a file named `layout_index.sqlite`."""
+    if os.path.isdir(database_path) or not os.path.splitext(database_path)[1]:
+        return os.path.join(database_path, DATABASE_FILE_NAME)
+    return database_path
+
+
+def _fnmatch(value, pattern):
+    return fnmatch(str(value), pattern)
+
+
+def _regexp(pattern, value):
+    return re.search(pattern, str(value)) is not None
+
+
+def _is_index_entity(schema, key):
+    return any(e.value['name'] == key and e.value['format'] == 'index' for e in schema.EntityEnum)
+
+
+def _range_condition(column, value_range: Range, params):
+    # index values are stored as integers without padding, other values never match a range
+    conditions = ["%s GLOB '[0-9]*'" % column, "%s NOT GLOB '*[^0-9]*'" % column]
+    if value_range.low is not None:
+        conditions.append('CAST(%s AS INTEGER) %s ?' % (column, '>=' if value_range.low_inclusive else '>'))
+        params.append(value_range.low)
+    if value_range.high is not None:
+        conditions.append('CAST(%s AS INTEGER) %s ?' % (column, '<=' if value_range.high_inclusive else '<'))
+        params.append(value_range.high)
+    return '(%s)' % ' AND '.join(conditions)
+
+
+class LayoutDatabase:
+    """An SQLite database containing the files, entities and metadata of a dataset.
+
+    Parameters
+    ----------
+    database_path:
+        either the path of the database file or a directory to create a `layout_index.sqlite` file in
+    """
+
+    def __init__(self, database_path: str):
+        self.path = get_database_file(database_path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.create_function('fnmatch', 2, _fnmatch, deterministic=True)
+        self._connection.create_function('regexp', 2, _regexp, deterministic=True)
+        self._info = None
+
+    def close(self):
+        """Closes the connection to the database file."""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def get_info(self) -> dict:
+        """Returns the properties of the indexed dataset (format version, schema name, base dir, root path),
+        an empty dict if the database is not populated."""
+        if self._info is None:
+            try:
+                self._info = dict(self._execute('SELECT key, value FROM info'))
+            except sqlite3.OperationalError:
+                # no tables yet
+                return {}
+        return self._info
+
+    def get_schema(self):
+        """
+        Returns
+        -------
+            the schema module the indexed dataset was loaded with
+        """
+        import ancpbids
+        return getattr(ancpbids, self.get_info()['schema'])
+
+    def is_stale(self, base_dir: str) -> bool:
+        """Checks whether the database needs to be (re)built for the dataset at the given directory.
+
+        The database is stale if it is not populated, was built for another dataset directory or if
+        any of the indexed directories or JSON files has been modified, removed or replaced since.
+        """
+        info = self.get_info()
+        if info.get('version') != _FORMAT_VERSION or info.get('base_dir') != os.path.abspath(base_dir):
+            return True
+        for path, mtime_ns in self._execute('SELECT path, mtime_ns FROM mtimes'):
+            try:
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def build(self, dataset):
+        """(Re)populates the database from the given loaded dataset."""
+        from .query import query
+        schema = dataset.get_schema()
+        root = dataset.get_absolute_path()
+        raw_files = {id(file) for file in query(dataset, scope='raw')}
+
+        files, entities, metadata = [], [], []
+        mtimes = {root: os.stat(root).st_mtime_ns}
+        bidsignore = os.path.join(root, '.bidsignore')
+        if os.path.isfile(bidsignore):
+            mtimes[bidsignore] = os.stat(bidsignore).st_mtime_ns
+        for node in dataset.to_generator():
+            if isinstance(node, schema.Folder):
+                path = node.get_absolute_path()
+                mtimes[path] = os.stat(path).st_mtime_ns
+                continue
+            if not isinstance(node, schema.File):
+                continue
+            file_id = len(files) + 1
+            path = node.get_absolute_path()
+            if node.name.endswith('.json'):
+                mtimes[path] = os.stat(path).st_mtime_ns
+            if not isinstance(node, schema.Artifact):
+                files.append((file_id, path, 0, id(node) in raw_files, None, None, None))
+                continue
+            files.append((file_id, path, 1, id(node) in raw_files, node.suffix, node.extension, node.datatype))
+            # queries match the first value of a repeated entity key only
+            keys = set()
+            for entity in node.entities:
+                entities.append((file_id, entity.key, str(entity.value), entity.key not in keys))
+                keys.add(entity.key)
+            metadata += [(file_id, key, json.dumps(value)) for key, value in node.get_metadata().items()]
+
+        info = {
+            'version': _FORMAT_VERSION,
+            'schema': schema.__name__.rsplit('.', 1)[-1],
+            'base_dir': os.path.abspath(dataset.base_dir_),
+            'root': root,
+        }
+        with self._lock:
+            connection = self._connection
+            connection.executescript(_CREATE_TABLES)
+            with connection:
+                connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', files)
+                connection.executemany('INSERT INTO entities VALUES (?, ?, ?, ?)', entities)
+                connection.executemany('INSERT INTO metadata VALUES (?, ?, ?)', metadata)
+                connection.executemany('INSERT INTO mtimes VALUES (?, ?)', mtimes.items())
+                # written last: an interrupted build leaves a database which is considered stale
+                connection.executemany('INSERT INTO info VALUES (?, ?)', info.items())
+        self._info = info
+
+    def _get_path(self, path):
+        return os.path.normpath(os.path.join(self.get_info()['root'], path))
+
+    def get_metadata(self, path: str, include_entities=False) -> Optional[dict]:
+        """Returns the metadata of the artifact at the given (absolute or dataset relative) path,
+        same as ``Artifact.get_metadata()``.
+
+        Returns
+        -------
+            the metadata dict or None if the path does not refer to an indexed artifact
+        """
+        rows = self._execute('SELECT id FROM files WHERE path = ? AND artifact = 1', (self._get_path(path),))
+        if not rows:
+            return None
+        file_id = rows[0][0]
+        metadata = {key: json.loads(value) for key, value in
+                    self._execute('SELECT key, value FROM metadata WHERE file_id = ? ORDER BY rowid', (file_id,))}
+        if include_entities:
+            schema = self.get_schema()
+            schema_entities = {e.value['name']: e.name for e in list(schema.EntityEnum)}
+            metadata.update({schema_entities[key]: schema.process_entity_value(key, value) for key, value in
+                             self._execute('SELECT key, value FROM entities WHERE file_id = ? ORDER BY rowid',
+                                           (file_id,))})
+        return metadata
+
+    @staticmethod
+    def _value_condition(column, patterns, regex_search, params, index=False):
+        conditions = []
+        for pattern in patterns:
+            if isinstance(pattern, Range):
+                conditions.append(_range_condition(column, pattern, params) if index else '0')
+                continue
+            pattern = str(pattern)
+            if regex_search:
+                conditions.append('regexp(?, %s)' % column)
+            elif is_glob(pattern):
+                conditions.append('fnmatch(%s, ?)' % column)
+            else:
+                conditions.append('%s = ?' % column)
+            params.append(pattern)
+        return '(%s)' % ' OR '.join(conditions)
+
+    def query(self, return_type: str = 'files', target: str = None, scope: str = None,
+              extension: Union[str, List[str]] = None, suffix: Union[str, List[str]] = None,
+              regex_search=False, limit: int = None, offset: int = 0, stream: bool = False,
+              **entities) -> Union[List[str], List[object], Iterator[str], None]:
+        """Queries the indexed files using the same filter semantics as :func:`ancpbids.query.query`.
+
+        Parameters
+        ----------
+        return_type:
+            Either 'files' to return the absolute paths of matched files
+            or 'id' to return the unique values of the target
+        target:
+            Either `suffixes`, `extensions`, `datatype` or one of any valid BIDS entities key, requires return_type='id'
+        scope:
+            'raw' (default), 'all' or the path of a folder relative to the dataset root, for example 'derivatives'
+        extension:
+            criterion to match any files containing the provided extension only
+        suffix:
+            criterion to match any files containing the provided suffix only
+        regex_search:
+            whether to interpret the criteria as regular expressions instead of fnmatch patterns
+        limit:
+            the maximum number of paths to return, requires return_type='files'
+        offset:
+            the number of matched paths to skip
+        stream:
+            whether to return an iterator yielding the matched paths, fetched from the database page by page
+
+        Returns
+        -------
+            depending on the return_type either a list of paths or unique values,
+            None if the scope does not refer to an existing folder
+        """
+        if return_type == 'id' and not target:
+            raise ValueError("return_type=id requires the target parameter to be set")
+        offset = offset or 0
+        paginate = limit is not None or offset or stream
+        if paginate:
+            if return_type == 'id':
+                raise ValueError("limit, offset and stream require return_type 'files'")
+            if (limit is not None and limit < 0) or offset < 0:
+                raise ValueError("limit and offset must not be negative")
+        schema = self.get_schema()
+        scope = scope or 'raw'
+        clauses, params = [], []
+        if scope == 'raw':
+            clauses.append('f.raw = 1')
+        elif scope != 'all':
+            scope_path = self._get_path(scope)
+            if not self._execute('SELECT 1 FROM mtimes WHERE path = ?', (scope_path,)):
+                return iter(()) if stream else None
+            clauses.append('substr(f.path, 1, ?) = ?')
+            params += [len(scope_path) + 1, scope_path + os.sep]
+
+        datatype = entities.pop('datatype', None)
+        target_column = None
+        if target:
+            target = normalize_target(schema, target)
+            if target == 'datatype':
+                datatype = '*'
+                target_column = 'datatype'
+            elif target == 'suffix':
+                suffix = '*'
+                target_column = 'suffix'
+            elif target == 'extension':
+                extension = '*'
+                target_column = 'extension'
+            else:
+                entities = {**entities, target: '*'}
+
+        criteria, _ = normalize_criteria(schema, extension=extension, suffix=suffix, **entities)
+        extension = criteria.pop('extension', None)
+        suffix = criteria.pop('suffix', None)
+        for key, v in criteria.items():
+            clauses.append('f.artifact = 1')
+            if v is None:
+                # the entity must not exist
+                clauses.append('NOT EXISTS (SELECT 1 FROM entities e WHERE e.file_id = f.id AND e.key = ?)')
+                params.append(key)
+                continue
+            params.append(key)
+            condition = self._value_condition('e.value', v if isinstance(v, list) else [v], regex_search, params,
+                                              _is_index_entity(schema, key))
+            clauses.append('EXISTS (SELECT 1 FROM entities e WHERE e.file_id = f.id AND e.key = ? AND e.first = 1 '
+                           'AND %s)' % condition)
+
+        for column, value in [('extension', extension), ('suffix', suffix), ('datatype', datatype)]:
+            if not value:
+                continue
+            clauses.append('f.artifact = 1')
+            clauses.append(self._value_condition('f.' + column, value if isinstance(value, list) else [value],
+                                                 regex_search, params))
+
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        if return_type == 'id':
+            if target_column:
+                sql = 'SELECT DISTINCT f.%s FROM files f%s' % (target_column, where)
+                return sorted(value for value, in self._execute(sql, params) if value)
+            sql = 'SELECT DISTINCT e.value FROM files f JOIN entities e ON e.file_id = f.id AND e.key = ? ' \
+                  'AND e.first = 1' + where
+            values = self._execute(sql, [target] + params)
+            return sorted({schema.process_entity_value(target, value) for value, in values})
+        if stream:
+            return self._iter_paths(clauses, params, limit, offset)
+        sql = 'SELECT f.path FROM files f%s ORDER BY f.id' % where
+        if paginate:
+            # a negative limit means no limit
+            sql += ' LIMIT ? OFFSET ?'
+            params = params + [-1 if limit is None else limit, offset]
+        return [path for path, in self._execute(sql, params)]
+
+    def _iter_paths(self, clauses, params, limit, offset):
+        """Yields the paths of the matched files page by page, i.e. continuing after the last fetched row id."""
+        sql = 'SELECT f.id, f.path FROM files f WHERE %s ORDER BY f.id LIMIT ? OFFSET ?' % ' AND '.join(
+            clauses + ['f.id > ?'])
+        last_id = -1
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = _STREAM_PAGE_SIZE if remaining is None else min(remaining, _STREAM_PAGE_SIZE)
+            rows = self._execute(sql, params + [last_id, page_size, offset])
+            offset = 0
+            for last_id, path in rows:
+                yield path
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < page_size:
+                break
@@ -1,10 +1,17 @@
 import importlib
 import inspect
 import pkgutil
+import threading
 from typing import List
 
 # global plugins registry (list of plugin metadata/settings)
 __PLUGINS__ = []
+# ranked registry entries per requested plugin class, reset whenever a plugin is registered
+__PLUGINS_CACHE__ = {}
+# schema modules the registered SchemaPlugins have been executed on, by module name
+__PATCHED_SCHEMAS__ = {}
+# guards patching schema modules and registering SchemaPlugins
+__SCHEMA_LOCK__ = threading.RLock()
 
 
 class Plugin:
@@ -160,15 +167,56 @@ def register_plugin(plugin_class, ranking: int = 1000, **props):
     props
         Additional (static) properties to attach to the provided plugin class.
 
+    Notes
+    -----
+    Schema modules are patched lazily on first use. A SchemaPlugin registered after a schema module
+    has been patched is executed on that schema module right away.
     """
     if not is_valid_plugin(plugin_class):
         raise ValueError('Invalid plugin class: %s' % plugin_class.__name__)
 
-    __PLUGINS__.append({
+    entry = {
         'ranking': ranking,
         'plugin_class': plugin_class,
         'props': props
-    })
+    }
+    if not issubclass(plugin_class, SchemaPlugin):
+        __PLUGINS__.append(entry)
+        __PLUGINS_CACHE__.clear()
+        return
+
+    # hold the schema lock so that a schema module being patched concurrently sees the plugin exactly once
+    with __SCHEMA_LOCK__:
+        __PLUGINS__.append(entry)
+        __PLUGINS_CACHE__.clear()
+        if __PATCHED_SCHEMAS__:
+            plugin = plugin_class(**props)
+            for module_name in sorted(__PATCHED_SCHEMAS__):
+                plugin.execute(__PATCHED_SCHEMAS__[module_name])
+
+
+def patch_schema(schema):
+    """Executes all registered SchemaPlugins on the given schema module, once per module.
+    SchemaPlugins registered afterwards are executed on it when they are registered, see :func:`register_plugin`.
+
+    Parameters
+    ----------
+    schema:
+        the schema module to patch
+
+    Returns
+    -------
+        the patched schema module
+    """
+    if schema.__name__ in __PATCHED_SCHEMAS__:
+        return schema
+    with __SCHEMA_LOCK__:
+        if schema.__name__ not in __PATCHED_SCHEMAS__:
+            # SchemaPlugins may monkey-patch the schema
+            for pl in get_plugins(SchemaPlugin):
+                pl.execute(schema)
+            __PATCHED_SCHEMAS__[schema.__name__] = schema
+    return schema
 
 
 def get_plugins(plugin_class, **props) -> List[Plugin]:
@@ -185,7 +233,10 @@ def get_plugins(plugin_class, **props) -> List[Plugin]:
     -------
         a list of plugin instances matching the provided plugin class and properties
     """
-    plugins = filter(lambda entry: issubclass(entry['plugin_class'], plugin_class), __PLUGINS__)
-    plugins = sorted(plugins, key=lambda entry: entry['ranking'])
+    plugins = __PLUGINS_CACHE__.get(plugin_class)
+    if plugins is None:
+        plugins = filter(lambda entry: issubclass(entry['plugin_class'], plugin_class), __PLUGINS__)
+        plugins = sorted(plugins, key=lambda entry: entry['ranking'])
+        __PLUGINS_CACHE__[plugin_class] = plugins
     # note that a concrete instance of the plugin classes is returned
     return list(map(lambda entry: entry['plugin_class'](**entry['props']), plugins))
@@ -1,49 +1,39 @@
-import fnmatch
-import inspect
+import functools
 import os
 import re
 
 from .plugin_files_handlers import read_plain_text
 from .. import utils
 from ..plugin import DatasetPlugin
+from ..traversal import walk
 from ..model_base import *
 
+# file types to use for files with special handling, depending on whether the name follows the BIDS naming scheme
+_FILE_TYPES = {
+    '.json': (MetadataArtifact, MetadataFile),
+    '.tsv': (TSVArtifact, TSVFile),
+}
+
+
 class DatasetPopulationPlugin(DatasetPlugin):
 
     def execute(self, dataset, schema):
         base_dir = str(dataset.base_dir_)
         self.schema = schema
         self.options = dataset.options
+        self._member_rules = {}
+        # processed entity values by (key, raw value), the same entities repeat across many files
+        self._entity_values = {}
         self._load_bidsignore(base_dir)
+        self._load_slice()
 
-        # load file system structure
-        self._load_folder(dataset, base_dir, base_dir)
-        # transform files to artifacts, i.e. files containing entities in their name
-        self._convert_files_to_artifacts(dataset)
-
-        # handle special files
-        self._handle_metadata_files(dataset)
-        self._handle_tsv_files(dataset)
-
-        # expand structure based on schema-files
-        self._expand_members(dataset)
-        # convert Folders within derivatives to DerivativeFolder
-        self._convert_derivatives_folders(dataset.derivatives)
-
-        # do optional stuff
-        self._determine_artifact_datatype(dataset)
-
-    def _determine_artifact_datatype(self, dataset):
-        if not self.options.infer_artifact_datatype:
-            return
-        datatype_folders = dataset.select(DatatypeFolder).objects()
-        for folder in datatype_folders:
-            artifacts = folder.select(Artifact).objects()
-            for artifact in artifacts:
-                artifact.datatype = folder.name
+        # load file system structure in a single traversal: each directory entry is classified once,
+        # i.e. files are converted to their (BIDS) file types and files/folders are assigned
+        # to the members of their parent folder as declared by the schema
+        self._load_folder(dataset, base_dir, '', Folder, None)
 
     def _load_bidsignore(self, base_dir):
-        self.bidsignore = lambda relative_path: False
+        self.bidsignore = lambda relative_path, is_dir=False: False
         if self.options.ignore:
             patterns = []
             if isinstance(self.options.ignore, bool):
@@ -54,195 +44,208 @@ class DatasetPopulationPlugin(DatasetPlugin):
                 patterns = self.options.ignore
 
             if patterns:
-                patterns = list(map(lambda pattern: pattern.strip(), patterns))
-                # TODO cleanup invalid filter such as empty lines or comments
-                self.bidsignore = lambda relative_path: next(
-                    filter(lambda pattern: fnmatch.fnmatch(relative_path, pattern), patterns), False)
+                self.bidsignore = utils.compile_ignore_patterns(patterns)
 
-    def _handle_metadata_files(self, folder):
-        if not isinstance(folder, Folder):
-            return
-        for file in filter(lambda f: f.name.endswith(".json"), folder.files):
-            if isinstance(file, Artifact):
-                mdfile = MetadataArtifact()
-            else:
-                mdfile = MetadataFile()
-            mdfile.parent_object_ = folder
-            mdfile.update(file)
-            # When ``load_contents`` is False we keep contents unloaded until
-            # the ``contents`` property is accessed (lazy loading).
-            if self.options.load_contents:
-                mdfile.contents = mdfile.load_contents()
-            folder.files.remove(file)
-            folder.files.append(mdfile)
+    def _load_slice(self):
+        def _to_names(values, prefix=''):
+            if values is None:
+                return None
+            if isinstance(values, str):
+                values = [values]
+            return {value if value.startswith(prefix) else prefix + value for value in map(str, values)}
 
-        for child in folder.folders:
-            self._handle_metadata_files(child)
+        self.subjects = _to_names(self.options.subjects, 'sub-')
+        self.sessions = _to_names(self.options.sessions, 'ses-')
+        self.datatypes = _to_names(self.options.datatypes)
+        # datatype folders within derivatives are plain derivative folders, recognized by their names
+        self.datatype_names = {e.value['value'] for e in self.schema.DatatypeEnum}
+        include_derivatives = self.options.include_derivatives
+        self.derivatives = include_derivatives if isinstance(include_derivatives, bool) else _to_names(
+            include_derivatives)
 
-    def _handle_tsv_files(self, folder):
-        if not isinstance(folder, Folder):
-            return
-        for file in filter(lambda f: f.name.endswith(".tsv"), folder.files):
-            if isinstance(file, Artifact):
-                newfile = TSVArtifact()
-            else:
-                newfile = TSVFile()
-            newfile.parent_object_ = folder
-            newfile.update(file)
-            # Defer reading large TSV files unless eager loading was requested
-            if self.options.load_contents:
-                newfile.contents = newfile.load_contents()
-            folder.files.remove(file)
-            folder.files.append(newfile)
+    def _in_slice(self, parent, directory, member, typ, folder_type):
+        """Returns whether the given directory is part of the requested slice of the dataset, see DatasetOptions."""
+        if isinstance(parent, Dataset):
+            if member == 'derivatives':
+                return self.derivatives is not False
+            # dataset-level folders (code, phenotype, stimuli, sourcedata, ...) are not subject-scoped
+            if not issubclass(typ, Subject):
+                return True
+        elif folder_type is DerivativeFolder and not isinstance(parent, DerivativeFolder):
+            # a pipeline folder within the derivatives folder
+            if not isinstance(self.derivatives, bool) and directory not in self.derivatives:
+                return False
+        # subject/session folders within derivatives are matched by their names
+        if self.subjects is not None and directory.startswith('sub-') and issubclass(typ, (Subject, DerivativeFolder)):
+            return directory in self.subjects
+        if self.sessions is not None and directory.startswith('ses-') and issubclass(typ, (SessionFolder,
+                                                                                           DerivativeFolder)):
+            return directory in self.sessions
+        if self.datatypes is not None:
+            if issubclass(typ, DatatypeFolder):
+                return directory in self.datatypes
+            # datatype folders within derivative subject/session folders
+            if issubclass(typ, DerivativeFolder) and isinstance(parent, DerivativeFolder) \
+                    and parent.name.startswith(('sub-', 'ses-')) and directory in self.datatype_names:
+                return directory in self.datatypes
+        return True
 
-        for child in folder.folders:
-            self._handle_tsv_files(child)
+    def _get_member_rules(self, folder_type):
+        """Returns the rules to assign directory entries to the members of the given folder type.
 
-    def _convert_derivatives_folders(self, parent):
-        if not parent:
-            return
-        for i, folder in enumerate(list(parent.folders)):
-            dfolder = DerivativeFolder()
-            dfolder.parent_object_ = parent
-            dfolder.update(folder)
-            parent.folders[i] = dfolder
-            self._convert_derivatives_folders(dfolder)
-            self._expand_members(dfolder)
-
-    def _convert_files_to_artifacts(self, parent):
-        for i, file in enumerate(parent.files):
-            artifact = self._convert_to_artifact(file)
-            if not artifact:
-                continue
-            artifact.parent_object_ = parent
-            parent.files[i] = artifact
-        for folder in parent.folders:
-            self._convert_files_to_artifacts(folder)
-
-    def _convert_to_artifact(self, file):
-        parts = utils.parse_bids_name(file.name)
-        if not parts:
-            return None
-        artifact = Artifact()
-        artifact.name = file.name
-        for key, value in parts['entities'].items():
-            entity = EntityRef()
-            entity.key = key
-            value = self.schema.process_entity_value(key, value)
-            entity.value = value
-            artifact.entities.append(entity)
-        artifact.suffix = parts['suffix']
-        artifact.extension = parts['extension']
-        return artifact
-
-    def _handle_direct_folders(self, parent, member, pattern, new_type):
-        if not isinstance(parent, Folder):
-            return
-        parent_folders = parent.get_folders_sorted()
-        folders = list(filter(lambda f: re.match(pattern, f.name), parent_folders))
-        for folder in folders:
-            obj = new_type()
-            obj.name = folder.name
-            obj.files = folder.files
-            for ofile in obj.files:
-                ofile.parent_object_ = obj
-            obj.folders = folder.folders
-            for ofolder in obj.folders:
-                ofolder.parent_object_ = obj
-            parent.remove_folder(folder.name)
-            obj.parent_object_ = parent
-            if member['max'] > 1:
-                getattr(parent, member['name']).append(obj)
-            else:
-                setattr(parent, member['name'], obj)
-            self._expand_members(obj)
+        Folder rules are checked in order of the member declarations, i.e. the first matching member wins.
+        File rules are looked up by the exact file name.
+        """
+        rules = self._member_rules.get(folder_type)
+        if rules is not None:
+            return rules
+        folder_rules = []
+        file_rules = {}
+        # plain folders (for example code, sourcedata) do not get their members expanded
+        if folder_type is not Folder:
+            for member in self.schema.get_members(folder_type):
+                name = member['name']
+                typ = member['type']
+                if name in ('files', 'folders') or not isinstance(typ, type) or not issubclass(typ, Model):
+                    continue
+                meta = member['meta']
+                multi = member['max'] > 1
+                if issubclass(typ, Folder):
+                    if typ is Folder:
+                        # plain folder members are matched by their name
+                        pattern = re.compile(re.escape(name) + r'\Z')
+                    else:
+                        pattern = re.compile(meta.get('name_pattern', '.*'))
+                    folder_rules.append((pattern, name, typ, multi))
+                elif issubclass(typ, JsonFile):
+                    # JSON files can be large; only map them to their member type if eager loading
+                    # was requested via ``DatasetOptions.load_contents``
+                    if self.options.load_contents:
+                        file_rules[name + '.json'] = (name, typ, multi)
+                elif typ is File:
+                    file_rules[meta.get('name_pattern', name)] = (name, typ, multi)
+        rules = self._member_rules[folder_type] = (folder_rules, file_rules)
+        return rules
 
-    def _expand_member(self, parent, member):
-        typ = member['type']
-        if not issubclass(typ, Model):
-            return
-        mapper_name = '_type_handler_%s' % typ.__name__
-        if mapper_name not in _TYPE_MAPPERS:
-            mapper_name = '_type_handler_default'
-        mapper = _TYPE_MAPPERS[mapper_name]
-        mapper(self, parent, member)
+    def _load_folder(self, parent, dir_path, rel_path, folder_type, datatype):
+        # the directory tree is loaded iteratively: scanning a directory returns the sub-directories to load next
+        for _ in walk((parent, dir_path, rel_path, folder_type, datatype), self._scan_folder):
+            pass
 
-    def _expand_members(self, folder):
-        members = self.schema.get_members(type(folder))
-        for member in members:
-            self._expand_member(folder, member)
+    def _scan_folder(self, load_args):
+        """Adds the files and folders of a directory to the given parent folder.
 
-    def _load_folder(self, parent, dir_path, ds_path):
-        for root, directories, files in os.walk(dir_path):
-            rel_base = root[len(ds_path):]
-            for directory in sorted(directories):
-                directory_ds_rel_path = '/'.join([rel_base, directory])[1:]
-                if self.bidsignore(directory_ds_rel_path):
-                    continue
-                folder = Folder()
-                folder.parent_object_ = parent
-                folder.name = directory
-                parent.folders.append(folder)
-                self._load_folder(folder, '/'.join([root, directory]), ds_path)
-            for file in sorted(files):
-                file_ds_rel_path = '/'.join([rel_base, file])[1:]
-                if self.bidsignore(file_ds_rel_path):
-                    continue
-                model_file = File()
-                model_file.parent_object_ = parent
-                model_file.name = file
-                parent.files.append(model_file)
-            # do not traverse into sub-dirs as they have been already processed recursively
-            break
+        Returns
+        -------
+            the arguments to load the sub-directories with, except for lazily loaded ones
+        """
+        parent, dir_path, rel_path, folder_type, datatype = load_args
+        sub_folders = []
+        try:
+            with os.scandir(dir_path) as it:
+                entries = [(entry.name, entry.is_dir()) for entry in it]
+        except OSError:
+            return sub_folders
+        folder_rules, file_rules = self._get_member_rules(type(parent))
 
-    def _type_handler_default(self, parent, member):
-        typ = member['type']
-        if issubclass(typ, JsonFile):
-            self._type_handler_JsonFile(parent, member, True)
-        elif issubclass(typ, Folder):
-            pattern = '.*'
-            meta = member['meta']
-            if 'name_pattern' in meta:
-                pattern = meta['name_pattern']
-            self._handle_direct_folders(parent, member, pattern=pattern, new_type=typ)
-
-    def _type_handler_File(self, parent, member):
-        if not isinstance(parent, Folder):
-            return
-        file_name = member['name']
-        meta = member['meta']
-        if 'name_pattern' in meta:
-            file_name = meta['name_pattern']
-        file = parent.get_file(file_name)
-        if file:
-            setattr(parent, member['name'], file)
-            parent.remove_file(file.name)
+        for directory in sorted(name for name, is_dir in entries if is_dir):
+            directory_ds_rel_path = '/'.join([rel_path, directory]) if rel_path else directory
+            # an ignored directory is not traversed at all
+            if self.bidsignore(directory_ds_rel_path, True):
+                continue
+            member, typ, multi = next(((name, typ, multi) for pattern, name, typ, multi in folder_rules
+                                       if pattern.match(directory)), (None, folder_type, True))
+            if not self._in_slice(parent, directory, member, typ, folder_type):
+                continue
+            folder = typ()
+            folder.name = directory
+            folder.parent_object_ = parent
+            self._add_member(parent, folder, member, multi)
+            # all folders within the derivatives folder are derivative folders
+            if isinstance(folder, DerivativeFolder) or (isinstance(parent, Dataset) and member == 'derivatives'):
+                sub_folder_type = DerivativeFolder
+            else:
+                sub_folder_type = Folder
+            # artifacts within a datatype folder (or any sub-folder of it) inherit its name as datatype
+            sub_datatype = directory if isinstance(folder, DatatypeFolder) else datatype
+            load_args = (folder, os.path.join(dir_path, directory), directory_ds_rel_path, sub_folder_type,
+                         sub_datatype)
+            if self.options.lazy_subtrees and isinstance(folder, (Subject, DerivativeFolder)):
+                # defer scanning the folder until its contents are accessed
+                folder.lazy_loader_ = functools.partial(self._load_folder, *load_args)
+            else:
+                sub_folders.append(load_args)
 
-    def _type_handler_Artifact(self, parent, member):
-        if not isinstance(parent, Folder):
-            return
-        attr = getattr(parent, member['name'])
-        multi = isinstance(attr, list)
-        name = member['name']
-        files = parent.files if multi else list(filter(lambda f: f.name == name, parent.files))
-        for file in files:
-            if not isinstance(file, Artifact):
+        file_names = sorted(name for name, is_dir in entries if not is_dir)
+        # the names of all files of the directory are parsed at once
+        columns = utils.parse_bids_names(file_names)
+        for row, file_name in enumerate(file_names):
+            file_ds_rel_path = '/'.join([rel_path, file_name]) if rel_path else file_name
+            if self.bidsignore(file_ds_rel_path):
                 continue
+            file = self._create_file(file_name, columns, row)
             file.parent_object_ = parent
-            parent.remove_file(file.name)
-            if multi:
-                attr.append(file)
+            if datatype and self.options.infer_artifact_datatype and isinstance(file, Artifact):
+                file.datatype = datatype
+            # When ``load_contents`` is False we keep contents unloaded until
+            # the ``contents`` property is accessed (lazy loading).
+            if self.options.load_contents and 'contents' in file:
+                file.contents = file.load_contents()
+            member, typ, multi = file_rules.get(file_name, (None, None, True))
+            if member is not None and issubclass(typ, JsonFile):
+                json_object = file.contents
+                if json_object:
+                    json_file = self._map_object(typ, json_object)
+                    json_file.name = file_name
+                    json_file.contents = json_object
+                    json_file.parent_object_ = parent
+                    file = json_file
+                else:
+                    member = None
+            self._add_member(parent, file, member, multi)
+        return sub_folders
+
+    def _add_member(self, parent, child, member, multi):
+        if member is None:
+            if isinstance(child, Folder):
+                parent.folders.append(child)
             else:
-                setattr(parent, member['name'], file)
+                parent.files.append(child)
+        elif multi:
+            getattr(parent, member).append(child)
+        else:
+            setattr(parent, member, child)
 
-    def _type_handler_Folder(self, parent, member):
-        if not isinstance(parent, Folder):
-            return
-        name = member['name']
-        folder = parent.get_folder(name)
-        if folder:
-            setattr(parent, name, folder)
-            parent.remove_folder(name)
+    def _create_file(self, file_name, columns, row):
+        """Creates the file of the given name, columns are the parsed names of the directory,
+        see :func:`parse_bids_names <ancpbids.utils.parse_bids_names>`."""
+        # files containing entities in their name are artifacts
+        keys = columns['keys'][row]
+        artifact_type, file_type = Artifact, File
+        for extension, types in _FILE_TYPES.items():
+            if file_name.endswith(extension):
+                artifact_type, file_type = types
+                break
+        if keys is None:
+            file = file_type()
+            file.name = file_name
+            return file
+        artifact = artifact_type()
+        artifact.name = file_name
+        entity_values = self._entity_values
+        entity_columns = columns['entities']
+        for key in keys:
+            value = entity_columns[key][row]
+            entity = EntityRef()
+            entity.key = key
+            if (key, value) not in entity_values:
+                entity_values[(key, value)] = self.schema.process_entity_value(key, value)
+            entity.value = entity_values[(key, value)]
+            entity.parent_object_ = artifact
+            artifact.entities.append(entity)
+        artifact.suffix = columns['suffix'][row]
+        artifact.extension = columns['extension'][row]
+        return artifact
 
     def _map_object(self, model_type, json_object):
         target = model_type()
@@ -259,27 +262,3 @@ class DatasetPopulationPlugin(DatasetPlugin):
                     value = self._map_object(value_type, value)
                 setattr(target, prop_name, value)
         return target
-
-    def _type_handler_JsonFile(self, parent, member, is_subclass=False):
-        name = member['name']
-        file_name = name + '.json'
-        file = parent.get_file(file_name)
-        if not file:
-            return
-        json_object = None
-        # JSON files can be large; only read them immediately if eager loading
-        # was requested via ``DatasetOptions.load_contents``
-        if self.options.load_contents:
-            json_object = file.load_contents()
-        if json_object:
-            model_type = member['type']
-            json_file = self._map_object(model_type, json_object)
-            json_file.name = file_name
-            json_file.contents = json_object
-            setattr(parent, member['name'], json_file)
-            parent.remove_file(file_name)
-            json_file.parent_object_ = parent
-
-
-_TYPE_MAPPERS = {name: obj for name, obj in inspect.getmembers(DatasetPopulationPlugin) if
-                 inspect.isfunction(obj) and obj.__name__.startswith('_type_handler_')}
@@ -1,12 +1,17 @@
+import copy
 import fnmatch
 import inspect
+import itertools
 import math
 import os
 import sys
+import threading
+import types
 from difflib import SequenceMatcher
 
 from ancpbids.plugin import SchemaPlugin
-from ancpbids.query import Select, query, query_entities
+from ancpbids.query import Select, query, query_many, query_entities, get_dataset, get_query_cache, get_entity_index
+from ancpbids.traversal import walk
 from ancpbids.utils import resolve_segments, convert_to_relative
 from ancpbids.model_base import *
 
@@ -29,11 +34,14 @@ def add_entity(schema, artifact, key, value):
     if isinstance(key, schema.EntityEnum):
         key = key.entity_
 
+    # entities do not affect the paths of the graph
+    _modified(artifact, lambda table: None)
     found = list(filter(lambda er: er.key == key, artifact.entities))
     if found:
         found[0].value = value
     else:
         eref = EntityRef(key, value)
+        eref.parent_object_ = artifact
         artifact.entities.append(eref)
 
 
@@ -96,7 +104,10 @@ def _get_path(folder, file_name=None, absolute=True):
 
 
 def remove_file(folder, file_name):
-    folder.files = list(filter(lambda file: file.name != file_name, folder.files))
+    if file_name and _get_child(folder, file_name, File) is None:
+        return
+    removed = get_child_map(folder).remove(folder, 'files', file_name)
+    _modified(folder, lambda table: table.remove(folder, file_name, removed))
 
 
 def create_artifact(folder, raw=None):
@@ -105,6 +116,8 @@ def create_artifact(folder, raw=None):
         artifact.entities.extend(raw.entities)
     artifact.parent_object_ = folder
     folder.files.append(artifact)
+    # the name of the artifact is not known yet, lookups of paths not found in the table will search the graph
+    _modified(folder, lambda table: setattr(table, 'complete', False))
     return artifact
 
 
@@ -114,6 +127,7 @@ def create_folder(folder, type_=None, **kwargs):
     sub_folder = type_(**kwargs)
     sub_folder.parent_object_ = folder
     folder.folders.append(sub_folder)
+    _modified(folder, lambda table: table.add(folder, sub_folder))
     return sub_folder
 
 
@@ -137,6 +151,7 @@ def create_derivative(ds, path=None, **kwargs):
     if ds.dataset_description:
         derivative.dataset_description.update(ds.dataset_description)
 
+    mark_modified(ds)
     return derivative
 
 
@@ -153,26 +168,37 @@ def create_dataset(schema, base_dir=None, **kwargs):
 
 
 def get_file(folder, file_name):
+    table, key = _lookup_path(folder, file_name)
+    if key is not None:
+        node = table.nodes.get(key)
+        if node is not None or table.complete:
+            return node if isinstance(node, File) else None
     folder, file_name = resolve_segments(folder, file_name, True)
     if not folder:
         return None
-    direct_files = folder.to_generator(depth_first=True, depth=1, filter_=lambda n: isinstance(n, File))
-    file = next(filter(lambda f: f.name == file_name, direct_files), None)
+    file = _get_child(folder, file_name, File)
+    if file is not None and key is not None:
+        table.nodes.setdefault(key, file)
     return file
 
 
 def get_files(folder, name_pattern):
+    if not any(c in name_pattern for c in '*?['):
+        file = _get_child(folder, name_pattern, File)
+        return [file] if file is not None else []
     direct_files = folder.to_generator(depth_first=True, depth=1, filter_=lambda n: isinstance(n, File))
     return list(filter(lambda file: fnmatch.fnmatch(file.name, name_pattern), direct_files))
 
 
 def remove_folder(folder, folder_name):
-    folder.folders = list(filter(lambda f: f.name != folder_name, folder.folders))
+    if folder_name and _get_child(folder, folder_name, Folder) is None:
+        return
+    removed = get_child_map(folder).remove(folder, 'folders', folder_name)
+    _modified(folder, lambda table: table.remove(folder, folder_name, removed))
 
 
 def get_folder(folder, folder_name):
-    direct_folders = folder.to_generator(depth_first=True, depth=1, filter_=lambda n: isinstance(n, Folder))
-    return next(filter(lambda f: f.name == folder_name, direct_folders), None)
+    return _get_child(folder, folder_name, Folder)
 
 
 def get_files_sorted(folder):
@@ -183,27 +209,102 @@ def get_folders_sorted(folder):
     return sorted(folder.folders, key=lambda f: f.name)
 
 
-def to_generator(source, depth_first=False, filter_=None, depth=1000):
-    if depth < 0:
-        return
+# guards the materialization of lazily loaded folders, see DatasetOptions.lazy_subtrees
+_LAZY_LOCK = threading.RLock()
+_LOADING = object()
 
-    if not depth_first:
-        if filter_ and not filter_(source):
-            return
-        yield source
 
-    for key, value in source.items():
+def materialize(folder):
+    """Scans the contents of a lazily loaded folder (placeholder) if not done yet."""
+    if 'lazy_loader_' not in folder.__dict__:
+        return
+    with _LAZY_LOCK:
+        loader = folder.__dict__.get('lazy_loader_')
+        if loader is None or loader is _LOADING:
+            # already loaded by another thread or a nested call while loading
+            return
+        folder.lazy_loader_ = _LOADING
+        dataset = get_dataset(folder)
+        generation = getattr(dataset, 'generation_', 0)
+        try:
+            loader()
+        except BaseException:
+            folder.lazy_loader_ = loader
+            raise
+        del folder.lazy_loader_
+        if dataset is not None:
+            # scanning a placeholder reveals its contents, it does not modify the graph
+            dataset.generation_ = generation
+
+
+def _lazy_property(prop):
+    """Wraps a property of a folder type to make sure a lazily loaded folder is materialized before access."""
+
+    def _getter(folder):
+        materialize(folder)
+        return prop.fget(folder)
+
+    def _setter(folder, value):
+        materialize(folder)
+        prop.fset(folder, value)
+
+    _getter.lazy_ = True
+    return property(_getter, _setter, doc=prop.__doc__)
+
+
+# per model class: the names of the members which may hold child nodes, see _get_child_members()
+_CHILD_MEMBERS = {}
+
+
+def _get_child_members(model_class):
+    """Returns the names of the members of the given model class declared (MEMBERS) to hold model objects.
+
+    Members of primitive types (str, dict, ...), i.e. loaded file contents, are never traversed.
+    The members are returned in declaration order, super classes first, the same order they are initialized in.
+    """
+    members = _CHILD_MEMBERS.get(model_class)
+    if members is None:
+        members = []
+        for klass in reversed(model_class.__mro__):
+            module = sys.modules.get(klass.__module__)
+            for name, spec in vars(klass).get('MEMBERS', {}).items():
+                member_type = getattr(module, spec['type'], None)
+                if isinstance(member_type, type) and issubclass(member_type, Model) and name not in members:
+                    members.append(name)
+        members = _CHILD_MEMBERS[model_class] = tuple(members)
+    return members
+
+
+def get_children(source):
+    """Returns the child nodes of the given model object, a lazily loaded folder is materialized first."""
+    members = _get_child_members(type(source))
+    if not members:
+        return None
+    if 'lazy_loader_' in source.__dict__:
+        materialize(source)
+    children = []
+    for key in members:
+        value = source.get(key)
         if isinstance(value, Model):
-            yield from to_generator(value, depth_first, filter_, depth - 1)
+            children.append(value)
         elif isinstance(value, list):
-            for item in value:
-                if isinstance(item, Model):
-                    yield from to_generator(item, depth_first, filter_, depth - 1)
+            children += [item for item in value if isinstance(item, Model)]
+    return children
 
-    if depth_first:
-        if filter_ and not filter_(source):
-            return
-        yield source
+
+def to_generator(source, depth_first=False, filter_=None, depth=1000, breadth_first=False, prune=None):
+    # in pre-order, nodes not matching the filter are pruned including their subtrees
+    if not depth_first and filter_ is not None:
+        prune = _prune_unmatched(filter_, prune)
+        filter_ = None
+    return walk(source, get_children, breadth_first=breadth_first, post_order=depth_first, max_depth=depth,
+                prune=prune, filter_=filter_)
+
+
+def _prune_unmatched(filter_, prune):
+    if prune is None:
+        return lambda node: not filter_(node)
+    return lambda node: prune(node) or not filter_(node)
 
 
 def iterancestors(source):
@@ -321,6 +422,360 @@ def get_entities(artifact):
     return {e['key']: e['value'] for e in artifact.entities}
 
 
+# source of the node ids, next() on a count is atomic, i.e. ids are unique across threads
+_NODE_IDS = itertools.count(1)
+
+
+def _init_model(model, *args, **kwargs):
+    model.node_id_ = next(_NODE_IDS)
+
+
+def get_node_id(model) -> int:
+    """Returns the unique integer id of the given node, assigned when the node was created."""
+    node_id = model.__dict__.get('node_id_')
+    if node_id is None:
+        # the node was created without calling its constructor, for example by unpickling
+        node_id = model.node_id_ = next(_NODE_IDS)
+    return node_id
+
+
+def _reset_node_id(clone):
+    # a copy is a new node, the node table of a copied dataset refers to the ids of the original nodes
+    clone.__dict__.pop('node_table_', None)
+    clone.node_id_ = next(_NODE_IDS)
+    return clone
+
+
+def _model_copy(model):
+    clone = type(model).__new__(type(model))
+    clone.__dict__.update(model.__dict__)
+    dict.update(clone, model)
+    return _reset_node_id(clone)
+
+
+def _model_deepcopy(model, memo):
+    clone = type(model).__new__(type(model))
+    memo[id(model)] = clone
+    for name, value in model.__dict__.items():
+        # the schema module of a dataset is shared by the copy
+        clone.__dict__[name] = value if isinstance(value, types.ModuleType) else copy.deepcopy(value, memo)
+    for key, value in model.items():
+        dict.__setitem__(clone, key, copy.deepcopy(value, memo))
+    return _reset_node_id(clone)
+
+
+def _model_hash(model):
+    # value objects (entity refs, mapped JSON contents) are hashed by their keys, they compare by contents
+    return hash(tuple(model))
+
+
+def _node_hash(node):
+    return get_node_id(node)
+
+
+def _node_eq(node, other):
+    # files and folders are equal if identical, comparisons with any other mapping compare the contents
+    if isinstance(other, (File, Folder)):
+        return node is other
+    return dict.__eq__(node, other)
+
+
+def _node_ne(node, other):
+    equal = _node_eq(node, other)
+    return equal if equal is NotImplemented else not equal
+
+
+def get_node_table(dataset) -> dict:
+    """Returns a dict of node id to node of all nodes of the given dataset.
+    The table is built on first use and rebuilt once the dataset was modified, see ``mark_modified()``."""
+    generation = getattr(dataset, 'generation_', 0)
+    cached = dataset.__dict__.get('node_table_')
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    table = {get_node_id(node): node for node in dataset.to_generator()}
+    dataset.node_table_ = (generation, table)
+    return table
+
+
+def get_node(dataset, node_id: int):
+    """Returns the node of the given dataset with the given id or None if there is no such node."""
+    return get_node_table(dataset).get(node_id)
+
+
+class ChildMap:
+    """The direct files and folders of a folder by name (in member order, the first child of a name wins),
+    see :func:`get_child_map`.
+
+    The map is kept next to the members of the folder: children appended to member lists are added on next access,
+    renamed children are updated by the name setters and any other change of the members
+    (for example assigning a new list) lets the map be rebuilt.
+    """
+
+    def __init__(self, folder):
+        self.files = {}
+        self.folders = {}
+        # names of more than one child, removing them requires searching all children
+        self._duplicates = set()
+        # per member: the list or object and the number of indexed list items
+        self._members = {}
+        for key, value in folder.items():
+            self._index_member(key, value, 0)
+
+    def _index_member(self, key, value, start):
+        if isinstance(value, list):
+            for child in value[start:]:
+                self.add(child)
+            self._members[key] = (value, len(value))
+        elif isinstance(value, Model):
+            self.add(value)
+            self._members[key] = (value, None)
+
+    def _children(self, node):
+        if isinstance(node, File):
+            return self.files
+        if isinstance(node, Folder):
+            return self.folders
+        return None
+
+    def add(self, node):
+        children = self._children(node)
+        if children is not None and node.name:
+            self._add(children, node.name, node)
+
+    def _add(self, children, name, node):
+        if children.setdefault(name, node) is not node:
+            self._duplicates.add(name)
+
+    def rename(self, node, old_name, new_name):
+        children = self._children(node)
+        if children is None:
+            return
+        if old_name and children.get(old_name) is node:
+            del children[old_name]
+        if new_name:
+            self._add(children, new_name, node)
+
+    def remove(self, folder, key, name) -> list:
+        """Removes the children of the given name from the given member list (in-place) and returns them."""
+        items = folder[key]
+        node = (self.files if key == 'files' else self.folders).get(name) if name else None
+        if node is not None and name not in self._duplicates:
+            # compare the ids to find the index, a unique name is removed without comparing all names
+            try:
+                index = list(map(id, items)).index(id(node))
+            except ValueError:
+                # the child is a single valued member, not contained in the list
+                return []
+            del items[index]
+            self._members[key] = (items, len(items))
+            del self._children(node)[name]
+            return [node]
+        removed = [child for child in items if child.name == name]
+        items[:] = [child for child in items if child.name != name]
+        if removed:
+            # other children of that name may remain, index all again
+            self.__init__(folder)
+        return removed
+
+    def is_valid(self, folder) -> bool:
+        """Adds children appended to the member lists since the last access,
+        returns False if the members changed otherwise, i.e. the map must be rebuilt."""
+        count = 0
+        for key, value in folder.items():
+            if not isinstance(value, (list, Model)):
+                continue
+            count += 1
+            known = self._members.get(key)
+            if known is None or known[0] is not value:
+                return False
+            if known[1] is not None and len(value) != known[1]:
+                if len(value) < known[1]:
+                    return False
+                self._index_member(key, value, known[1])
+        return count == len(self._members)
+
+
+def get_child_map(folder) -> ChildMap:
+    """Returns the map of the direct files and folders by name of the given folder, used to look up children."""
+    if 'lazy_loader_' in folder.__dict__:
+        materialize(folder)
+    child_map = folder.__dict__.get('child_map_')
+    if child_map is None or not child_map.is_valid(folder):
+        child_map = folder.child_map_ = ChildMap(folder)
+    return child_map
+
+
+def _get_child(folder, name, type_):
+    children = get_child_map(folder).files if type_ is File else get_child_map(folder).folders
+    node = children.get(name)
+    if node is not None and node.name != name:
+        # renamed without using the name property, for example by setting the dict item
+        child_map = folder.child_map_ = ChildMap(folder)
+        node = (child_map.files if type_ is File else child_map.folders).get(name)
+    return node
+
+
+def _named_property(prop):
+    """Wraps the name property of files and folders to keep the child map of the parent folder up-to-date."""
+
+    def _setter(node, name):
+        old_name = node.get('name')
+        prop.fset(node, name)
+        parent = node.__dict__.get('parent_object_')
+        if parent is not None and old_name != name:
+            _renamed(parent, node, old_name, name)
+
+    _setter.named_ = True
+    return property(prop.fget, _setter, doc=prop.__doc__)
+
+
+def _modifying_property(prop):
+    """Wraps a member property to mark the dataset as modified when the member is assigned."""
+
+    def _setter(node, value):
+        prop.fset(node, value)
+        mark_modified(node)
+
+    _setter.modifies_ = True
+    return property(prop.fget, _setter, doc=prop.__doc__)
+
+
+def _renamed(parent, node, old_name, new_name):
+    child_map = parent.__dict__.get('child_map_')
+    if child_map is not None:
+        child_map.rename(node, old_name, new_name)
+    _modified(parent, lambda table: table.rename(parent, node, old_name, new_name))
+
+
+class PathTable:
+    """A dict of relative path to node (file or folder) of a dataset, see :func:`get_path_table`.
+
+    If the table is not complete (some folders are loaded lazily or nodes were created without a name),
+    paths not found in the table have to be searched in the graph.
+    """
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.nodes = {}
+        self.complete = True
+
+    def index(self, folder, prefix=''):
+        """Adds the files and folders within the given folder (recursively) using the given path prefix."""
+        for _ in walk((folder, prefix), self._index_folder):
+            pass
+
+    def _index_folder(self, entry):
+        """Adds the direct children of a folder and returns the (folder, prefix) entries of the folders to index next."""
+        folder, prefix = entry
+        sub_folders = []
+        for child in folder.to_generator(depth=1):
+            if child is folder or not isinstance(child, (File, Folder)):
+                continue
+            if not child.name:
+                self.complete = False
+                continue
+            path = prefix + child.name
+            # the first node of a name wins, same as searching the members in order does
+            if path in self.nodes:
+                continue
+            self.nodes[path] = child
+            if isinstance(child, Folder):
+                if child.__dict__.get('lazy_loader_') is not None:
+                    # do not trigger loading a lazily loaded folder
+                    self.complete = False
+                    continue
+                sub_folders.append((child, path + os.sep))
+        return sub_folders
+
+    def add(self, folder, node):
+        key = _get_path_key(folder, node.name)
+        if key is None:
+            self.complete = False
+            return
+        self.nodes.setdefault(key, node)
+
+    def rename(self, folder, node, old_name, new_name):
+        if isinstance(node, Folder):
+            # the paths of all nodes within the folder change, let the table be rebuilt on next use
+            self.generation = None
+            return
+        old_key = _get_path_key(folder, old_name)
+        if old_key is not None and self.nodes.get(old_key) is node:
+            del self.nodes[old_key]
+        self.add(folder, node)
+
+    def remove(self, folder, name, removed):
+        key = _get_path_key(folder, name)
+        node = self.nodes.get(key)
+        if key is None or node not in removed:
+            return
+        del self.nodes[key]
+        if not isinstance(node, Folder):
+            return
+        prefix = key + os.sep
+        for path in [path for path in self.nodes if path.startswith(prefix)]:
+            del self.nodes[path]
+
+
+def get_path_table(dataset) -> PathTable:
+    """Returns the table of relative path to node of the given dataset, used to look up files and folders by path.
+    The table is built on first use and kept up-to-date by create_artifact(), create_folder(), remove_file() and
+    remove_folder(), any other modification (see ``mark_modified()``) lets the table be rebuilt on next use."""
+    generation = getattr(dataset, 'generation_', 0)
+    table = dataset.__dict__.get('path_table_')
+    if table is None or table.generation != generation:
+        table = PathTable(generation)
+        table.index(dataset)
+        dataset.path_table_ = table
+    return table
+
+
+def _get_path_key(folder, path):
+    segments = [path]
+    current = folder
+    while current is not None and not isinstance(current, Dataset):
+        segments.insert(0, current.name)
+        current = current.parent_object_
+    if not all(segments):
+        # a folder without a name cannot be addressed by a path
+        return None
+    return os.path.normpath(os.path.join(*segments))
+
+
+def _lookup_path(folder, path):
+    """Returns the path table of the dataset containing the folder and the key of the given relative path,
+    (None, None) if the path cannot be looked up in the table."""
+    if not path or os.path.isabs(path) or '..' in os.path.normpath(path).split(os.sep):
+        return None, None
+    dataset = get_dataset(folder)
+    key = _get_path_key(folder, path)
+    if dataset is None or key is None:
+        return None, None
+    return get_path_table(dataset), key
+
+
+def _modified(folder, update):
+    """Marks the dataset containing the given node as modified. If its path table is up-to-date,
+    the given update is applied to it instead of rebuilding it on next use."""
+    dataset = get_dataset(folder)
+    if dataset is None:
+        return
+    table = dataset.__dict__.get('path_table_')
+    in_sync = table is not None and table.generation == getattr(dataset, 'generation_', 0)
+    mark_modified(dataset)
+    if in_sync:
+        update(table)
+        table.generation = dataset.generation_
+
+
+def mark_modified(model):
+    """Increases the generation of the dataset containing the given node, which drops its cached query results.
+    Called by all functions modifying the graph, call it after modifying the graph directly."""
+    dataset = get_dataset(model)
+    if dataset is not None:
+        dataset.generation_ = getattr(dataset, 'generation_', 0) + 1
+
+
 def get_schema(model):
     current = model
     while current is not None:
@@ -360,9 +815,26 @@ def _map_object(schema, model_type, json_object):
 class PatchingSchemaPlugin(SchemaPlugin):
     def execute(self, schema):
         schema.Model.get_schema = get_schema
-        schema.Model.__hash__ = lambda self: hash(tuple(self))
+        schema.Model.__init__ = _init_model
+        schema.Model.__hash__ = _model_hash
+        schema.Model.__copy__ = _model_copy
+        schema.Model.__deepcopy__ = _model_deepcopy
+        for cls in (schema.File, schema.Folder):
+            cls.__hash__ = _node_hash
+            cls.__eq__ = _node_eq
+            cls.__ne__ = _node_ne
+        schema.Model.get_node_id = get_node_id
+        schema.Dataset.get_node_table = get_node_table
+        schema.Dataset.get_node = get_node
+        schema.Dataset.get_path_table = get_path_table
+        schema.Folder.get_child_map = get_child_map
+        for cls in (schema.File, schema.Folder):
+            # the model classes are shared by all schema versions, make sure to wrap only once
+            if not hasattr(cls.name.fset, 'named_'):
+                cls.name = _named_property(cls.name)
         schema.Folder.select = select
         schema.Folder.query = query
+        schema.Folder.query_many = query_many
         schema.Folder.query_entities = query_entities
         schema.File.get_parent = get_parent
         schema.Folder.get_parent = get_parent
@@ -391,6 +863,9 @@ class PatchingSchemaPlugin(SchemaPlugin):
         schema.Model.to_generator = to_generator
         schema.Model.to_dict = to_dict
         schema.Model.iterancestors = iterancestors
+        schema.Model.mark_modified = mark_modified
+        schema.Dataset.get_query_cache = get_query_cache
+        schema.Dataset.get_entity_index = get_entity_index
 
         import weakref
 
@@ -500,6 +975,33 @@ class PatchingSchemaPlugin(SchemaPlugin):
         schema.get_model_classes = lambda: get_model_classes(schema)
         schema.get_members = lambda element_type, include_superclass=True: get_members(schema, element_type,
                                                                                        include_superclass)
+
+        # assigning the members (children) of a folder invalidates the cached lookups and query results
+        for cls in schema.get_model_classes().values():
+            if not issubclass(cls, schema.Folder):
+                continue
+            for member in schema.get_members(cls, include_superclass=False):
+                prop = cls.__dict__.get(member['name'])
+                if member['type'] is not str and isinstance(prop, property) and prop.fset is not None \
+                        and not hasattr(prop.fset, 'modifies_') and not hasattr(prop.fget, 'lazy_'):
+                    setattr(cls, member['name'], _modifying_property(prop))
+
+        # so does changing the members of files queries match on, renaming is handled by the name setters
+        for cls, names in ((schema.File, ('extension',)), (schema.Artifact, ('suffix', 'datatype', 'entities')),
+                           (schema.EntityRef, ('key', 'value'))):
+            for name in names:
+                prop = cls.__dict__.get(name)
+                if isinstance(prop, property) and prop.fset is not None and not hasattr(prop.fset, 'modifies_'):
+                    setattr(cls, name, _modifying_property(prop))
+
+        # subject and derivative folders may be placeholders which are scanned on first access
+        for cls in (schema.Subject, schema.DerivativeFolder):
+            for member in schema.get_members(cls):
+                prop = getattr(cls, member['name'], None)
+                # the model classes are shared by all schema versions, make sure to wrap only once
+                if member['type'] is not str and isinstance(prop, property) and not hasattr(prop.fget, 'lazy_'):
+                    setattr(cls, member['name'], _lazy_property(prop))
+
         schema.process_entity_value = lambda key, value: process_entity_value(schema, key, value)
         schema.fuzzy_match_entity_key = lambda user_key: fuzzy_match_entity_key(schema, user_key)
         schema.fuzzy_match_entity = lambda user_key: fuzzy_match_entity(schema, user_key)
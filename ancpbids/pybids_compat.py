@@ -1,7 +1,7 @@
 import os.path
 import warnings
 from functools import partial
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Iterator
 
 import ancpbids
 from ancpbids import ValidationPlugin
@@ -21,11 +21,63 @@ class BIDSLayout:
     ----------
     ds_dir:
         the (absolute) path to the dataset to load
+    database_path:
+        optional path of an SQLite database (file or directory) to persist the index of the dataset to,
+        see :mod:`ancpbids.layout_db`. If the database is up-to-date, the dataset is not scanned:
+        :meth:`get` (for return types other than 'object') and :meth:`get_metadata` are answered by the database
+        and the in-memory dataset is only loaded on first access.
+    reset_database:
+        whether to rebuild the database even if it is up-to-date
+
+    Once the in-memory dataset is modified (see ``mark_modified()``) or replaced, all queries are answered
+    by the in-memory dataset.
     """
 
-    def __init__(self, ds_dir: str, **kwargs):
-        self.dataset = load_dataset(ds_dir)
-        self.schema = self.dataset.get_schema()
+    def __init__(self, ds_dir: str, database_path: str = None, reset_database: bool = False, **kwargs):
+        self.ds_dir = ds_dir
+        self._dataset = None
+        self.database = None
+        # the generation of the in-memory dataset the database corresponds to
+        self._database_generation = None
+        if database_path:
+            from .layout_db import LayoutDatabase
+            self.database = LayoutDatabase(database_path)
+            if reset_database or self.database.is_stale(ds_dir):
+                self._dataset = load_dataset(ds_dir)
+                self.database.build(self._dataset)
+                self._database_generation = getattr(self._dataset, 'generation_', 0)
+            self.schema = self.database.get_schema()
+        else:
+            self._dataset = load_dataset(ds_dir)
+            self.schema = self._dataset.get_schema()
+
+    @property
+    def dataset(self):
+        if self._dataset is None:
+            self._dataset = load_dataset(self.ds_dir)
+            # the database is up-to-date with the files just loaded
+            self._database_generation = getattr(self._dataset, 'generation_', 0)
+        return self._dataset
+
+    @dataset.setter
+    def dataset(self, dataset):
+        # the database does not correspond to the assigned dataset
+        self._dataset = dataset
+        self._database_generation = None
+        self.schema = dataset.get_schema()
+
+    def _is_database_current(self) -> bool:
+        """Whether the database (if any) reflects the in-memory dataset, i.e. it was not modified since."""
+        if self.database is None:
+            return False
+        return self._dataset is None or getattr(self._dataset, 'generation_', 0) == self._database_generation
+
+    def _use_database(self, return_type, scope) -> bool:
+        """Whether a query can be answered by the database: it returns file paths or unique values
+        and the database reflects the in-memory dataset."""
+        if not return_type or not (return_type.startswith('file') or return_type == 'id'):
+            return False
+        return scope != 'self' and self._is_database_current()
 
     def __getattr__(self, key):
         # replace arbitrary get functions with calls to get
@@ -66,6 +118,10 @@ class BIDSLayout:
         precedence, per the inheritance rules in the BIDS specification.
 
         """
+        if self._is_database_current():
+            md = self.database.get_metadata(path, include_entities=include_entities)
+            if md is not None:
+                return md
         path = os.path.normpath(path)
         # make relative to dataset root, i.e., remove base path
         if path.startswith(self.dataset.base_dir_):
@@ -76,7 +132,8 @@ class BIDSLayout:
 
     def get(self, return_type: str = 'object', target: str = None, scope: str = None,
             extension: Union[str, List[str]] = None, suffix: Union[str, List[str]] = None,
-            **entities) -> Union[List[str], List[object]]:
+            limit: int = None, offset: int = 0, stream: bool = False,
+            **entities) -> Union[List[str], List[object], Iterator]:
         """Depending on the return_type value returns either paths to files that matched the filtering criteria
         or :class:`Artifact <ancpbids.model_v1_7_0.Artifact>` objects for further processing by the caller.
 
@@ -89,6 +146,9 @@ class BIDSLayout:
 
             file_paths = layout.get(subj=['02', '03'], task='lang', return_type='files')
 
+            # page through the matched files in a stable order
+            file_paths = layout.get(suffix='bold', return_type='files', limit=100, offset=200)
+
         Parameters
         ----------
         return_type:
@@ -111,6 +171,12 @@ class BIDSLayout:
             criterion to match any files containing the provided extension only
         suffix:
             criterion to match any files containing the provided suffix only
+        limit:
+            the maximum number of files/objects to return, see :func:`ancpbids.query.query`
+        offset:
+            the number of matched files/objects to skip
+        stream:
+            whether to return an iterator yielding the matched files/objects lazily instead of a list
         entities
             a list of key-values to match the entities of interest, example: subj='02',task='lang'
 
@@ -119,8 +185,54 @@ class BIDSLayout:
             depending on the return_type value either paths to files that matched the filtering criteria
             or Artifact objects for further processing by the caller
         """
+        if self._use_database(return_type, scope):
+            # a sorter only applies to objects, paths are returned in traversal order and unique values sorted
+            entities.pop('sorter', None)
+            return self.database.query(return_type, target, scope, extension, suffix, limit=limit, offset=offset,
+                                       stream=stream, **entities)
         folder = self.dataset
-        return query_module.query(folder, return_type, target, scope, extension, suffix, **entities)
+        return query_module.query(folder, return_type, target, scope, extension, suffix, limit=limit, offset=offset,
+                                  stream=stream, **entities)
+
+    def get_many(self, queries: List[dict], **common) -> List[Union[List[str], List[object], None]]:
+        """Executes a batch of queries, see :meth:`get`, and returns their results in the same order.
+        Queries searching the in-memory dataset are evaluated in a single traversal,
+        see :func:`ancpbids.query.query_many`.
+
+        .. code-block::
+
+            bold, events = layout.get_many([dict(suffix='bold'), dict(suffix='events')],
+                                           sub='01', task='lang', return_type='files')
+
+        Parameters
+        ----------
+        queries:
+            the queries to execute, each a dict of keyword arguments to :meth:`get`, except `stream`
+        common:
+            keyword arguments shared by all queries, overridden by the arguments of a query
+
+        Returns
+        -------
+            one result per query, as returned by :meth:`get`
+        """
+        results = [None] * len(queries)
+        batch = []
+        for i, spec in enumerate(queries):
+            spec = {**common, **spec}
+            if spec.get('stream'):
+                raise ValueError("get_many does not support stream, use get() instead")
+            return_type = spec.get('return_type', 'object')
+            if self._use_database(return_type, spec.get('scope')):
+                # answered by the database without traversing the dataset, a sorter only applies to objects
+                spec.pop('sorter', None)
+                results[i] = self.database.query(**{'return_type': return_type, **spec})
+            else:
+                batch.append((i, spec))
+        if batch:
+            batch_results = query_module.query_many(self.dataset, [spec for _, spec in batch])
+            for (i, _), result in zip(batch, batch_results):
+                results[i] = result
+        return results
 
     def get_entities(self, scope: str = query_module._UNSET, sort: bool = False) -> dict:
         """Returns a unique set of entities found within the dataset as a dict.
@@ -1,10 +1,16 @@
+import heapq
 import os
 import re
 import sys
+import threading
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
+from dataclasses import dataclass
 from fnmatch import fnmatch
-from typing import Union, List
+from itertools import islice
+from typing import Union, List, NamedTuple, Iterator, Optional, Tuple
 
+from ancpbids.traversal import walk
 from ancpbids.utils import resolve_segments
 from ancpbids.model_base import *
 
@@ -95,10 +101,85 @@ class FnMatchExpr(CompExpr):
         return value is not None and fnmatch(value, self.pattern)
 
 
+@dataclass(frozen=True)
+class Range:
+    """A range of numeric (index) entity values, see :func:`gt`, :func:`ge`, :func:`lt`, :func:`le` and
+    :func:`between`. Values which are not integers, for example labels, are never contained."""
+    low: Union[int, float] = None
+    high: Union[int, float] = None
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+
+    def __post_init__(self):
+        for bound in ('low', 'high'):
+            value = getattr(self, bound)
+            if isinstance(value, str):
+                # allow padded index values as bounds, same as for entity values: '02' -> 2
+                object.__setattr__(self, bound, int(value))
+            elif value is not None and not isinstance(value, (int, float)):
+                raise ValueError("range bounds must be numbers: %r" % (value,))
+
+    def contains(self, value) -> bool:
+        if not isinstance(value, int) or isinstance(value, bool):
+            return False
+        if self.low is not None and (value < self.low or (value == self.low and not self.low_inclusive)):
+            return False
+        if self.high is not None and (value > self.high or (value == self.high and not self.high_inclusive)):
+            return False
+        return True
+
+    def select(self, values: list) -> slice:
+        """Returns the slice of the given sorted list of integers containing the values within this range."""
+        start, stop = 0, len(values)
+        if self.low is not None:
+            start = (bisect_left if self.low_inclusive else bisect_right)(values, self.low)
+        if self.high is not None:
+            stop = (bisect_right if self.high_inclusive else bisect_left)(values, self.high)
+        return slice(start, max(start, stop))
+
+
+def gt(value) -> Range:
+    """Matches index entity values greater than the given value, example: ``query(run=gt(2))``."""
+    return Range(low=value, low_inclusive=False)
+
+
+def ge(value) -> Range:
+    """Matches index entity values greater than or equal to the given value."""
+    return Range(low=value)
+
+
+def lt(value) -> Range:
+    """Matches index entity values less than the given value."""
+    return Range(high=value, high_inclusive=False)
+
+
+def le(value) -> Range:
+    """Matches index entity values less than or equal to the given value."""
+    return Range(high=value)
+
+
+def between(low, high) -> Range:
+    """Matches index entity values from low to high (both inclusive), example: ``query(run=between(1, 4))``."""
+    return Range(low=low, high=high)
+
+
+class RangeExpr(CompExpr):
+    def __init__(self, attr: property, value_range: Range):
+        self.attr = attr
+        self.value_range = value_range
+
+    def eval(self, context) -> bool:
+        value = self.attr.fget(context)
+        value = self.convert_value(value)
+        return self.value_range.contains(value)
+
+
 class EntityExpr(CompExpr):
     def __init__(self, schema, key, pattern, op=FnMatchExpr):
         self.schema = schema
-        if pattern is not None:
+        if isinstance(pattern, Range):
+            op = RangeExpr
+        elif pattern is not None:
             pattern = schema.process_entity_value(key, pattern)
             if isinstance(pattern, list):
                 pattern = list(map(lambda v: str(v), pattern))
@@ -133,6 +214,7 @@ class Select:
         self.filter_type = filter_type
         self._where = TrueExpr()
         self._subtree = TrueExpr()
+        self._candidates = None
 
     def subtree(self, bool_expr: BoolExpr):
         self._subtree = bool_expr
@@ -141,8 +223,30 @@ class Select:
         self._where = bool_expr
         return self
 
+    def candidates(self, nodes):
+        """Restricts the search to the given nodes (in traversal order) instead of traversing the whole context,
+        nodes which would not be visited by traversing the context are skipped."""
+        self._candidates = nodes
+        return self
+
+    def _is_reachable(self, node, depth):
+        # the node must be within the context and none of its ancestors (nor itself) pruned, see subtree()
+        current = node
+        while depth >= 0 and self._subtree.eval(current):
+            if current is self.context:
+                return True
+            current = getattr(current, 'parent_object_', None)
+            if current is None:
+                return False
+            depth -= 1
+        return False
+
     def _exec(self, callback, depth=sys.maxsize):
-        for m in self.context.to_generator(filter_=lambda o: self._subtree.eval(o), depth=depth):
+        if self._candidates is not None:
+            nodes = (m for m in self._candidates if self._is_reachable(m, depth))
+        else:
+            nodes = self.context.to_generator(filter_=self._subtree.eval, depth=depth)
+        for m in nodes:
             if isinstance(m, self.filter_type) and self._where.eval(m):
                 yield callback(m)
 
@@ -189,22 +293,450 @@ def _require_artifact(schema, expr) -> AllExpr:
     return AllExpr(CustomOpExpr(lambda m: isinstance(m, schema.Artifact)), expr)
 
 
+# the columns of artifacts which can be queried other than their entities
+FIXED_COLUMNS = ('suffix', 'extension', 'datatype')
+
+
+def is_glob(pattern: str) -> bool:
+    """Returns whether the given criterion is a fnmatch pattern rather than a plain value."""
+    return any(c in pattern for c in '*?[')
+
+
+def normalize_extension(extension: Union[str, List[str]]) -> Union[str, List[str]]:
+    """Prefixes the given extension criterion (or each of a list of criteria) with a dot if missing."""
+    converter = lambda v: "." + v if v != "*" and not v.startswith(".") else v
+    return list(map(converter, extension)) if isinstance(extension, list) else converter(extension)
+
+
+def normalize_target(schema, target: str) -> str:
+    """Returns the column of the given target of a query with return_type 'id': one of :data:`FIXED_COLUMNS`
+    (for example 'suffixes' targets the suffix column) or the matching entity key."""
+    if target == 'datatype':
+        return target
+    if target in 'suffixes':
+        return 'suffix'
+    if target in 'extensions':
+        return 'extension'
+    return schema.fuzzy_match_entity_key(target)
+
+
+def normalize_criteria(schema, return_type: str = None, target: str = None,
+                       extension: Union[str, List[str]] = None, suffix: Union[str, List[str]] = None,
+                       **entities) -> Tuple[dict, Optional[str]]:
+    """Normalises the filter arguments of :func:`query` to criteria per column, used by the indexes answering
+    queries without traversing the graph (:class:`Catalog <ancpbids.Catalog>`,
+    :class:`DatasetIndex <ancpbids.shared_index.DatasetIndex>`,
+    :class:`LayoutDatabase <ancpbids.layout_db.LayoutDatabase>`).
+
+    Parameters
+    ----------
+    schema:
+        the schema to match the entity keys and to process the entity values with
+    return_type, target, extension, suffix, entities:
+        see :func:`query`
+
+    Returns
+    -------
+        the criteria by column (entity key or one of :data:`FIXED_COLUMNS`) and, for return_type 'id',
+        the column of the target. A criterion for the target is added if not given, i.e. only artifacts having
+        a value for the target are matched.
+    """
+    criteria = {}
+    for k, v in entities.items():
+        if k == 'datatype':
+            criteria[k] = v
+            continue
+        key = schema.fuzzy_match_entity_key(k)
+        if isinstance(v, list):
+            criteria[key] = [value if isinstance(value, Range) else schema.process_entity_value(key, value)
+                             for value in v]
+        else:
+            criteria[key] = v if isinstance(v, Range) else schema.process_entity_value(key, v)
+    if extension:
+        criteria['extension'] = normalize_extension(extension)
+    if suffix:
+        criteria['suffix'] = suffix
+    if return_type == 'id':
+        if not target:
+            raise ValueError("return_type=id requires the target parameter to be set")
+        target = normalize_target(schema, target)
+        criteria.setdefault(target, '*')
+    return criteria, target
+
+
+# the folder types named after the entity (<key>-<label>) all files within them share
+_ENTITY_FOLDER_TYPES = {
+    'sub': (Subject, DerivativeFolder),
+    'ses': (SessionFolder, DerivativeFolder),
+}
+
+
+def _regex_lookup(column, value):
+    patterns = list(map(str, value)) if isinstance(value, list) else [str(value)]
+    return lambda index: index.search(column, patterns)
+
+
+def _label_lookup(column, value):
+    labels = list(map(str, value)) if isinstance(value, list) else [str(value)]
+    return lambda index: index.lookup(column, labels)
+
+
+class _EntityFolderExpr(CompExpr):
+    """False for folders named after the given entity (subjects, sessions and derivative folders following the same
+    naming scheme) whose label does not match, see :func:`_entity_folder_expr`."""
+
+    def __init__(self, prefix, folder_types, names, matches):
+        self.prefix = prefix
+        self.folder_types = folder_types
+        # the matching folder names if plain labels were given, None otherwise
+        self.names = names
+        self.matches = matches
+
+    def applies_to(self, m) -> bool:
+        return isinstance(m, self.folder_types) and bool(m.name) and m.name.startswith(self.prefix)
+
+    def eval(self, context) -> bool:
+        return not self.applies_to(context) or self.matches(context)
+
+
+def _entity_folder_expr(key, value, search_operator) -> _EntityFolderExpr:
+    """Returns an expression which is False for folders named after the given entity (subjects, sessions and
+    derivative folders following the same naming scheme) whose label does not match the given value(s)."""
+    prefix = key + '-'
+    labels = list(map(str, value)) if isinstance(value, list) else [str(value)]
+    names = None
+    if search_operator is FnMatchExpr and not any(is_glob(label) for label in labels):
+        # plain labels, match the folder names directly
+        names = frozenset(prefix + label for label in labels)
+        matches = lambda folder: folder.name in names
+    else:
+        label = property(lambda folder: folder.name[len(prefix):])
+        matches = _to_any_expr(labels, lambda val: search_operator(label, val)).eval
+    return _EntityFolderExpr(prefix, _ENTITY_FOLDER_TYPES[key], names, matches)
+
+
+DEFAULT_QUERY_CACHE_SIZE = 128
+
+_NOT_CACHED = object()
+
+
+class QueryCacheInfo(NamedTuple):
+    """Statistics of a :class:`QueryCache`, see :meth:`QueryCache.info`."""
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+    generation: int
+
+    @property
+    def hit_rate(self) -> float:
+        """The ratio of queries answered by the cache, 0.0 if no query was executed yet."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class QueryCache:
+    """A LRU cache of the results of :func:`query` calls on the folders of a dataset.
+
+    The results are keyed by the normalised query arguments. All cached results are dropped as soon as
+    the generation of the dataset changes, i.e. the graph was modified, see ``Model.mark_modified()``.
+
+    Parameters
+    ----------
+    maxsize:
+        the maximum number of cached results, 0 to disable caching
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._generation = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sync(self, generation):
+        if generation != self._generation:
+            self._results.clear()
+            self._generation = generation
+
+    def get(self, key, generation: int):
+        """Returns the cached result for the given key or `_NOT_CACHED`."""
+        with self._lock:
+            self._sync(generation)
+            result = self._results.get(key, _NOT_CACHED)
+            if result is _NOT_CACHED:
+                self.misses += 1
+            else:
+                self._results.move_to_end(key)
+                self.hits += 1
+            return result
+
+    def put(self, key, generation: int, result):
+        """Caches the result of a query executed at the given generation of the dataset."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._sync(generation)
+            self._results[key] = result
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def info(self) -> QueryCacheInfo:
+        """
+        Returns
+        -------
+        QueryCacheInfo
+            the number of hits and misses, the max and current size and the generation of the cached results
+        """
+        with self._lock:
+            return QueryCacheInfo(self.hits, self.misses, self.maxsize, len(self._results), self._generation)
+
+    def clear(self):
+        """Drops all cached results and resets the statistics."""
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def get_dataset(model):
+    """Returns the dataset the given node is contained in or None if it is not part of a dataset."""
+    current = model
+    while current is not None:
+        if isinstance(current, Dataset):
+            return current
+        current = getattr(current, 'parent_object_', None)
+    return None
+
+
+def get_query_cache(dataset) -> QueryCache:
+    """Returns the query cache of the given dataset, its size is set by
+    :attr:`DatasetOptions.query_cache_size <ancpbids.DatasetOptions.query_cache_size>`."""
+    cache = dataset.__dict__.get('query_cache_')
+    if cache is None:
+        maxsize = getattr(getattr(dataset, 'options', None), 'query_cache_size', 0)
+        cache = dataset.query_cache_ = QueryCache(maxsize)
+    return cache
+
+
+class EntityIndex:
+    """The artifacts of a dataset in traversal order along with per-column arrays of their values,
+    the columns being the entity keys, suffix, extension and datatype.
+
+    - the sorted integer values of each entity key, i.e. artifacts having an index entity (run, echo, ...)
+      within a :class:`Range` are found using bisection
+    - newline-joined buffers of the values of each column along with an offset table,
+      i.e. regular expressions are searched over all values at once instead of value by value
+    - the positions of the artifacts per value of each column, i.e. plain labels are looked up in a dict
+
+    The index is built on first use and dropped as soon as the graph is modified, see :func:`get_entity_index`.
+    Folders not loaded yet (see :attr:`DatasetOptions.lazy_subtrees <ancpbids.DatasetOptions.lazy_subtrees>`)
+    are not indexed. Queries only use the index if they search the whole dataset without subject/session criteria
+    (whose folders are pruned instead) and none of the unloaded folders, i.e. the index never loads a subtree.
+    """
+
+    def __init__(self, dataset):
+        self.generation = getattr(dataset, 'generation_', 0)
+        self.artifacts = []
+        schema = dataset.get_schema()
+        processed = {}
+        # per entity key: the positions of the artifacts having the entity and the (processed) values
+        self._entities = {}
+        # the lazily loaded folders not loaded yet, they are skipped
+        self.unloaded = []
+        for node in dataset.to_generator(prune=self._skip_unloaded):
+            if not isinstance(node, Artifact):
+                continue
+            position = len(self.artifacts)
+            self.artifacts.append(node)
+            for entity in node.entities:
+                column = self._entities.get(entity.key)
+                if column is None:
+                    column = self._entities[entity.key] = ([], [])
+                elif column[0] and column[0][-1] == position:
+                    # the first entity of a key is matched by queries
+                    continue
+                value = processed.get((entity.key, entity.value), _NOT_CACHED)
+                if value is _NOT_CACHED:
+                    value = processed[(entity.key, entity.value)] = schema.process_entity_value(entity.key,
+                                                                                                entity.value)
+                column[0].append(position)
+                column[1].append(value)
+        self._ranges = {}
+        self._buffers = {}
+        self._labels = {}
+
+    def _skip_unloaded(self, node):
+        if 'lazy_loader_' in node.__dict__:
+            self.unloaded.append(node)
+            return True
+        return False
+
+    def is_complete(self) -> bool:
+        """Returns whether none of the skipped folders was loaded since, i.e. no artifacts are missing."""
+        return all('lazy_loader_' in folder.__dict__ for folder in self.unloaded)
+
+    def get_artifacts(self, positions) -> list:
+        """Returns the artifacts at the given positions in traversal order."""
+        return [self.artifacts[position] for position in sorted(positions)]
+
+    def select(self, key: str, value_range: Range) -> set:
+        """Returns the positions of the artifacts whose (first) entity of the given key is within the range."""
+        column = self._ranges.get(key)
+        if column is None:
+            positions, values = self._entities.get(key, ([], []))
+            pairs = sorted((value, position) for position, value in zip(positions, values)
+                           if isinstance(value, int) and not isinstance(value, bool))
+            column = self._ranges[key] = ([value for value, _ in pairs], [position for _, position in pairs])
+        values, positions = column
+        return set(positions[value_range.select(values)])
+
+    def _get_column(self, column):
+        if column in FIXED_COLUMNS:
+            return range(len(self.artifacts)), [getattr(artifact, column) for artifact in self.artifacts]
+        return self._entities.get(column, ([], []))
+
+    def lookup(self, column: str, labels: list) -> Optional[set]:
+        """Returns the positions of the artifacts whose value of the given column (entity key, suffix, extension
+        or datatype) equals any of the labels, compared as strings the same as done by :class:`FnMatchExpr`.
+
+        Returns
+        -------
+            the matched positions or None if any label is a pattern, i.e. it has to be evaluated value by value
+        """
+        if any(is_glob(label) for label in labels):
+            return None
+        column_labels = self._labels.get(column)
+        if column_labels is None:
+            column_labels = self._labels[column] = {}
+            for position, value in zip(*self._get_column(column)):
+                column_labels.setdefault(os.path.normcase(str(value)), set()).add(position)
+        matched = set()
+        for label in labels:
+            matched.update(column_labels.get(os.path.normcase(label), ()))
+        return matched
+
+    def _get_buffer(self, column):
+        buffer = self._buffers.get(column, _NOT_CACHED)
+        if buffer is _NOT_CACHED:
+            positions, values = self._get_column(column)
+            # values are matched as strings, the same as done by ReExpr
+            lines = [str(value) for value in values]
+            buffer = None
+            if not any('\n' in line for line in lines):
+                offsets = []
+                offset = 0
+                for line in lines:
+                    offsets.append(offset)
+                    offset += len(line) + 1
+                buffer = ('\n'.join(lines), offsets, positions)
+            self._buffers[column] = buffer
+        return buffer
+
+    def search(self, column: str, patterns: list) -> Optional[set]:
+        """Returns the positions of the artifacts whose value of the given column (entity key, suffix, extension
+        or datatype) matches any of the regular expressions, see `re.search`.
+
+        Returns
+        -------
+            the matched positions or None if the expressions cannot be searched over the joined values
+            (lookarounds, \\A, \\Z or matches spanning multiple values), i.e. they have to be evaluated value by value
+        """
+        buffer = self._get_buffer(column)
+        if buffer is None:
+            return None
+        text, offsets, positions = buffer
+        matched = set()
+        for pattern in patterns:
+            if any(token in pattern for token in _LINE_SENSITIVE_TOKENS):
+                return None
+            regex = re.compile(pattern, re.MULTILINE)
+            pos = 0
+            while pos <= len(text):
+                match = regex.search(text, pos)
+                if match is None:
+                    break
+                if '\n' in match.group():
+                    return None
+                line = bisect_right(offsets, match.start()) - 1
+                matched.add(positions[line])
+                # continue with the next value, one match per value is enough
+                pos = offsets[line + 1] if line + 1 < len(offsets) else len(text) + 1
+        return matched
+
+
+# regular expression tokens which match differently within a joined buffer than within a single value
+_LINE_SENSITIVE_TOKENS = ('(?=', '(?!', '(?<', '\\A', '\\Z')
+
+
+def get_entity_index(dataset) -> EntityIndex:
+    """Returns the (up-to-date) entity index of the given dataset, see :class:`EntityIndex`."""
+    index = dataset.__dict__.get('entity_index_')
+    if index is None or index.generation != getattr(dataset, 'generation_', 0) or not index.is_complete():
+        index = dataset.entity_index_ = EntityIndex(dataset)
+    return index
+
+
+def _freeze(value):
+    # lists of criteria are OR combined and their values compared as strings, i.e. their order does not matter
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(map(str, value)))
+    return value
+
+
+def _get_cache_key(folder, return_type, target, scope, extension, suffix, regex_search, sorter, limit, offset,
+                   stream, entities):
+    if sorter is not None or stream:
+        return None
+    if scope is None:
+        scope = 'raw' if isinstance(folder, Dataset) else 'all'
+    key = (id(folder), return_type, target, scope, _freeze(extension), _freeze(suffix), bool(regex_search), limit,
+           offset, tuple(sorted((k, _freeze(v)) for k, v in entities.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _copy_result(result):
+    # do not hand out the cached containers, the caller may modify them
+    if isinstance(result, (list, set)):
+        return type(result)(result)
+    return result
+
+
 def query(folder, return_type: str = 'object', target: str = None, scope: str = None,
           extension: Union[str, List[str]] = None, suffix: Union[str, List[str]] = None,
-          regex_search=False, sorter=None,
-          **entities) -> Union[List[str], List[object]]:
+          regex_search=False, sorter=None, limit: int = None, offset: int = 0, stream: bool = False,
+          **entities) -> Union[List[str], List[object], Iterator]:
     """Depending on the return_type value returns either paths to files that matched the filtering criteria
     or :class:`Artifact <ancpbids.model_v1_7_0.Artifact>` objects for further processing by the caller.
 
     Note that all provided filter criteria are AND combined, i.e. subj='02',task='lang' will match files containing
     '02' as a subject AND 'lang' as a task. If you provide a list of values for a criteria, they will be OR combined.
 
+    Results are cached per dataset (see :class:`QueryCache`) until the graph is modified, i.e. repeating a query
+    does not traverse the graph again.
+
+    Files and objects can be paged through using `limit`/`offset` or consumed lazily using `stream`.
+    Pages are sliced from the same order as the unpaginated result, i.e. `get(limit=n) == get()[:n]`: files in
+    traversal order (directory entries are sorted by name when loading a dataset), i.e. no matches beyond the requested
+    page are collected, and objects ordered by `sorter` (by name by default), which requires all matches.
+
     .. code-block::
 
         file_paths = layout.get(subj='02', task='lang', suffix='bold', return_type='files')
 
         file_paths = layout.get(subj=['02', '03'], task='lang', return_type='files')
 
+        # the 3rd page of 100 files
+        file_paths = layout.get(suffix='bold', return_type='files', limit=100, offset=200)
+
+        for artifact in layout.get(suffix='bold', stream=True):
+            ...
+
     Parameters
     ----------
     folder:
@@ -231,17 +763,281 @@ def query(folder, return_type: str = 'object', target: str = None, scope: str =
         criterion to match any files containing the provided suffix only
     entities
         a list of key-values to match the entities of interest, example: subj='02',task='lang'
+        The special key `datatype` matches the datatype folder an artifact is contained in, example: datatype='func'
+        (requires :attr:`DatasetOptions.infer_artifact_datatype <ancpbids.DatasetOptions.infer_artifact_datatype>`)
+        Index entities (run, echo, ...) can be matched by a :class:`Range` of values, example: run=gt(2)
+        or run=between(1, 4). These are looked up in the sorted values of the :class:`EntityIndex` of the dataset.
+    limit:
+        the maximum number of files/objects to return, requires return_type 'files' or 'object' without target
+    offset:
+        the number of matched files/objects to skip
+    stream:
+        whether to return an iterator yielding the matched files/objects lazily instead of a list,
+        the graph must not be modified while consuming it
 
     Returns
     -------
         depending on the return_type value either paths to files that matched the filtering criteria
         or Artifact objects for further processing by the caller
     """
+    dataset = get_dataset(folder)
+    key = None
+    if dataset is not None:
+        key = _get_cache_key(folder, return_type, target, scope, extension, suffix, regex_search, sorter, limit, offset,
+                             stream, entities)
+    if key is None:
+        return _query(folder, return_type, target, scope, extension, suffix, regex_search, sorter, limit, offset,
+                      stream, **entities)
+    cache = get_query_cache(dataset)
+    generation = getattr(dataset, 'generation_', 0)
+    result = cache.get(key, generation)
+    if result is _NOT_CACHED:
+        result = _query(folder, return_type, target, scope, extension, suffix, regex_search, sorter, limit, offset,
+                        stream, **entities)
+        cache.put(key, generation, result)
+    return _copy_result(result)
+
+
+# the parameters of query() other than entities, with their default values
+_QUERY_PARAMETERS = OrderedDict([('return_type', 'object'), ('target', None), ('scope', None), ('extension', None),
+                                 ('suffix', None), ('regex_search', False), ('sorter', None), ('limit', None),
+                                 ('offset', 0), ('stream', False)])
+
+
+def query_many(folder, queries: List[dict], **common) -> List[Union[List[str], List[object], set, None]]:
+    """Executes a batch of queries, see :func:`query`, and returns their results in the same order.
+
+    Instead of traversing the graph once per query, all queries searching the same folder are evaluated in a single
+    traversal: subtrees are only descended into as long as any of the queries may match within them (i.e. one walk
+    through each subject folder for a batch of per-subject queries). Plain labels of other entities, suffix,
+    extension and datatype are looked up in the :class:`EntityIndex` shared by the whole batch instead (if it can be
+    used, see there), i.e. such queries (as well as range predicates, regex_search and cached queries) do not take
+    part in the traversal.
+
+    .. code-block::
+
+        bold, events, sidecars = dataset.query_many([dict(suffix='bold', extension='.nii.gz'),
+                                                     dict(suffix='events'),
+                                                     dict(suffix='bold', extension='.json')],
+                                                    sub='01', return_type='files')
+
+        files_per_subject = dataset.query_many([dict(sub=label) for label in subjects], return_type='files')
+
+    Parameters
+    ----------
+    folder:
+        an entry-point of type Folder to search within
+    queries:
+        the queries to execute, each a dict of keyword arguments to :func:`query`, except `stream`
+    common:
+        keyword arguments shared by all queries, overridden by the arguments of a query
+
+    Returns
+    -------
+        one result per query, as returned by :func:`query`
+    """
+    results = [None] * len(queries)
+    dataset = get_dataset(folder)
+    cache = get_query_cache(dataset) if dataset is not None else None
+    generation = getattr(dataset, 'generation_', 0)
+    pending = []
+    for i, spec in enumerate(queries):
+        entities = {**common, **spec}
+        params = {name: entities.pop(name, default) for name, default in _QUERY_PARAMETERS.items()}
+        if params['stream']:
+            raise ValueError("query_many does not support stream, use query() instead")
+        key = _get_cache_key(folder, entities=entities, **params) if cache is not None else None
+        if key is not None:
+            result = cache.get(key, generation)
+            if result is not _NOT_CACHED:
+                results[i] = _copy_result(result)
+                continue
+        plan = _plan_query(folder, label_lookups=True, **params, **entities)
+        if plan is not None:
+            pending.append((i, key, plan))
+
+    matches = {}
+    # the queries to evaluate in a single traversal, grouped by the folder to search
+    groups = OrderedDict()
+    for i, _, plan in pending:
+        if plan.select._candidates is not None:
+            # already narrowed down by the entity index
+            matches[i] = plan.select.objects(depth=plan.depth)
+        else:
+            groups.setdefault(id(plan.select.context), []).append((i, plan))
+    for plans in groups.values():
+        group_matches = _select_many([plan.select for _, plan in plans], [plan.depth for _, plan in plans])
+        for (i, _), select_matches in zip(plans, group_matches):
+            matches[i] = select_matches
+
+    for i, key, plan in pending:
+        result = plan.finish(matches[i])
+        if key is not None:
+            cache.put(key, generation, result)
+            result = _copy_result(result)
+        results[i] = result
+    return results
+
+
+def _select_many(selects: List[Select], depths: List[int]) -> List[list]:
+    """Evaluates the given selects (of the same context) in a single pre-order traversal of their context and returns
+    the matched nodes of each select in traversal order.
+
+    Each visited node carries the (indices of the) selects it is neither pruned for, see :meth:`Select.subtree`,
+    nor too deep for, a subtree is skipped once no select is left. Subject/session folders are dispatched to the
+    selects searching them by name instead of evaluating the subtree expressions of all selects.
+    """
+    from ancpbids.plugins.plugin_schema_patches import get_children
+
+    matches = [[] for _ in selects]
+    context = selects[0].context
+    pruning = frozenset(i for i, select in enumerate(selects) if not isinstance(select._subtree, TrueExpr))
+    limited = frozenset(i for i, depth in enumerate(depths) if depth < sys.maxsize)
+
+    # per folder name prefix: the folder types, the selects per folder name and all selects restricted by name
+    folder_exprs = {}
+    for i in pruning:
+        for op in getattr(selects[i]._subtree, 'bool_ops', ()):
+            if isinstance(op, _EntityFolderExpr) and op.names is not None:
+                folder_types, claims, restricted = folder_exprs.setdefault(op.prefix, (op.folder_types, {}, set()))
+                restricted.add(i)
+                for name in op.names:
+                    claims.setdefault(name, set()).add(i)
+    rejected_by_name = {}
+
+    def get_rejecting(node):
+        # the selects not searching the given subject/session folder
+        for prefix, (folder_types, claims, restricted) in folder_exprs.items():
+            if isinstance(node, folder_types) and node.name and node.name.startswith(prefix):
+                rejecting = rejected_by_name.get(node.name)
+                if rejecting is None:
+                    rejecting = rejected_by_name[node.name] = frozenset(restricted.difference(claims.get(node.name,
+                                                                                                          ())))
+                return rejecting
+        return None
+
+    def get_active_children(entry):
+        node, active, depth = entry
+        children = get_children(node)
+        if not children:
+            return None
+        depth += 1
+        if not limited.isdisjoint(active):
+            active = frozenset(i for i in active if depths[i] >= depth)
+            if not active:
+                return None
+        if pruning.isdisjoint(active):
+            return [(child, active, depth) for child in children]
+        entries = []
+        for child in children:
+            child_active = active
+            rejecting = get_rejecting(child) if folder_exprs else None
+            if rejecting:
+                child_active = child_active.difference(rejecting)
+            rejecting = [i for i in pruning.intersection(child_active) if not selects[i]._subtree.eval(child)]
+            if rejecting:
+                child_active = child_active.difference(rejecting)
+            if child_active:
+                entries.append((child, child_active, depth))
+        return entries
+
+    root = frozenset(i for i, select in enumerate(selects) if depths[i] >= 0 and select._subtree.eval(context))
+    if not root:
+        return matches
+    for node, active, _ in walk((context, root, 0), get_active_children):
+        for i in active:
+            select = selects[i]
+            if isinstance(node, select.filter_type) and select._where.eval(node):
+                matches[i].append(node)
+    return matches
+
+
+def _query(folder, return_type: str = 'object', target: str = None, scope: str = None,
+          extension: Union[str, List[str]] = None, suffix: Union[str, List[str]] = None,
+          regex_search=False, sorter=None, limit: int = None, offset: int = 0, stream: bool = False,
+          **entities) -> Union[List[str], List[object], Iterator]:
+    """Executes the query without caching, see :func:`query`."""
+    plan = _plan_query(folder, return_type, target, scope, extension, suffix, regex_search, sorter, limit, offset,
+                       stream, **entities)
+    if plan is None:
+        return iter(()) if stream else None
+    return plan.finish(plan.select.objects(depth=plan.depth))
+
+
+class _QueryPlan:
+    """A query ready to be executed: the select to traverse the graph with and how to turn its matches into the
+    result of the query."""
+
+    def __init__(self, select, depth, return_type, sorter, result_extractor, limit, offset, stream):
+        self.select = select
+        self.depth = depth
+        self.return_type = return_type
+        self.sorter = sorter
+        self.result_extractor = result_extractor
+        self.limit = limit
+        self.offset = offset
+        self.stream = stream
+
+    @property
+    def paginate(self):
+        return self.limit is not None or self.offset or self.stream
+
+    def finish(self, matches):
+        """Returns the result of the query given its matches (in traversal order)."""
+        return_type = self.return_type
+        if return_type:
+            if return_type.startswith("file"):
+                paths = map(self.select.schema.File.get_absolute_path, matches)
+                if self.paginate:
+                    return _paginate(paths, self.limit, self.offset, self.stream)
+                return list(paths)
+            elif return_type == 'dir':
+                result = filter(lambda o: isinstance(o, File), matches)
+                return set(map(lambda a: a.get_parent().get_relative_path(), result))
+
+        sorter = self.sorter
+        artifacts = matches
+        if sorter is None:
+            sorter = lambda artifact: artifact.name
+        if self.paginate:
+            # page through the same order as the unpaginated result, i.e. get(limit=n) == get()[:n]
+            if not callable(sorter):
+                return _paginate(artifacts, self.limit, self.offset, self.stream)
+            if self.limit is not None and not self.stream:
+                # only the first offset + limit matches need to be ordered (stable like sorted())
+                artifacts = heapq.nsmallest(self.offset + self.limit, artifacts, key=sorter)
+            else:
+                artifacts = sorted(artifacts, key=sorter)
+            return _paginate(artifacts, self.limit, self.offset, self.stream)
+        if callable(sorter):
+            artifacts = sorted(artifacts, key=sorter)
+        if self.result_extractor:
+            return sorted(set(self.result_extractor(artifacts)))
+        return list(artifacts)
+
+
+def _plan_query(folder, return_type: str = 'object', target: str = None, scope: str = None,
+                extension: Union[str, List[str]] = None, suffix: Union[str, List[str]] = None,
+                regex_search=False, sorter=None, limit: int = None, offset: int = 0, stream: bool = False,
+                label_lookups: bool = False, **entities) -> Optional[_QueryPlan]:
+    """Validates the query parameters and translates them to a :class:`_QueryPlan`,
+    None if the scope does not exist.
+
+    If `label_lookups` is set, plain labels of entities (other than sub and ses, whose folders are pruned instead),
+    suffix, extension and datatype are looked up in the :class:`EntityIndex`, which pays off once the index is shared
+    by several queries."""
     if scope is None:
         scope = 'raw' if isinstance(folder, Dataset) else 'all'
     if return_type == 'id':
         if not target:
             raise ValueError("return_type=id requires the target parameter to be set")
+    offset = offset or 0
+    paginate = limit is not None or offset or stream
+    if paginate:
+        if target or (return_type and return_type != 'object' and not return_type.startswith('file')):
+            raise ValueError("limit, offset and stream require return_type 'files' or 'object' without target")
+        if (limit is not None and limit < 0) or offset < 0:
+            raise ValueError("limit and offset must not be negative")
 
     schema = folder.get_schema()
     context = folder
@@ -255,20 +1051,27 @@ def query(folder, return_type: str = 'object', target: str = None, scope: str =
 
     select = context.select(target_type)
 
+    subtree_ops = []
     if scope == 'raw':
         # the raw scope does not search in derivatives folder but everything else
-        select.subtree(CustomOpExpr(lambda m: not isinstance(m, DerivativeFolder)))
+        subtree_ops.append(CustomOpExpr(lambda m: not isinstance(m, DerivativeFolder)))
+
+    # the datatype is not an entity but an attribute of artifacts set while loading the dataset
+    datatype = entities.pop('datatype', None)
 
     result_extractor = None
     if target:
-        if target in 'suffixes':
+        target = normalize_target(schema, target)
+        if target == 'datatype':
+            datatype = '*'
+            result_extractor = lambda artifacts: [a.datatype for a in artifacts if a.datatype]
+        elif target == 'suffix':
             suffix = '*'
             result_extractor = lambda artifacts: [a.suffix for a in artifacts if a.suffix]
-        elif target in 'extensions':
+        elif target == 'extension':
             extension = '*'
             result_extractor = lambda artifacts: [a.extension for a in artifacts if a.extension]
         else:
-            target = schema.fuzzy_match_entity_key(target)
             entities = {**entities, target: '*'}
             result_extractor = lambda artifacts: [entity.value for a in artifacts for entity in
                                                   filter(lambda e: e.key == target, a.entities) if a.entities]
@@ -277,45 +1080,106 @@ def query(folder, return_type: str = 'object', target: str = None, scope: str =
     if regex_search:
         search_operator = ReExpr
 
+    # criteria which can be looked up in the entity index of the dataset instead of being evaluated per artifact:
+    # pairs of the lookup function and the expression to evaluate otherwise
+    lookups = []
+    # plain labels to look up if label_lookups is set
+    labels = []
+    folder_pruned = False
     for k, v in entities.items():
         entity_key = schema.fuzzy_match_entity(k)
-        v = schema.process_entity_value(entity_key, v)
-        ops.append(
-            _require_artifact(schema,
-                              _to_any_expr(v, lambda val: EntityExpr(schema, entity_key, val, op=search_operator))))
+        key = entity_key.value['name']
+        if isinstance(v, Range):
+            lookups.append((lambda index, key=key, v=v: index.select(key, v),
+                            _require_artifact(schema, EntityExpr(schema, entity_key, v))))
+            continue
+        has_range = any(isinstance(val, Range) for val in (v if isinstance(v, list) else [v]))
+        if not has_range:
+            v = schema.process_entity_value(entity_key, v)
+        expr = _require_artifact(schema,
+                                 _to_any_expr(v, lambda val: EntityExpr(schema, entity_key, val, op=search_operator)))
+        if regex_search and v is not None and not has_range:
+            lookups.append((_regex_lookup(key, v), expr))
+        elif label_lookups and v is not None and not has_range and key not in _ENTITY_FOLDER_TYPES:
+            labels.append((_label_lookup(key, v), expr))
+        else:
+            ops.append(expr)
+        if key in _ENTITY_FOLDER_TYPES and v is not None and not has_range:
+            # do not search (or even scan, if loaded lazily) subject/session folders of other subjects/sessions
+            subtree_ops.append(_entity_folder_expr(key, v, search_operator))
+            folder_pruned = True
 
     if extension:
-        converter = lambda v: "." + v if v != "*" and not v.startswith(".") else v
-        any_expr = _to_any_expr(extension, lambda ext: search_operator(Artifact.extension, ext), converter)
+        any_expr = _to_any_expr(extension, lambda ext: search_operator(Artifact.extension, ext), normalize_extension)
         require_expr = _require_artifact(schema, any_expr)
-        ops.append(require_expr)
+        if regex_search or label_lookups:
+            extension = normalize_extension(extension)
+        if regex_search:
+            lookups.append((_regex_lookup('extension', extension), require_expr))
+        elif label_lookups:
+            labels.append((_label_lookup('extension', extension), require_expr))
+        else:
+            ops.append(require_expr)
 
     if suffix:
-        ops.append(
-            _require_artifact(schema,
-                              _to_any_expr(suffix, lambda suf: search_operator(Artifact.suffix, suf))))
+        expr = _require_artifact(schema, _to_any_expr(suffix, lambda suf: search_operator(Artifact.suffix, suf)))
+        if regex_search:
+            lookups.append((_regex_lookup('suffix', suffix), expr))
+        elif label_lookups:
+            labels.append((_label_lookup('suffix', suffix), expr))
+        else:
+            ops.append(expr)
+
+    if datatype:
+        expr = _require_artifact(schema, _to_any_expr(datatype, lambda dt: search_operator(Artifact.datatype, dt)))
+        if regex_search:
+            lookups.append((_regex_lookup('datatype', datatype), expr))
+        elif label_lookups:
+            labels.append((_label_lookup('datatype', datatype), expr))
+        else:
+            ops.append(expr)
+
+    if folder_pruned:
+        # searching the folders of the requested subjects/sessions only is cheaper than checking all labeled artifacts
+        ops.extend(expr for _, expr in labels)
+    else:
+        lookups.extend(labels)
+
+    if subtree_ops:
+        select.subtree(AllExpr(*subtree_ops))
+
+    dataset = get_dataset(context)
+    index = None
+    # the index covers the whole dataset: it is not used for queries restricted to a folder or to the folders of
+    # some subjects/sessions, nor for queries searching folders which are not loaded (and so not indexed) yet
+    if lookups and dataset is not None and context is dataset and not folder_pruned:
+        index = get_entity_index(dataset)
+        if any(select._is_reachable(folder, sys.maxsize) for folder in index.unloaded):
+            index = None
+    positions = None
+    for lookup, expr in lookups:
+        matched = lookup(index) if index is not None else None
+        if matched is None:
+            ops.append(expr)
+        else:
+            positions = matched if positions is None else positions.intersection(matched)
+    if positions is not None:
+        # only the artifacts found in the index need to be checked: O(log n + k) for ranges,
+        # a single regular expression search over the joined values for regex_search, O(k) for label lookups
+        select.candidates(index.get_artifacts(positions))
 
     select.where(AllExpr(*ops))
 
     search_depth = sys.maxsize
-    if scope == "self":
+    if scope == "self" and not (return_type and return_type.startswith("file")):
         search_depth = 1
 
-    if return_type:
-        if return_type.startswith("file"):
-            return list(select.get_file_paths_absolute())
-        elif return_type == 'dir':
-            result = filter(lambda o: isinstance(o, File), select.objects(depth=search_depth))
-            return set(map(lambda a: a.get_parent().get_relative_path(), result))
-
-    artifacts = select.objects(depth=search_depth)
-    if sorter is None:
-        sorter = lambda artifact: artifact.name
-    if callable(sorter):
-        artifacts = sorted(artifacts, key=sorter)
-    if result_extractor:
-        return sorted(set(result_extractor(artifacts)))
-    return list(artifacts)
+    return _QueryPlan(select, search_depth, return_type, sorter, result_extractor, limit, offset, stream)
+
+
+def _paginate(results, limit, offset, stream):
+    results = islice(results, offset, None if limit is None else offset + limit)
+    return results if stream else list(results)
 
 
 _UNSET = object()
@@ -0,0 +1,343 @@
+"""A read-only, flat index of the artifacts of a loaded dataset which can be shared across processes.
+
+The index is a single binary buffer that is either placed into a ``multiprocessing.shared_memory`` segment
+or written to a file which is memory-mapped by the readers. Worker processes attach to the buffer by name/path,
+no Python object graph is rebuilt or pickled: string columns are dictionary encoded, i.e. each column holds
+one int32 code per artifact referring to a (small) list of unique values.
+
+.. code-block::
+
+    from ancpbids import load_dataset
+    from ancpbids.shared_index import export_index, attach_index
+
+    dataset = load_dataset('path/to/your/dataset')
+    index = export_index(dataset)
+    # in a worker process
+    index = attach_index(index.name)
+    bold_files = index.query(sub='01', suffix='bold', extension='.nii.gz')
+"""
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from fnmatch import fnmatch
+from typing import Union, List
+
+_MAGIC = b'ANCPIDX\x01'
+_HEADER_SIZE = struct.Struct('<I')
+_ALIGNMENT = 8
+# code used in a column if an artifact does not have a value for it
+_MISSING = -1
+# names of the shared memory segments exported by this process
+_EXPORTED = set()
+
+
+def _align(size):
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _encode(dataset, scope=None) -> bytes:
+    from .query import query
+    schema = dataset.get_schema()
+    artifacts = [a for a in query(dataset, scope=scope) if isinstance(a, schema.Artifact)]
+
+    codes = {}
+    uniques = {}
+
+    def _set(column, row, value):
+        if value is None:
+            return
+        if column not in codes:
+            codes[column] = array('i', [_MISSING]) * len(artifacts)
+            uniques[column] = {}
+        value = str(value)
+        column_values = uniques[column]
+        code = column_values.get(value)
+        if code is None:
+            code = column_values[value] = len(column_values)
+        codes[column][row] = code
+
+    path_offsets = array('Q', [0])
+    path_data = bytearray()
+    for row, artifact in enumerate(artifacts):
+        path_data += artifact.get_absolute_path().encode()
+        path_offsets.append(len(path_data))
+        _set('suffix', row, artifact.suffix)
+        _set('extension', row, artifact.extension)
+        _set('datatype', row, artifact.datatype)
+        keys = set()
+        for entity in artifact.entities:
+            # queries match the first value of a repeated entity key
+            if entity.key not in keys:
+                keys.add(entity.key)
+                _set(entity.key, row, entity.value)
+
+    # lay out all sections behind the header, each section is aligned to allow casting to typed memoryviews
+    sections = [path_offsets.tobytes(), bytes(path_data)] + [codes[column].tobytes() for column in codes]
+    offsets = []
+    offset = 0
+    for section in sections:
+        offsets.append(offset)
+        offset = _align(offset + len(section))
+    header = {
+        'schema': schema.__name__.rsplit('.', 1)[-1],
+        'base_dir': dataset.base_dir_,
+        'byteorder': sys.byteorder,
+        'rows': len(artifacts),
+        'paths': {'offsets': offsets[0], 'data': offsets[1], 'size': len(path_data)},
+        'columns': {column: {'values': list(uniques[column].keys()), 'offset': offsets[i + 2]}
+                    for i, column in enumerate(codes)},
+    }
+    header = json.dumps(header).encode()
+    data_start = _align(len(_MAGIC) + _HEADER_SIZE.size + len(header))
+
+    buffer = bytearray(data_start + offset)
+    buffer[:len(_MAGIC)] = _MAGIC
+    _HEADER_SIZE.pack_into(buffer, len(_MAGIC), len(header))
+    buffer[len(_MAGIC) + _HEADER_SIZE.size:len(_MAGIC) + _HEADER_SIZE.size + len(header)] = header
+    for section, section_offset in zip(sections, offsets):
+        start = data_start + section_offset
+        buffer[start:start + len(section)] = section
+    return bytes(buffer)
+
+
+class DatasetIndex:
+    """A read-only view on an exported dataset index, see :func:`export_index` and :func:`attach_index`.
+
+    Instances are picklable: only the name of the shared memory segment (or the file path) is transferred,
+    so they can be passed to worker processes (for example as an attribute of a ``torch`` dataset).
+    """
+
+    def __init__(self, buffer, handle=None, name: str = None):
+        self.name = name
+        self._handle = handle
+        self._views = []
+        self._buffer = self._view(memoryview(buffer))
+        if self._buffer[:len(_MAGIC)] != _MAGIC:
+            raise ValueError('Not a dataset index: %s' % name)
+        header_size, = _HEADER_SIZE.unpack_from(self._buffer, len(_MAGIC))
+        header_start = len(_MAGIC) + _HEADER_SIZE.size
+        header = json.loads(bytes(self._buffer[header_start:header_start + header_size]))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('Dataset index %s was exported on a platform with different byte order' % name)
+        data_start = _align(header_start + header_size)
+
+        self.schema_name = header['schema']
+        self.base_dir = header['base_dir']
+        self.rows = header['rows']
+        paths = header['paths']
+        start = data_start + paths['offsets']
+        self._path_offsets = self._view(self._buffer[start:start + 8 * (self.rows + 1)].cast('Q'))
+        start = data_start + paths['data']
+        self._path_data = self._view(self._buffer[start:start + paths['size']])
+        self._columns = {}
+        for column, spec in header['columns'].items():
+            start = data_start + spec['offset']
+            self._columns[column] = (spec['values'], self._view(self._buffer[start:start + 4 * self.rows].cast('i')))
+
+    def _view(self, view):
+        self._views.append(view)
+        return view
+
+    def __len__(self):
+        return self.rows
+
+    def __reduce__(self):
+        return attach_index, (self.name,)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_schema(self):
+        """
+        Returns
+        -------
+            the schema module the exported dataset was loaded with
+        """
+        import ancpbids
+        return getattr(ancpbids, self.schema_name)
+
+    def get_columns(self) -> List[str]:
+        """
+        Returns
+        -------
+        list
+            the names of the available columns, i.e. suffix, extension, datatype and all found entity keys
+        """
+        return list(self._columns.keys())
+
+    def get_path(self, row: int) -> str:
+        """Returns the absolute path of the artifact at the given row."""
+        return bytes(self._path_data[self._path_offsets[row]:self._path_offsets[row + 1]]).decode()
+
+    def get_row(self, row: int) -> dict:
+        """Returns the path and all column values of the artifact at the given row as a dict."""
+        result = {'path': self.get_path(row)}
+        for column, (values, codes) in self._columns.items():
+            code = codes[row]
+            if code != _MISSING:
+                result[column] = values[code]
+        return result
+
+    def _match_codes(self, column, pattern, regex_search):
+        """Returns the set of codes of the given column matching the pattern (or list of patterns)."""
+        from .query import Range
+        values, _ = self._columns[column]
+        patterns = pattern if isinstance(pattern, list) else [pattern]
+        ranges = [p for p in patterns if isinstance(p, Range)]
+        patterns = [str(p) for p in patterns if not isinstance(p, Range)]
+        codes = set()
+        if ranges:
+            # the values are stored as strings, ranges are matched against the processed (numeric) values
+            schema = self.get_schema()
+            codes.update(code for code, value in enumerate(values)
+                         if any(r.contains(schema.process_entity_value(column, value)) for r in ranges))
+        if regex_search:
+            patterns = [re.compile(p) for p in patterns]
+            codes.update(code for code, value in enumerate(values) if any(p.search(value) for p in patterns))
+        else:
+            codes.update(code for code, value in enumerate(values) if any(fnmatch(value, p) for p in patterns))
+        return codes
+
+    def select(self, regex_search=False, **criteria) -> List[int]:
+        """Returns the rows matching all the provided column criteria, see :meth:`query`."""
+        rows = range(self.rows)
+        for column, pattern in criteria.items():
+            if column not in self._columns:
+                if pattern is None:
+                    # the value must not exist and no artifact has a value for that column
+                    continue
+                return []
+            _, codes = self._columns[column]
+            if pattern is None:
+                rows = [row for row in rows if codes[row] == _MISSING]
+            else:
+                matching = self._match_codes(column, pattern, regex_search)
+                rows = [row for row in rows if codes[row] in matching]
+            if not rows:
+                break
+        return list(rows)
+
+    def query(self, return_type: str = 'files', target: str = None,
+              extension: Union[str, List[str]] = None, suffix: Union[str, List[str]] = None,
+              regex_search=False, **entities) -> Union[List[str], List[dict]]:
+        """Queries the index using the same filter semantics as :func:`ancpbids.query.query`.
+
+        Parameters
+        ----------
+        return_type:
+            Either 'files' to return the absolute paths of matched artifacts, 'dict' to return a dict per artifact
+            containing its path and column values or 'id' to return the unique values of the target column
+        target:
+            the column (entity) to return the unique values of, requires return_type='id'
+        extension:
+            criterion to match any files containing the provided extension only
+        suffix:
+            criterion to match any files containing the provided suffix only
+        regex_search:
+            whether to interpret the criteria as regular expressions instead of fnmatch patterns
+        entities
+            a list of key-values to match the entities of interest, example: subj='02',task='lang'
+
+        Returns
+        -------
+            depending on the return_type either a list of paths, dicts or unique values
+        """
+        from .query import normalize_criteria
+        schema = self.get_schema()
+        criteria, target = normalize_criteria(schema, return_type, target, extension, suffix, **entities)
+        rows = self.select(regex_search=regex_search, **criteria)
+        if return_type == 'id':
+            if target not in self._columns:
+                return []
+            values, codes = self._columns[target]
+            return sorted({schema.process_entity_value(target, values[codes[row]]) for row in rows})
+        if return_type == 'dict':
+            return [self.get_row(row) for row in rows]
+        return [self.get_path(row) for row in rows]
+
+    def close(self):
+        """Releases this view on the index. The underlying shared memory segment remains available to others."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def unlink(self):
+        """Closes this view and destroys the underlying shared memory segment (or file).
+        Should only be called by the process which exported the index once all workers are finished."""
+        handle = self._handle
+        self.close()
+        if hasattr(handle, 'unlink'):
+            handle.unlink()
+        elif self.name and os.path.isfile(self.name):
+            os.remove(self.name)
+
+
+def export_index(dataset, path: str = None, scope: str = None) -> DatasetIndex:
+    """Exports the artifacts (paths, suffixes, extensions, datatypes and entities) of a loaded dataset
+    into a shared memory segment or, if a path is provided, into a file.
+
+    Parameters
+    ----------
+    dataset:
+        the (loaded) dataset to export
+    path:
+        optional file path to write the index to, if not set a new shared memory segment is created
+    scope:
+        the scope of artifacts to export, see :func:`ancpbids.query.query`
+
+    Returns
+    -------
+    DatasetIndex
+        the exported index, its name can be used to attach to it from other processes
+        Note that the creator is responsible to call :meth:`DatasetIndex.unlink` to free a shared memory segment.
+    """
+    buffer = _encode(dataset, scope=scope)
+    if path:
+        with open(path, 'wb') as f:
+            f.write(buffer)
+        return attach_index(path)
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(create=True, size=len(buffer))
+    shm.buf[:len(buffer)] = buffer
+    _EXPORTED.add(shm.name)
+    return DatasetIndex(shm.buf, handle=shm, name=shm.name)
+
+
+def attach_index(name: str) -> DatasetIndex:
+    """Attaches (read-only) to an index exported via :func:`export_index`.
+
+    Parameters
+    ----------
+    name:
+        either the name of the shared memory segment or the path of the index file
+
+    Returns
+    -------
+    DatasetIndex
+        a zero-copy view on the exported index
+    """
+    if os.path.isfile(name):
+        with open(name, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return DatasetIndex(mm, handle=mm, name=name)
+    from multiprocessing import shared_memory
+    try:
+        # do not let the resource tracker of an attaching process destroy the segment (Python >= 3.13)
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix' and name not in _EXPORTED:
+            # older versions register every attached segment, the tracker would unlink it once this process exits
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+    return DatasetIndex(shm.buf, handle=shm, name=name)
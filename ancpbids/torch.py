@@ -1,36 +1,79 @@
 import math
+import queue
+import threading
+from itertools import islice
 from typing import Union
 
-from torch.utils.data import Dataset, random_split, DataLoader
+from torch.utils.data import Dataset, IterableDataset, random_split, DataLoader, get_worker_info
 import ancpbids
+from ancpbids.tsv_cache import TSVCache
+
+
+def _query_data_files(bids_dataset_path, query_kwargs):
+    bids_dataset = ancpbids.load_dataset(bids_dataset_path)
+    query_kwargs = dict(query_kwargs or {})
+    # limit scope to raw as the user is most probably not interested in derivatives
+    query_kwargs.setdefault("scope", "raw")
+    return bids_dataset.query(**query_kwargs)
+
+
+def _get_events_file(data_file):
+    sidecar = data_file.sidecar(suffix="events", extension=".tsv")
+    if len(sidecar) > 0:
+        return sidecar[0]
+    return None
+
+
+def _load_events(data_file, events_cache: TSVCache = None) -> dict or None:
+    events_file = _get_events_file(data_file)
+    if events_file is None:
+        return {}
+    if events_cache is not None:
+        return events_cache.load(events_file.get_absolute_path())
+    return events_file.load_contents()
 
 
 class TorchDataset(Dataset):
-    def __init__(self, *bids_dataset_paths, **query_kwargs):
+    """A map-style dataset of `(file_path, events)` tuples of all files matching the query in the given datasets.
+
+    Parameters
+    ----------
+    bids_dataset_paths:
+        the paths of the datasets to query
+    events_cache_dir:
+        optional directory of a persistent :class:`TSVCache <ancpbids.tsv_cache.TSVCache>`, if set,
+        events are parsed once into the cache and memory-mapped on each access instead of being held in memory
+    query_kwargs:
+        the query arguments to select the data files, see :func:`ancpbids.query.query`
+    """
+
+    def __init__(self, *bids_dataset_paths, events_cache_dir: str = None, **query_kwargs):
         self.data_events_files = []
+        self.events_cache = TSVCache(events_cache_dir) if events_cache_dir else None
 
         for bids_dataset_path in bids_dataset_paths:
-            bids_dataset = ancpbids.load_dataset(bids_dataset_path)
-            if query_kwargs is None:
-                query_kwargs = {}
-            # limit scope to raw as the user is most probably not interested in derivatives
-            query_kwargs.setdefault("scope", "raw")
-            data_files = bids_dataset.query(**query_kwargs)
-
-            def load_contents(data_file) -> dict or None:
-                sidecar = data_file.sidecar(suffix="events", extension=".tsv")
-                if len(sidecar) > 0:
-                    return sidecar[0].load_contents()
-                return {}
-
-            self.data_events_files += [
-                (data_file.get_absolute_path(), load_contents(data_file)) for data_file in data_files]
+            data_files = _query_data_files(bids_dataset_path, query_kwargs)
+            if self.events_cache is None:
+                self.data_events_files += [
+                    (data_file.get_absolute_path(), _load_events(data_file)) for data_file in data_files]
+                continue
+            # keep the events paths only, populating the cache if not done by an earlier run
+            for data_file in data_files:
+                events_file = _get_events_file(data_file)
+                events_path = None
+                if events_file is not None:
+                    events_path = events_file.get_absolute_path()
+                    self.events_cache.ensure(events_path)
+                self.data_events_files.append((data_file.get_absolute_path(), events_path))
 
     def __len__(self):
         return len(self.data_events_files)
 
     def __getitem__(self, idx):
-        return self.data_events_files[idx]
+        file_path, events = self.data_events_files[idx]
+        if self.events_cache is not None:
+            events = self.events_cache.load(events) if events else {}
+        return file_path, events
 
     def split(self, *args: float):
         sum_ratios = sum(args)
@@ -38,3 +81,119 @@ class TorchDataset(Dataset):
             raise ValueError("sum of split ratios should be 1.0")
 
         return random_split(self, args)
+
+
+class _PrefetchError:
+    def __init__(self, error):
+        self.error = error
+
+
+_END = object()
+
+
+def _prefetch(iterable, size: int):
+    """Consumes the iterable in a background thread keeping up to `size` items ahead of the caller."""
+    if size <= 0:
+        yield from iterable
+        return
+    buffer = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def _put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put(item):
+                    return
+        except BaseException as e:
+            _put(_PrefetchError(e))
+        _put(_END)
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                break
+            if isinstance(item, _PrefetchError):
+                raise item.error
+            yield item
+    finally:
+        # the consumer may stop early, make sure the producer does not block forever
+        stopped.set()
+        producer.join()
+
+
+class TorchIterableDataset(IterableDataset):
+    """Streams `(file_path, events)` tuples of all files matching the query in the given datasets.
+
+    In contrast to :class:`TorchDataset`, datasets are loaded and queried lazily when iterating,
+    and the events of each file are read on demand within the (worker) process consuming it.
+    The matched files are sharded deterministically: each DataLoader worker of each distributed rank
+    gets every n-th file, with n being the total number of workers across all ranks.
+
+    .. code-block::
+
+        torch_ds = TorchIterableDataset(dataset_path, suffix="bold", prefetch=4)
+        data_loader = torch.utils.data.DataLoader(torch_ds, num_workers=2)
+
+    Parameters
+    ----------
+    bids_dataset_paths:
+        the paths of the datasets to query
+    prefetch:
+        the number of items to load ahead in a background thread, 0 to disable prefetching
+    rank:
+        the rank of this node, defaults to the rank of the initialized process group (if any), else 0
+    world_size:
+        the number of ranks, defaults to the world size of the initialized process group (if any), else 1
+    events_cache_dir:
+        optional directory of a persistent :class:`TSVCache <ancpbids.tsv_cache.TSVCache>` to read the events from
+    query_kwargs:
+        the query arguments to select the data files, see :func:`ancpbids.query.query`
+    """
+
+    def __init__(self, *bids_dataset_paths, prefetch: int = 2, rank: int = None, world_size: int = None,
+                 events_cache_dir: str = None, **query_kwargs):
+        super(TorchIterableDataset, self).__init__()
+        self.bids_dataset_paths = bids_dataset_paths
+        self.prefetch = prefetch
+        self.events_cache_dir = events_cache_dir
+        self.rank = rank
+        self.world_size = world_size
+        self.query_kwargs = query_kwargs
+
+    def _get_shard(self):
+        rank, world_size = self.rank, self.world_size
+        if rank is None or world_size is None:
+            import torch.distributed as dist
+            initialized = dist.is_available() and dist.is_initialized()
+            if rank is None:
+                rank = dist.get_rank() if initialized else 0
+            if world_size is None:
+                world_size = dist.get_world_size() if initialized else 1
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        return rank * num_workers + worker_id, world_size * num_workers
+
+    def _iter_data_files(self):
+        for bids_dataset_path in self.bids_dataset_paths:
+            yield from _query_data_files(bids_dataset_path, self.query_kwargs)
+
+    def _iter_items(self):
+        shard, num_shards = self._get_shard()
+        events_cache = TSVCache(self.events_cache_dir) if self.events_cache_dir else None
+        for data_file in islice(self._iter_data_files(), shard, None, num_shards):
+            yield data_file.get_absolute_path(), _load_events(data_file, events_cache)
+
+    def __iter__(self):
+        return _prefetch(self._iter_items(), self.prefetch)
@@ -0,0 +1,115 @@
+"""An iterative (stack/queue based) tree traversal shared by the loader, the query engine, the validator and the writer.
+
+Trees are traversed without recursion, i.e. each visited node costs the same regardless of its depth
+and deep trees cannot exceed the interpreter's recursion limit.
+
+.. code-block::
+
+    import os
+    from ancpbids.traversal import walk
+
+    # all directories below a path level by level, without descending into hidden directories
+    children = lambda path: sorted(entry.path for entry in os.scandir(path) if entry.is_dir())
+    hidden = lambda path: os.path.basename(path).startswith('.')
+    for path in walk('/data/ds001', children, breadth_first=True, prune=hidden):
+        print(path)
+"""
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional
+
+_DONE = object()
+
+
+def walk(root, get_children: Callable[[object], Optional[Iterable]], breadth_first: bool = False,
+         post_order: bool = False, max_depth: int = None, prune: Callable[[object], bool] = None,
+         filter_: Callable[[object], bool] = None) -> Iterator:
+    """Traverses the tree starting at the given root node and yields the visited nodes.
+
+    Parameters
+    ----------
+    root:
+        the node to start the traversal at
+    get_children:
+        returns the (ordered) children of the given node, None or an empty iterable for leaf nodes.
+        It is called at most once per node, when its subtree is entered, i.e. after a node has been yielded
+        in pre-order traversals.
+    breadth_first:
+        whether to visit the nodes level by level instead of depth-first (the default)
+    post_order:
+        whether to yield the nodes after their children instead of before them (depth-first only)
+    max_depth:
+        the maximum depth (relative to the root, which is at depth 0) of nodes to visit, unlimited by default
+    prune:
+        returns True for nodes to skip including their subtrees, i.e. they are neither yielded nor expanded
+    filter_:
+        returns True for nodes to yield, nodes not matching are still expanded
+
+    Returns
+    -------
+        an iterator over the visited nodes
+    """
+    if breadth_first and post_order:
+        raise ValueError("post-order traversal requires depth-first traversal")
+    if max_depth is not None and max_depth < 0:
+        return iter(())
+    if breadth_first:
+        return _walk_breadth_first(root, get_children, max_depth, prune, filter_)
+    if post_order:
+        return _walk_post_order(root, get_children, max_depth, prune, filter_)
+    return _walk_pre_order(root, get_children, max_depth, prune, filter_)
+
+
+def _walk_pre_order(root, get_children, max_depth, prune, filter_):
+    # one iterator over the remaining siblings per level, the depth of a node is the size of the stack minus one
+    stack = [iter((root,))]
+    while stack:
+        node = next(stack[-1], _DONE)
+        if node is _DONE:
+            stack.pop()
+            continue
+        if prune is not None and prune(node):
+            continue
+        if filter_ is None or filter_(node):
+            yield node
+        if max_depth is None or len(stack) <= max_depth:
+            children = get_children(node)
+            if children:
+                stack.append(iter(children))
+
+
+def _walk_post_order(root, get_children, max_depth, prune, filter_):
+    stack = [iter((root,))]
+    # the node each iterator on the stack iterates the children of
+    parents = [None]
+    while stack:
+        node = next(stack[-1], _DONE)
+        if node is _DONE:
+            stack.pop()
+            node = parents.pop()
+            if stack and (filter_ is None or filter_(node)):
+                yield node
+            continue
+        if prune is not None and prune(node):
+            continue
+        if max_depth is None or len(stack) <= max_depth:
+            children = get_children(node)
+            if children:
+                stack.append(iter(children))
+                parents.append(node)
+                continue
+        if filter_ is None or filter_(node):
+            yield node
+
+
+def _walk_breadth_first(root, get_children, max_depth, prune, filter_):
+    queue = deque(((root, 0),))
+    while queue:
+        node, depth = queue.popleft()
+        if prune is not None and prune(node):
+            continue
+        if filter_ is None or filter_(node):
+            yield node
+        if max_depth is None or depth < max_depth:
+            children = get_children(node)
+            if children:
+                queue.extend((child, depth + 1) for child in children)
@@ -0,0 +1,253 @@
+"""A persistent on-disk cache of parsed TSV files (for example events sidecars).
+
+Each TSV file is parsed once and stored in a compact binary columnar format: per column the offsets of its cells
+followed by a NUL separated UTF-8 data blob. Cache entries are keyed by the absolute path, size and modification time of the TSV
+file, i.e. a modified TSV file is parsed again. Reading an entry memory-maps the cache file and returns lazy views,
+no TSV parsing is involved and a cell is decoded only when it is accessed.
+
+.. code-block::
+
+    cache = TSVCache('~/.ancp-bids/cache')
+    rows = cache.load('sub-01/func/sub-01_task-rest_events.tsv')
+"""
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Sequence
+from typing import List, Dict, Optional
+
+_MAGIC = b'ANCPTSV\x02'
+_HEADER_SIZE = struct.Struct('<I')
+_OFFSET = struct.Struct('<I')
+_CELL = struct.Struct('<II')
+_EXTENSION = '.tsvc'
+_SEPARATOR = b'\0'
+
+
+def _read_rows(file_path):
+    """Parses the TSV file into a header and rows (lists of cells), returns None if not representable by the cache."""
+    with open(file_path, newline='') as f:
+        reader = csv.reader(f, dialect="excel-tab")
+        header = next(reader, None)
+        if header is None:
+            return [], []
+        rows = []
+        for row in reader:
+            if not row:
+                # csv.DictReader skips empty lines as well
+                continue
+            if len(row) > len(header):
+                return None
+            rows.append(row)
+    return header, rows
+
+
+def _encode(header, rows) -> bytes:
+    nulls = {}
+    sections = []
+    for i, column in enumerate(header):
+        cells = []
+        for r, row in enumerate(rows):
+            if i < len(row):
+                cells.append(row[i].encode())
+            else:
+                # csv.DictReader fills missing cells with None
+                nulls.setdefault(column, []).append(r)
+                cells.append(b'')
+        # the cells are NUL separated (to split a whole column at once), the cell r is stored at
+        # data[offsets[r]:offsets[r + 1] - 1] (to decode a single cell)
+        data = _SEPARATOR.join(cells)
+        if data.count(_SEPARATOR) != max(len(cells) - 1, 0) or len(data) >= 0xFFFFFFFF:
+            return None
+        offsets = [0]
+        for cell in cells:
+            offsets.append(offsets[-1] + len(cell) + 1)
+        sections.append(struct.pack('<%dI' % len(offsets), *offsets) + data)
+    meta = json.dumps({
+        'columns': header,
+        'rows': len(rows),
+        'sizes': [len(section) for section in sections],
+        'nulls': nulls,
+    }).encode()
+    return b''.join([_MAGIC, _HEADER_SIZE.pack(len(meta)), meta] + sections)
+
+
+class _LazySequence(Sequence):
+    """A read-only sequence decoding its items on access, compares equal to lists of the same items."""
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('index out of range')
+        return self._get(index)
+
+    def _get(self, index):
+        raise NotImplementedError()
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        # the memory-map cannot be pickled (for example to pass it to another process), a copy is passed instead
+        return list, (list(self),)
+
+
+class _Column(_LazySequence):
+    """The values of a column of a cache entry."""
+
+    def __init__(self, mm, start, rows, nulls):
+        self._mm = mm
+        self._offsets = start
+        self._data = start + (rows + 1) * _OFFSET.size
+        self._rows = rows
+        self._nulls = nulls
+
+    def __len__(self):
+        return self._rows
+
+    def _get(self, index):
+        if index in self._nulls:
+            return None
+        begin, end = _CELL.unpack_from(self._mm, self._offsets + index * _OFFSET.size)
+        return self._mm[self._data + begin:self._data + end - 1].decode()
+
+    def __iter__(self):
+        # iterating decodes and splits the whole column at once
+        if not self._rows:
+            return iter(())
+        end, = _OFFSET.unpack_from(self._mm, self._data - _OFFSET.size)
+        values = self._mm[self._data:self._data + end - 1].decode().split('\0')
+        for r in self._nulls:
+            values[r] = None
+        return iter(values)
+
+
+class _Rows(_LazySequence):
+    """The rows of a cache entry as dicts of column name to value."""
+
+    def __init__(self, columns):
+        self._columns = columns
+        self._rows = len(next(iter(columns.values()))) if columns else 0
+
+    def __len__(self):
+        return self._rows
+
+    def _get(self, index):
+        return {name: column._get(index) for name, column in self._columns.items()}
+
+    def __iter__(self):
+        names = list(self._columns.keys())
+        for cells in zip(*self._columns.values()):
+            yield dict(zip(names, cells))
+
+
+class TSVCache:
+    """Caches parsed TSV files in the given directory.
+
+    Parameters
+    ----------
+    cache_dir:
+        the directory to store the cache entries in, will be created if missing
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_cache_path(self, file_path: str) -> str:
+        """Returns the path of the cache entry of the given TSV file depending on its path, size and mtime."""
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        # entries of other format versions are not found
+        key = '\0'.join([_MAGIC.hex(), file_path, str(stat.st_size), str(stat.st_mtime_ns)])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + _EXTENSION)
+
+    def ensure(self, file_path: str) -> Optional[str]:
+        """Makes sure the given TSV file is cached and returns the path of its cache entry.
+
+        Returns
+        -------
+            the cache entry path or None if the file cannot be represented by the cache (malformed rows, NUL chars)
+        """
+        cache_path = self.get_cache_path(file_path)
+        if os.path.exists(cache_path):
+            return cache_path
+        parsed = _read_rows(file_path)
+        encoded = _encode(*parsed) if parsed is not None else None
+        if encoded is None:
+            return None
+        # write to a temporary file first, concurrent workers may populate the same entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(encoded)
+        os.replace(tmp_path, cache_path)
+        return cache_path
+
+    def load(self, file_path: str) -> List[Dict[str, str]]:
+        """Returns the rows of the given TSV file as dicts, same as reading the file via `csv.DictReader`.
+        If cached, the rows are a lazy (read-only) sequence, see :func:`load_cached`."""
+        cache_path = self.ensure(file_path)
+        if cache_path is None:
+            from .plugins.plugin_files_handlers import read_tsv
+            return read_tsv(file_path)
+        return load_cached(cache_path)
+
+    def load_columns(self, file_path: str) -> Dict[str, List[str]]:
+        """Returns the columns of the given TSV file as a dict of column name to list of values."""
+        cache_path = self.ensure(file_path)
+        if cache_path is None:
+            rows = self.load(file_path)
+            return {column: [row[column] for row in rows] for column in (rows[0].keys() if rows else [])}
+        return load_cached(cache_path, as_columns=True)
+
+
+def load_cached(cache_path: str, as_columns=False):
+    """Reads a cache entry (see :meth:`TSVCache.ensure`) by memory-mapping it.
+
+    The returned rows/columns are read-only sequences comparing equal to lists of the same values. They decode a cell
+    only when it is accessed and keep the cache entry memory-mapped as long as they are referenced.
+
+    Parameters
+    ----------
+    cache_path:
+        the path of the cache entry
+    as_columns:
+        whether to return a dict of columns instead of a list of row dicts
+
+    Returns
+    -------
+        either a sequence of dicts (one per row) or a dict of sequences (one per column)
+    """
+    with open(cache_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError('Invalid TSV cache entry: %s' % cache_path)
+        # the memory-map stays valid after closing the file
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(_MAGIC)] != _MAGIC:
+        mm.close()
+        raise ValueError('Invalid TSV cache entry: %s' % cache_path)
+    meta_size, = _HEADER_SIZE.unpack_from(mm, len(_MAGIC))
+    start = len(_MAGIC) + _HEADER_SIZE.size
+    meta = json.loads(mm[start:start + meta_size])
+    start += meta_size
+    columns = {}
+    for column, size in zip(meta['columns'], meta['sizes']):
+        columns[column] = _Column(mm, start, meta['rows'], frozenset(meta['nulls'].get(column, [])))
+        start += size
+    if as_columns:
+        return columns
+    return _Rows(columns)
@@ -1,5 +1,9 @@
+import functools
 import logging
 import os
+import re
+import sys
+from typing import List
 
 FILE_READERS = {}
 FILE_WRITERS = {}
@@ -7,8 +11,50 @@ FILE_WRITERS = {}
 LOGGER = logging.getLogger(__file__)
 
 
+# maximum number of distinct file names to keep parsed results of
+PARSE_CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_bids_name(base_name: str):
+    """Parses a file name (without path segments) to a tuple (entities, suffix, extension, keys) or None if not a BIDS
+    name. The entities are returned as a tuple of key-value tuples, keys is the tuple of distinct entity keys in order
+    of appearance. All strings are interned as they repeat across files."""
+    stem, dot, extension = base_name.partition(os.extsep)
+    if not dot:
+        # if extension missing, then not a valid BIDS file
+        return None
+
+    underscore_parts = stem.split('_')
+    if len(underscore_parts) < 2:
+        return None
+
+    # last segment must be suffix
+    suffix = underscore_parts.pop()
+    if '-' in suffix:
+        return None
+
+    entities = []
+    for part in underscore_parts:
+        key, dash, value = part.partition('-')
+        if not dash:
+            # not a key-value pair
+            return None
+        entities.append((sys.intern(key), sys.intern(value.partition('-')[0])))
+
+    keys = tuple(dict.fromkeys(key for key, _ in entities))
+    return tuple(entities), sys.intern(suffix), sys.intern(os.extsep + extension), keys
+
+
+def _get_base_name(name: str):
+    if os.sep in name or (os.altsep and os.altsep in name):
+        return os.path.basename(name)
+    return name
+
+
 def parse_bids_name(name: str):
     """Parses a given string (file name) according to the BIDS naming scheme.
+    Results are cached, i.e. parsing the same file name again is cheap.
 
     Parameters
     ----------
@@ -27,35 +73,61 @@ def parse_bids_name(name: str):
     {'entities': {'sub': '11', 'task': 'mixedgamblestask', 'run': '02'}, 'suffix': 'bold', 'extension': '.nii.gz'}
 
     """
-    base_name = os.path.basename(name)
-    parts = base_name.split(os.extsep, 1)
-    if len(parts) != 2:
-        # if extension missing, then not a valid BIDS file
+    parts = _parse_bids_name(_get_base_name(name))
+    if parts is None:
         return None
+    entities, suffix, extension, _ = parts
+    return {
+        'entities': dict(entities),
+        'suffix': suffix,
+        'extension': extension
+    }
 
-    extension = os.extsep + parts[1]
-    underscore_parts = parts[0].split('_')
 
-    if len(underscore_parts) < 2:
-        return None
+def parse_bids_names(names: List[str]):
+    """Parses the given file names according to the BIDS naming scheme, see :func:`parse_bids_name`.
 
-    # last segment must be suffix
-    suffix = underscore_parts[-1]
-    if '-' in suffix:
-        return None
+    Parameters
+    ----------
+    names
+        The file names to parse. Any path segments will be ignored.
 
-    entities = {}
-    for i in range(0, len(underscore_parts) - 1):
-        dash_parts = underscore_parts[i].split('-')
-        if len(dash_parts) < 2:
-            # not a key-value pair
-            return None
-        entities[dash_parts[0]] = dash_parts[1]
+    Returns
+    -------
+    dict
+        A dictionary of columns (lists) with one row per given name: 'suffix', 'extension', 'keys' and 'entities',
+        the latter being a dict of entity key to its column of values. 'keys' holds the tuple of entity keys of
+        each name in order of appearance. Columns contain None if a name does not have a value, i.e. suffix,
+        extension and keys are None if the name is not a valid BIDS name.
+
+    Examples
+    --------
 
+    >>> parse_bids_names(["sub-11_task-rest_bold.nii.gz", "sub-12_T1w.nii.gz", "README"])
+    {'suffix': ['bold', 'T1w', None], 'extension': ['.nii.gz', '.nii.gz', None],
+     'keys': [('sub', 'task'), ('sub',), None], 'entities': {'sub': ['11', '12', None], 'task': ['rest', None, None]}}
+
+    """
+    num_rows = len(names)
+    suffixes = [None] * num_rows
+    extensions = [None] * num_rows
+    keys = [None] * num_rows
+    entities = {}
+    for row, name in enumerate(names):
+        parts = _parse_bids_name(_get_base_name(name))
+        if parts is None:
+            continue
+        row_entities, suffixes[row], extensions[row], keys[row] = parts
+        for key, value in row_entities:
+            column = entities.get(key)
+            if column is None:
+                column = entities[key] = [None] * num_rows
+            column[row] = value
     return {
-        'entities': entities,
-        'suffix': suffix,
-        'extension': extension
+        'suffix': suffixes,
+        'extension': extensions,
+        'keys': keys,
+        'entities': entities
     }
 
 
@@ -199,6 +271,163 @@ def fetch_dataset(dataset_id: str, output_dir='~/.ancp-bids/datasets'):
     return output_path
 
 
+def _translate_ignore_glob(glob: str) -> str:
+    """Translates the glob of a gitignore pattern (without negation and trailing slash) to a regular expression."""
+    result = []
+    i, n = 0, len(glob)
+    while i < n:
+        c = glob[i]
+        if c == '*':
+            if glob.startswith('**', i) and (i == 0 or glob[i - 1] == '/'):
+                if i + 2 == n:
+                    # trailing "/**" matches everything inside (but not the directory itself)
+                    result.append('.+')
+                    i += 2
+                    continue
+                if glob[i + 2] == '/':
+                    # leading "**/" or inner "/**/" matches zero or more directories
+                    result.append('(?:.*/)?')
+                    i += 3
+                    continue
+            while i < n and glob[i] == '*':
+                i += 1
+            result.append('[^/]*')
+            continue
+        if c == '?':
+            result.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and glob[j] in '!^':
+                j += 1
+            # a "]" right after the opening bracket (or negation) is part of the set
+            if j < n and glob[j] == ']':
+                j += 1
+            j = glob.find(']', j)
+            if j < 0:
+                # not a set, the bracket is matched literally
+                result.append(re.escape(c))
+            else:
+                result.append(_translate_ignore_set(glob[i + 1:j]))
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            result.append(re.escape(glob[i]))
+        else:
+            result.append(re.escape(c))
+        i += 1
+    return ''.join(result)
+
+
+def _translate_ignore_set(content: str) -> str:
+    """Translates the content of a bracket expression to a regular expression matching a single character,
+    the bracket expression is matched literally if it is not valid (for example "[z-a]"), same as by fnmatch."""
+    literal = re.escape('[%s]' % content)
+    negated = content[:1] in ('!', '^')
+    if negated:
+        content = content[1:]
+    # escape characters which are special within a regular expression set but not within a glob set
+    content = re.sub(r'([\\\[&~|^])', r'\\\1', content)
+    regex = '[%s%s]' % ('^' if negated else '', content)
+    try:
+        re.compile(regex)
+    except re.error:
+        return literal
+    return regex
+
+
+def _translate_ignore_pattern(pattern: str):
+    """Translates a single gitignore pattern to a tuple (negated, anchored, dir_only, regex)
+    or None if the line is not a pattern."""
+    if pattern.endswith('\n'):
+        pattern = pattern[:-1]
+    # trailing spaces are ignored unless escaped
+    stripped = pattern.rstrip()
+    if stripped.endswith('\\') and len(stripped) < len(pattern):
+        stripped += ' '
+    pattern = stripped.lstrip()
+    if not pattern or pattern.startswith('#'):
+        return None
+    negated = pattern.startswith('!')
+    if negated:
+        pattern = pattern[1:]
+    elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+        return None
+    # a pattern containing a slash (other than a trailing one) is relative to the root, else it matches at any level
+    anchored = '/' in pattern
+    return negated, anchored, dir_only, _translate_ignore_glob(pattern.lstrip('/'))
+
+
+def _compile_ignore_run(translated_patterns):
+    """Combines translated patterns of the same kind (exclude or re-include) to a single regular expression."""
+    groups = {}
+    for negated, anchored, dir_only, regex in translated_patterns:
+        groups.setdefault((negated, anchored, dir_only), []).append(regex)
+    alternatives = []
+    for (negated, anchored, dir_only), regexes in groups.items():
+        # directories are matched with a trailing slash, any path below an ignored directory is ignored as well
+        # whereas re-including a directory does not re-include its contents
+        if negated:
+            suffix = '/' if dir_only else '/?'
+        else:
+            suffix = '/.*' if dir_only else '(?:/.*)?'
+        alternatives.append('%s(?:%s)%s' % ('' if anchored else '(?:.*/)?', '|'.join(regexes), suffix))
+    return re.compile('|'.join(alternatives), re.DOTALL).fullmatch
+
+
+def compile_ignore_patterns(patterns: List[str]):
+    """Compiles a list of patterns following the gitignore semantics (as used by .bidsignore files)
+    to a matcher function.
+
+    Empty lines and comments (starting with '#') are skipped, patterns starting with '!' re-include paths excluded by
+    preceding patterns, patterns with a leading or inner '/' are anchored at the dataset root, patterns with a trailing
+    '/' match directories only and '**' matches across directories. The last matching pattern decides.
+
+    Parameters
+    ----------
+    patterns:
+        the gitignore patterns, for example the lines of a .bidsignore file
+
+    Returns
+    -------
+        a function `(relative_path: str, is_dir: bool = False) -> bool` returning whether the given path
+        (relative to the dataset root using '/' as separator) is ignored
+    """
+    # consecutive patterns of the same kind (exclude/re-include) are combined to a single regular expression,
+    # the runs are checked in reverse order, i.e. the first matching run decides
+    runs = []
+    for translated in filter(None, map(_translate_ignore_pattern, patterns)):
+        negated = translated[0]
+        if runs and runs[-1][0] == negated:
+            runs[-1][1].append(translated)
+        else:
+            runs.append((negated, [translated]))
+    runs = [(negated, _compile_ignore_run(run)) for negated, run in reversed(runs)]
+    # a leading re-include run cannot re-include anything
+    while runs and runs[-1][0]:
+        runs.pop()
+
+    if not runs:
+        return lambda relative_path, is_dir=False: False
+
+    if len(runs) == 1:
+        match = runs[0][1]
+        return lambda relative_path, is_dir=False: match(relative_path + '/' if is_dir else relative_path) is not None
+
+    def _is_ignored(relative_path: str, is_dir: bool = False) -> bool:
+        if is_dir:
+            relative_path += '/'
+        for negated, match in runs:
+            if match(relative_path):
+                return not negated
+        return False
+
+    return _is_ignored
+
+
 def resolve_segments(root_folder, path_, last_seg_file=False, create_if_missing=False):
     context = root_folder
     if path_:
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import unittest
+
+import ancpbids
+from ancpbids import aio
+from ..base_test_case import *
+
+
+class AsyncApiTestCase(BaseTestCase):
+    def test_load_and_query(self):
+        async def _run():
+            datasets = await asyncio.gather(ancpbids.aload_dataset(DS005_DIR), ancpbids.aload_dataset(SYNTHETIC_DIR),
+                                            ancpbids.aload_dataset(DS005_DIR, subjects=['01']))
+            bold_files = await ancpbids.aquery(datasets[0], sub='01', suffix='bold', extension='.nii.gz')
+            metadata = await ancpbids.aget_metadata(bold_files[0])
+            events = await ancpbids.acontents(bold_files[0].sidecar(suffix='events', extension='.tsv')[0])
+            return datasets, bold_files, metadata, events
+
+        datasets, bold_files, metadata, events = asyncio.run(_run())
+        self.assertEqual(['ds005', 'synthetic', 'ds005'], [ds.name for ds in datasets])
+        self.assertEqual(['sub-01'], [s.name for s in datasets[2].subjects])
+        self.assertEqual(3, len(bold_files))
+        self.assertEqual(2.0, metadata['RepetitionTime'])
+        self.assertEqual(86, len(events))
+
+    def test_stream(self):
+        dataset = ancpbids.load_dataset(DS005_DIR)
+
+        async def _run():
+            return await ancpbids.aquery(dataset, suffix='bold', return_type='files', stream=True, limit=5)
+
+        # a stream is consumed within the executor, the event loop receives a list
+        result = asyncio.run(_run())
+        self.assertTrue(isinstance(result, list))
+        self.assertEqual(dataset.query(suffix='bold', return_type='files')[:5], result)
+
+    def test_executor(self):
+        thread_names = []
+
+        def _record():
+            thread_names.append(threading.current_thread().name)
+
+        async def _run():
+            await asyncio.gather(*[aio.run_blocking(_record) for _ in range(4)])
+
+        try:
+            aio.configure(max_workers=1)
+            asyncio.run(_run())
+            # all blocking operations were executed by the single worker of the dedicated executor
+            self.assertEqual(1, len(set(thread_names)))
+            self.assertTrue(thread_names[0].startswith('ancpbids-aio'))
+        finally:
+            aio.configure()
+
+
+if __name__ == '__main__':
+    unittest.main()
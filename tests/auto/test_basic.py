@@ -1,7 +1,9 @@
+import copy
 import os.path
 
 from ancpbids import load_dataset, DatasetOptions
-from ancpbids.utils import parse_bids_name
+from ancpbids.model_base import EntityRef, File, Folder
+from ancpbids.utils import parse_bids_name, parse_bids_names
 from ..base_test_case import *
 
 
@@ -23,6 +25,18 @@ class BasicTestCase(BaseTestCase):
         self.assertEqual(['11', 'mixedgamblestask', '02'], list(bids_obj['entities'].values()))
         self.assertEqual('bold', bids_obj['suffix'])
         self.assertEqual('.nii.gz', bids_obj['extension'])
+        # cached results must not be affected by modifications of returned objects
+        bids_obj['entities']['sub'] = '12'
+        self.assertEqual('11', parse_bids_name("sub-11_task-mixedgamblestask_run-02_bold.nii.gz")['entities']['sub'])
+        self.assertEqual(bids_obj['suffix'], parse_bids_name("/path/to/sub-11_task-x_bold.nii.gz")['suffix'])
+
+    def test_parse_bids_names(self):
+        columns = parse_bids_names(["sub-11_task-mixedgamblestask_run-02_bold.nii.gz", "sub-12_T1w.nii.gz", "README"])
+        self.assertEqual(['bold', 'T1w', None], columns['suffix'])
+        self.assertEqual(['.nii.gz', '.nii.gz', None], columns['extension'])
+        self.assertEqual([('sub', 'task', 'run'), ('sub',), None], columns['keys'])
+        self.assertEqual({'sub': ['11', '12', None], 'task': ['mixedgamblestask', None, None],
+                          'run': ['02', None, None]}, columns['entities'])
 
     def test_ds005_basic_structure(self):
         ds005 = load_dataset(DS005_DIR)
@@ -77,6 +91,72 @@ class BasicTestCase(BaseTestCase):
         self.assertEqual("sub-01_task-mixedgamblestask_run-02_events.tsv", tsvfiles[1].name)
         self.assertEqual("sub-01_task-mixedgamblestask_run-03_events.tsv", tsvfiles[2].name)
 
+    def _expected_graph(self, ds_dir, schema):
+        # the graph as derived from the file system and the BIDS naming scheme, independent of the loader
+        datatypes = {e.value['value'] for e in schema.DatatypeEnum}
+        expected = {}
+        for dir_path, dir_names, file_names in os.walk(ds_dir):
+            rel_dir = os.path.relpath(dir_path, ds_dir).replace(os.sep, '/')
+            parent = expected.get(rel_dir)
+            for name in dir_names:
+                rel_path = name if rel_dir == '.' else rel_dir + '/' + name
+                if rel_path.startswith('derivatives/'):
+                    typ = schema.DerivativeFolder
+                elif rel_dir == '.' and name.startswith('sub-'):
+                    typ = schema.Subject
+                elif parent and parent[0] is schema.Subject and name.startswith('ses-'):
+                    typ = schema.SessionFolder
+                elif parent and parent[0] in (schema.Subject, schema.SessionFolder) and name in datatypes:
+                    typ = schema.DatatypeFolder
+                else:
+                    typ = schema.Folder
+                datatype = name if typ is schema.DatatypeFolder else parent[3] if parent else None
+                expected[rel_path] = (typ, None, None, datatype, None)
+            for name in file_names:
+                rel_path = name if rel_dir == '.' else rel_dir + '/' + name
+                parts = parse_bids_name(name)
+                if name.endswith('.json'):
+                    types = (schema.MetadataArtifact, schema.MetadataFile)
+                elif name.endswith('.tsv'):
+                    types = (schema.TSVArtifact, schema.TSVFile)
+                else:
+                    types = (schema.Artifact, schema.File)
+                if parts:
+                    entities = [(key, schema.process_entity_value(key, value))
+                                for key, value in parts['entities'].items()]
+                    datatype = parent[3] if parent else None
+                    expected[rel_path] = (types[0], parts['suffix'], parts['extension'], datatype, entities)
+                else:
+                    expected[rel_path] = (types[1], None, None, None, None)
+        return expected
+
+    def _loaded_graph(self, dataset):
+        schema = dataset.get_schema()
+        loaded = {}
+        for node in dataset.to_generator():
+            if node is dataset or not isinstance(node, (schema.Folder, schema.File)):
+                continue
+            if isinstance(node, schema.Artifact):
+                entities = [(entity.key, entity.value) for entity in node.entities]
+                loaded[node.get_relative_path()] = (type(node), node.suffix, node.extension, node.datatype, entities)
+            elif isinstance(node, schema.Folder):
+                folders = [node] + list(node.iterancestors())
+                datatype = next((folder.name for folder in folders if isinstance(folder, schema.DatatypeFolder)), None)
+                loaded[node.get_relative_path()] = (type(node), None, None, datatype, None)
+            else:
+                loaded[node.get_relative_path()] = (type(node), None, None, None, None)
+        return loaded
+
+    def test_loaded_graph(self):
+        # the graph must match the file system: node types, names (paths), entities and the inferred datatype
+        for ds_dir in [DS005_DIR, SYNTHETIC_DIR]:
+            dataset = load_dataset(ds_dir, DatasetOptions(ignore=False))
+            expected = self._expected_graph(ds_dir, dataset.get_schema())
+            loaded = self._loaded_graph(dataset)
+            self.assertEqual(sorted(expected), sorted(loaded), ds_dir)
+            for rel_path, node in expected.items():
+                self.assertEqual(node, loaded[rel_path], rel_path)
+
     def test_json_file_contents(self):
         ds005 = load_dataset(DS005_DIR)
         dataset_description = ds005.load_file_contents("dataset_description.json")
@@ -130,6 +210,18 @@ class BasicTestCase(BaseTestCase):
             ds005.to_generator(depth_first=True, depth=1, filter_=lambda n: isinstance(n, schema.File)))
         self.assertEqual(8, len(all_direct_files))
 
+    def test_to_generator_skips_contents(self):
+        ds005 = load_dataset(DS005_DIR)
+        expected = [n.get_node_id() for n in ds005.to_generator()]
+        ds005 = load_dataset(DS005_DIR, DatasetOptions(load_contents=True))
+        participants = ds005.get_file('participants.tsv')
+        self.assertEqual(16, len(participants.contents))
+        # loaded contents are not traversed even if they happen to contain model objects
+        participants.contents.append(ds005.get_schema().EntityRef(key='sub', value='17'))
+        nodes = list(ds005.to_generator())
+        self.assertEqual(len(expected), len(nodes))
+        self.assertNotIn(participants.contents[-1], nodes)
+
     def test_get_files_and_folders(self):
         ds005 = load_dataset(DS005_DIR)
 
@@ -169,15 +261,119 @@ class BasicTestCase(BaseTestCase):
         self.assertEqual(ds_path, ds_path_norm)
 
     def test_datatype_of_artifact(self):
-        ds005 = load_dataset(DS005_DIR)
+        ds005 = load_dataset(DS005_DIR, DatasetOptions(infer_artifact_datatype=False))
         anat_files = ds005.query(scope="raw", sub="01", suffix="T1w")
         assert len(anat_files) == 1
         assert anat_files[0].datatype is None
 
-        ds005 = load_dataset(DS005_DIR, DatasetOptions(infer_artifact_datatype=True))
+        ds005 = load_dataset(DS005_DIR)
         anat_files = ds005.query(scope="raw", sub="01", suffix="T1w")
         assert len(anat_files) == 1
         assert anat_files[0].datatype == "anat"
 
+    def test_query_datatype(self):
+        ds005 = load_dataset(DS005_DIR)
+        func_files = ds005.query(scope="raw", sub="01", datatype="func")
+        self.assertEqual(7, len(func_files))
+        self.assertTrue(all(f.datatype == "func" for f in func_files))
+        self.assertEqual(["anat", "dwi", "func"], ds005.query(scope="raw", return_type="id", target="datatype"))
+        self.assertEqual(0, len(ds005.query(scope="raw", sub="01", datatype="fmap")))
+
+    def test_node_ids(self):
+        ds005 = load_dataset(DS005_DIR)
+        nodes = list(ds005.to_generator())
+        self.assertEqual(len(nodes), len({node.get_node_id() for node in nodes}))
+        graph_nodes = [node for node in nodes if isinstance(node, (File, Folder))]
+        self.assertEqual(len(graph_nodes), len(set(graph_nodes)))
+        for node in nodes[:50]:
+            self.assertIs(node, ds005.get_node(node.get_node_id()))
+
+        # nodes are equal if identical, comparing with plain dicts compares the contents
+        other = load_dataset(DS005_DIR)
+        self.assertNotEqual(ds005.dataset_description, other.dataset_description)
+        self.assertEqual(dict(ds005.dataset_description), other.dataset_description)
+
+        artifact = ds005.get_folder('sub-01').create_artifact()
+        self.assertIs(artifact, ds005.get_node(artifact.get_node_id()))
+        self.assertIsNone(other.get_node(artifact.get_node_id()))
+
+        # value objects compare by contents
+        bold = "sub-01/func/sub-01_task-mixedgamblestask_run-01_bold.nii.gz"
+        self.assertEqual(ds005.get_file(bold).entities, other.get_file(bold).entities)
+        self.assertEqual(EntityRef(key='sub', value='01'), other.get_file(bold).entities[0])
+
+        # copies are new nodes
+        for clone in (copy.copy(artifact), copy.deepcopy(artifact)):
+            self.assertNotEqual(artifact.get_node_id(), clone.get_node_id())
+            self.assertNotEqual(artifact, clone)
+            self.assertEqual(dict(artifact), clone)
+        clone = copy.deepcopy(other)
+        self.assertIsNone(clone.get_node(artifact.get_node_id()))
+        self.assertIsNone(clone.get_node(other.get_node_id()))
+        self.assertIs(clone, clone.get_node(clone.get_node_id()))
+
+    def test_path_table(self):
+        ds005 = load_dataset(DS005_DIR)
+        table = ds005.get_path_table()
+        self.assertTrue(table.complete)
+        for file in ds005.query(scope='all')[:100]:
+            self.assertIs(file, ds005.get_file(file.get_relative_path()))
+        sub01 = ds005.get_folder('sub-01')
+        self.assertIs(sub01, table.nodes['sub-01'])
+        self.assertIsNone(ds005.get_file('sub-01'))
+        self.assertIsNone(ds005.get_file('sub-01/func/missing.nii.gz'))
+        self.assertIsNone(sub01.get_file('../dataset_description.json'))
+
+        # the table is kept up-to-date instead of being rebuilt
+        sub01.create_folder(name='extra').create_folder(name='nested')
+        self.assertIsNotNone(ds005.get_folder('sub-01').get_folder('extra'))
+        self.assertIsNotNone(table.nodes[os.path.join('sub-01', 'extra', 'nested')])
+        sub01.get_folder('func').remove_file('sub-01_task-mixedgamblestask_run-01_events.tsv')
+        self.assertIsNone(ds005.get_file('sub-01/func/sub-01_task-mixedgamblestask_run-01_events.tsv'))
+        sub01.remove_folder('extra')
+        self.assertIsNone(sub01.get_folder('extra'))
+        self.assertNotIn(os.path.join('sub-01', 'extra', 'nested'), table.nodes)
+        artifact = sub01.create_artifact()
+        artifact.name = 'sub-01_new.txt'
+        self.assertIs(artifact, ds005.get_file('sub-01/sub-01_new.txt'))
+        self.assertIs(table, ds005.get_path_table())
+
+        # lazily loaded folders are not loaded to build the table
+        ds = load_dataset(DS005_DIR, DatasetOptions(lazy_subtrees=True))
+        self.assertFalse(ds.get_path_table().complete)
+        self.assertIsNotNone(ds.get_file('sub-03/anat/sub-03_T1w.nii.gz'))
+        self.assertIsNone(ds.get_file('sub-03/anat/missing.nii.gz'))
+
+    def test_child_map(self):
+        ds005 = load_dataset(DS005_DIR)
+        func = ds005.get_folder('sub-01').get_folder('func')
+        child_map = func.get_child_map()
+        self.assertEqual(len(func.files), len(child_map.files))
+        self.assertEqual('dataset_description.json', ds005.get_file('dataset_description.json').name)
+
+        artifact = func.create_artifact()
+        artifact.name = 'sub-01_new.txt'
+        self.assertIs(artifact, func.get_file('sub-01_new.txt'))
+        artifact.name = 'sub-01_renamed.txt'
+        self.assertIsNone(func.get_file('sub-01_new.txt'))
+        self.assertEqual([artifact], func.get_files('sub-01_renamed.txt'))
+
+        names = [f.name for f in func.files]
+        func.remove_file(names[0])
+        self.assertEqual(names[1:], [f.name for f in func.files])
+        self.assertIsNone(func.get_file(names[0]))
+        self.assertIs(child_map, func.get_child_map())
+
+        # duplicate names are all removed, same as before
+        for _ in range(2):
+            func.create_artifact().name = 'duplicate.txt'
+        func.remove_file('duplicate.txt')
+        self.assertEqual(names[1:], [f.name for f in func.files])
+
+        # assigning a new list rebuilds the map
+        func.files = func.files[:1]
+        self.assertIsNone(func.get_file(names[2]))
+        self.assertIs(func.files[0], func.get_file(names[1]))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+import ancpbids
+from ancpbids import Catalog
+from ..base_test_case import *
+
+
+class CatalogTestCase(BaseTestCase):
+    def test_query_across_datasets(self):
+        catalog = Catalog(DS005_DIR, SYNTHETIC_DIR)
+        self.assertEqual(['ds005', 'synthetic'], list(catalog.datasets.keys()))
+        datasets = [ancpbids.load_dataset(DS005_DIR), ancpbids.load_dataset(SYNTHETIC_DIR)]
+
+        for criteria in [dict(suffix='bold', extension='.nii.gz'), dict(sub=['01', '02'], run=1),
+                         dict(scope='all', sub='03', desc='*'), dict(regex_search=True, sub='0[12]', suffix='T1w')]:
+            expected = [path for ds in datasets for path in ds.query(return_type='files', **criteria)
+                        if ancpbids.utils.parse_bids_name(path)]
+            self.assertEqual(sorted(expected), sorted(catalog.query(return_type='files', **criteria)))
+
+        matches = catalog.query(sub='01', suffix='T1w')
+        # matches are ordered by dataset
+        self.assertEqual(['ds005'] + ['synthetic'] * len(datasets[1].query(sub='01', suffix='T1w')),
+                         [match.dataset for match in matches])
+        self.assertTrue(all(match.artifact.suffix == 'T1w' for match in matches))
+
+        self.assertEqual(['01', '02', '03', '04', '05'],
+                         catalog.query(return_type='id', target='subject', datasets=['synthetic']))
+        self.assertEqual(['anat', 'dwi', 'func'], catalog.query(return_type='id', target='datatype'))
+        self.assertEqual([], catalog.query(scope='fmriprep', sub='01', suffix='T1w'))
+        self.assertEqual({'synthetic'}, {match.dataset for match in catalog.query(scope='fmriprep')})
+
+    def test_duplicate_names(self):
+        catalog = Catalog(DS005_DIR)
+        with self.assertRaises(ValueError):
+            catalog.add(DS005_DIR)
+        catalog.add(DS005_DIR, name='ds005-copy')
+        self.assertEqual(2 * len(catalog.query(datasets=['ds005'])), len(catalog.query()))
+
+    def test_modified_datasets(self):
+        catalog = Catalog(DS005_DIR)
+        dataset = catalog.datasets['ds005']
+        self.assertEqual(3, len(catalog.query(sub='01', suffix='bold')))
+        # the index is rebuilt once a dataset is modified
+        func = dataset.get_folder('sub-01').get_folder('func')
+        artifact = func.create_artifact()
+        artifact.add_entities(sub='01', task='new')
+        artifact.suffix = 'bold'
+        artifact.extension = '.nii.gz'
+        artifact.name = 'sub-01_task-new_bold.nii.gz'
+        self.assertEqual(4, len(catalog.query(sub='01', suffix='bold')))
+        self.assertEqual(['mixedgamblestask', 'new'], catalog.query(return_type='id', target='task'))
+        func.remove_file(artifact.name)
+        self.assertEqual(3, len(catalog.query(sub='01', suffix='bold')))
+
+    def test_dataset_schemas(self):
+        from unittest import mock
+        dataset = ancpbids.load_dataset(DS005_DIR)
+        dataset._versioned_schema = ancpbids._get_schema_module('model_v1_8_0')
+        catalog = Catalog()
+        catalog.add_dataset(dataset)
+        catalog.add(SYNTHETIC_DIR)
+        # the criteria are processed using the schema of each dataset
+        with mock.patch.object(ancpbids.model_v1_8_0, 'fuzzy_match_entity_key',
+                               wraps=ancpbids.model_v1_8_0.fuzzy_match_entity_key) as fuzzy_match:
+            matches = catalog.query(subject='01', run='001')
+            fuzzy_match.assert_any_call('subject')
+        self.assertEqual({'ds005', 'synthetic'}, {match.dataset for match in matches})
+        self.assertEqual(catalog.query(sub='01', run=1), matches)
+
+    def test_ranges_and_targets(self):
+        from ancpbids.query import gt, between
+        catalog = Catalog(DS005_DIR)
+        dataset = catalog.datasets['ds005']
+        for criteria in [dict(run=gt(2)), dict(run=between(1, 2), suffix='bold'), dict(run=[gt(2), '1'])]:
+            expected = dataset.query(return_type='files', **criteria)
+            self.assertTrue(expected)
+            self.assertEqual(sorted(expected), sorted(catalog.query(return_type='files', **criteria)))
+        # the same targets as supported by query(), e.g. 'suffixes' targets the suffix column
+        for target in ['suffixes', 'extensions', 'datatype', 'run']:
+            self.assertEqual(dataset.query(return_type='id', target=target),
+                             catalog.query(return_type='id', target=target), target)
+
+
+if __name__ == '__main__':
+    unittest.main()
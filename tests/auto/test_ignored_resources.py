@@ -1,6 +1,7 @@
 import unittest
 
 from ancpbids import load_dataset, DatasetOptions
+from ancpbids.utils import compile_ignore_patterns
 from tests.base_test_case import DS005_DIR_IGNORED_RESOURCES
 
 
@@ -25,6 +26,52 @@ class IgnoredResourcesTestCase(unittest.TestCase):
 
         assert ds.get_file(".bidsignore") is None
 
+    def test_gitignore_semantics(self):
+        is_ignored = compile_ignore_patterns(["# a comment", "", "*.log", "!keep.log", "/build/", "doc/**/*.pdf",
+                                              "models"])
+        assert is_ignored("sub-01/x.log")
+        assert not is_ignored("sub-01/keep.log")
+        assert not is_ignored("# a comment")
+        # anchored and directory only
+        assert is_ignored("build", is_dir=True)
+        assert not is_ignored("build")
+        assert not is_ignored("src/build", is_dir=True)
+        assert is_ignored("build/main.c")
+        assert is_ignored("doc/a/b/c.pdf")
+        assert is_ignored("doc/c.pdf")
+        assert not is_ignored("src/doc/c.pdf")
+        # unanchored patterns match at any level including everything below
+        assert is_ignored("derivatives/models", is_dir=True)
+        assert is_ignored("models/model.json")
+        # re-including a directory does not re-include its contents
+        is_ignored = compile_ignore_patterns(["*", "!sub-*/"])
+        assert not is_ignored("sub-01", is_dir=True)
+        assert is_ignored("sub-01/func", is_dir=True)
+
+    def test_ignore_negation(self):
+        ds = load_dataset(DS005_DIR_IGNORED_RESOURCES, DatasetOptions(ignore=["*", "!*/", "!*.nii.gz"]))
+        assert ds.get_file("dataset_description.json") is None
+        assert len(ds.query(sub="01", suffix="bold")) == 1
+
+    def test_malformed_sets(self):
+        # bracket expressions which cannot be parsed as a set are matched literally, same as by fnmatch
+        is_ignored = compile_ignore_patterns(["foo[]", "a[]]b", "[z-a]", "[!]", "x[!a-c]y", "n[^]]"])
+        assert is_ignored("foo[]")
+        assert not is_ignored("foo")
+        # a "]" right after the opening bracket is part of the set
+        assert is_ignored("a]b")
+        assert not is_ignored("a[]]b")
+        assert is_ignored("[z-a]")
+        assert not is_ignored("z")
+        assert is_ignored("[!]")
+        assert is_ignored("xdy")
+        assert not is_ignored("xay")
+        assert is_ignored("nx")
+        assert not is_ignored("n]")
+
+        ds = load_dataset(DS005_DIR_IGNORED_RESOURCES, DatasetOptions(ignore=["foo[]", "a[]]b", "[z-a]", "[!]"]))
+        assert len(ds.query(scope="all")) == len(load_dataset(DS005_DIR_IGNORED_RESOURCES).query(scope="all"))
+
 
 if __name__ == '__main__':
     unittest.main()
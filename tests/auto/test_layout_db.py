@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import ancpbids
+from ancpbids.pybids_compat import BIDSLayout
+from ancpbids.layout_db import DATABASE_FILE_NAME
+from ..base_test_case import *
+
+
+class LayoutDatabaseTestCase(BaseTestCase):
+    def test_queries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            in_memory = BIDSLayout(DS005_DIR)
+            BIDSLayout(DS005_DIR, database_path=tmp)
+            self.assertTrue(os.path.isfile(os.path.join(tmp, DATABASE_FILE_NAME)))
+
+            layout = BIDSLayout(DS005_DIR, database_path=tmp)
+            # the database is up-to-date, the dataset is not loaded
+            self.assertIsNone(layout._dataset)
+            queries = [
+                dict(sub='01', suffix='bold', return_type='files'),
+                dict(sub=['02', '03'], run=[1, '02'], extension='tsv', return_type='files'),
+                dict(sub='0[1-3]', datatype='func', return_type='files'),
+                dict(task='mixed.*', regex_search=True, return_type='files'),
+                dict(scope='all', return_type='files'),
+                dict(scope='derivatives', return_type='files'),
+                dict(ses='*', return_type='files'),
+                dict(run=None, suffix='bold', return_type='files'),
+                dict(return_type='id', target='run'),
+                dict(return_type='id', target='suffix', sub='01'),
+                dict(return_type='id', target='datatype'),
+                dict(run=ancpbids.gt(1), sub='0[1-3]', return_type='files'),
+                dict(run=[ancpbids.lt(2), 3], return_type='files'),
+                dict(sub=ancpbids.between(1, 3), return_type='files'),
+                dict(return_type='id', target='suffixes'),
+                dict(suffix='bold', sorter=lambda a: a.name, return_type='files'),
+            ]
+            for query in queries:
+                self.assertEqual(in_memory.get(**query), layout.get(**query), query)
+            self.assertEqual([in_memory.get(**query) for query in queries], layout.get_many(queries))
+            self.assertEqual([in_memory.get(**query) for query in queries], in_memory.get_many(queries))
+            self.assertEqual(in_memory.get_subjects(), layout.get_subjects())
+            self.assertIsNone(layout.get(scope='unknown', return_type='files'))
+
+            path = "sub-01/func/sub-01_task-mixedgamblestask_run-01_bold.nii.gz"
+            self.assertEqual(in_memory.get_metadata(os.path.join(in_memory.dataset.base_dir_, path)),
+                             layout.get_metadata(path))
+            self.assertEqual(in_memory.get_metadata(path, include_entities=True),
+                             layout.get_metadata(path, include_entities=True))
+            self.assertIsNone(layout._dataset)
+
+            # objects are returned from the in-memory graph, loaded on demand
+            self.assertEqual(len(in_memory.get(sub='01')), len(layout.get(sub='01')))
+            self.assertIsNotNone(layout._dataset)
+
+    def test_modified_dataset(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            BIDSLayout(DS005_DIR, database_path=tmp)
+            layout = BIDSLayout(DS005_DIR, database_path=tmp)
+            self.assertEqual(3, len(layout.get(sub='01', suffix='bold', return_type='files')))
+            # once the in-memory dataset is modified, queries are answered by it instead of the database
+            func = layout.dataset.get_folder('sub-01').get_folder('func')
+            artifact = func.create_artifact()
+            artifact.add_entities(sub='01', task='new')
+            artifact.suffix = 'bold'
+            artifact.extension = '.nii.gz'
+            artifact.name = 'sub-01_task-new_bold.nii.gz'
+            layout.dataset.mark_modified()
+            self.assertEqual(4, len(layout.get(sub='01', suffix='bold', return_type='files')))
+            self.assertEqual(['mixedgamblestask', 'new'], layout.get(return_type='id', target='task'))
+            self.assertEqual([['mixedgamblestask', 'new']], layout.get_many([dict(return_type='id', target='task')]))
+
+            # the database does not describe an assigned dataset either
+            layout = BIDSLayout(DS005_DIR, database_path=tmp)
+            layout.dataset = ancpbids.load_dataset(DS005_SMALL_DIR)
+            self.assertEqual(layout.dataset.query(return_type='id', target='sub'),
+                             layout.get(return_type='id', target='sub'))
+
+    def test_repeated_entity_keys(self):
+        dataset = ancpbids.load_dataset(DS005_DIR)
+        artifact = dataset.query(sub='01', run=1, suffix='bold')[0]
+        entity = dataset.get_schema().EntityRef()
+        entity.key = 'run'
+        entity.value = 3
+        artifact.entities.append(entity)
+        dataset.mark_modified()
+        with tempfile.TemporaryDirectory() as tmp:
+            from ancpbids.layout_db import LayoutDatabase
+            with LayoutDatabase(tmp) as database:
+                database.build(dataset)
+                # only the first value of a repeated key is matched, same as by the in-memory query
+                for query in [dict(run=3), dict(run=ancpbids.gt(2)), dict(sub='01', run='*')]:
+                    self.assertEqual(dataset.query(return_type='files', **query), database.query(**query), query)
+                self.assertEqual(dataset.query(return_type='id', target='run', sub='01'),
+                                 database.query(return_type='id', target='run', sub='01'))
+
+    def test_pagination(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            in_memory = BIDSLayout(SYNTHETIC_DIR)
+            BIDSLayout(SYNTHETIC_DIR, database_path=tmp)
+            layout = BIDSLayout(SYNTHETIC_DIR, database_path=tmp)
+            files = in_memory.get(scope='all', return_type='files')
+            self.assertEqual(files, layout.get(scope='all', return_type='files'))
+            for limit, offset in [(10, 0), (10, 25), (None, 100), (5, len(files))]:
+                expected = files[offset:None if limit is None else offset + limit]
+                self.assertEqual(expected, layout.get(scope='all', return_type='files', limit=limit, offset=offset))
+                self.assertEqual(expected, list(layout.get(scope='all', return_type='files', limit=limit,
+                                                           offset=offset, stream=True)))
+            self.assertEqual(in_memory.get(sub='02', return_type='files'),
+                             list(layout.get(sub='02', return_type='files', stream=True)))
+            self.assertRaises(ValueError, layout.get, return_type='id', target='sub', limit=1)
+            self.assertIsNone(layout._dataset)
+
+    def test_staleness(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ds_dir = os.path.join(tmp, 'ds005-small')
+            shutil.copytree(DS005_SMALL_DIR, ds_dir)
+            database_path = os.path.join(tmp, 'index.db')
+            BIDSLayout(ds_dir, database_path=database_path)
+            layout = BIDSLayout(ds_dir, database_path=database_path)
+            self.assertFalse(layout.database.is_stale(ds_dir))
+            self.assertEqual(['01'], layout.get_subjects())
+
+            sidecar = os.path.join(ds_dir, 'task-mixedgamblestask_bold.json')
+            with open(sidecar) as f:
+                metadata = json.load(f)
+            metadata['TaskName'] = 'changed'
+            with open(sidecar, 'w') as f:
+                json.dump(metadata, f)
+            os.makedirs(os.path.join(ds_dir, 'sub-02', 'anat'))
+            open(os.path.join(ds_dir, 'sub-02', 'anat', 'sub-02_T1w.nii.gz'), 'w').close()
+            # make sure the changes are visible on file systems with coarse timestamps
+            os.utime(sidecar, ns=(0, 0))
+            os.utime(ds_dir, ns=(0, 0))
+            self.assertTrue(layout.database.is_stale(ds_dir))
+
+            layout = BIDSLayout(ds_dir, database_path=database_path)
+            self.assertIsNotNone(layout._dataset)
+            self.assertEqual(['01', '02'], layout.get_subjects())
+            path = "sub-01/func/sub-01_task-mixedgamblestask_run-01_bold.nii.gz"
+            self.assertEqual('changed', layout.get_metadata(path)['TaskName'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,6 +27,31 @@ class LazyLoadingTestCase(unittest.TestCase):
         gc.collect()
         self.assertIsNone(ref())
         self.assertEqual(16, len(participants.contents))
+    def test_lazy_subtrees(self):
+        ds = load_dataset(DS005_DIR)
+        lazy_ds = load_dataset(DS005_DIR, DatasetOptions(lazy_subtrees=True))
+
+        def _is_placeholder(folder):
+            return 'lazy_loader_' in folder.__dict__
+
+        self.assertEqual(16, len(lazy_ds.subjects))
+        self.assertTrue(all(_is_placeholder(subject) for subject in lazy_ds.subjects))
+        self.assertTrue(all(_is_placeholder(folder) for folder in lazy_ds.derivatives.folders))
+
+        # only the matching subject is scanned
+        self.assertEqual(ds.query(sub='02', return_type='files'), lazy_ds.query(sub='02', return_type='files'))
+        self.assertEqual(['sub-02'], [s.name for s in lazy_ds.subjects if not _is_placeholder(s)])
+        self.assertTrue(all(_is_placeholder(folder) for folder in lazy_ds.derivatives.folders))
+
+        # accessing members scans the folder
+        sub_03 = lazy_ds.get_folder('sub-03')
+        self.assertEqual(['anat', 'dwi', 'func'], [f.name for f in sub_03.datatypes])
+        self.assertFalse(_is_placeholder(sub_03))
+        self.assertTrue(_is_placeholder(lazy_ds.get_folder('sub-01')))
+
+        self.assertEqual(ds.query(scope='all', return_type='files'), lazy_ds.query(scope='all', return_type='files'))
+        self.assertFalse(any(_is_placeholder(folder) for folder in lazy_ds.derivatives.folders))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ancpbids import load_dataset, validate_dataset, DatasetOptions
+from ..base_test_case import *
+
+
+class PartialLoadingTestCase(BaseTestCase):
+    def test_subjects_and_datatypes(self):
+        ds = load_dataset(DS005_DIR, subjects=['01', 'sub-03'], datatypes=['func'], include_derivatives=False)
+        self.assertEqual(['sub-01', 'sub-03'], [s.name for s in ds.subjects])
+        self.assertEqual([['func'], ['func']], [[d.name for d in s.datatypes] for s in ds.subjects])
+        self.assertIsNone(ds.derivatives)
+        # top-level files are kept, i.e. inheritance of metadata still works
+        self.assertIsNotNone(ds.dataset_description)
+        self.assertIsNotNone(ds.get_file('participants.tsv'))
+        self.assertEqual(['01', '03'], ds.query(target='sub'))
+        bold = ds.get_file("sub-01/func/sub-01_task-mixedgamblestask_run-01_bold.nii.gz")
+        self.assertEqual(2.0, bold.get_metadata()['RepetitionTime'])
+        # slicing must not introduce validation errors, the models folder of ds005 is reported in either case
+        full_errors = [e['message'] for e in validate_dataset(load_dataset(DS005_DIR)).get_errors()]
+        for error in validate_dataset(ds).get_errors():
+            self.assertIn(error['message'], full_errors)
+
+    def test_sessions_and_derivatives(self):
+        full = load_dataset(SYNTHETIC_DIR)
+        ds = load_dataset(SYNTHETIC_DIR, DatasetOptions(subjects=['02']), sessions='01',
+                          include_derivatives=['fmriprep'])
+        self.assertEqual(['02'], ds.options.subjects)
+        self.assertEqual(['sub-02'], [s.name for s in ds.subjects])
+        self.assertEqual(['ses-01'], [s.name for s in ds.subjects[0].sessions])
+        self.assertEqual(full.query(scope='all', sub='02', ses='01', return_type='files'),
+                         ds.query(scope='all', sub='02', ses='01', return_type='files'))
+        self.assertEqual([], ds.query(scope='all', ses='02', return_type='files'))
+        self.assertEqual(['fmriprep'], [f.name for f in ds.derivatives.folders])
+        self.assertEqual(['sub-02'], [f.name for f in ds.derivatives.folders[0].folders])
+
+        ds = load_dataset(SYNTHETIC_DIR, include_derivatives=['other'])
+        self.assertEqual([], ds.derivatives.folders)
+        self.assertEqual(5, len(ds.subjects))
+
+    def test_dataset_level_folders(self):
+        # folders which are not subject-scoped are loaded when slicing, e.g. models, code or sourcedata
+        full = load_dataset(DS005_DIR)
+        ds = load_dataset(DS005_DIR, subjects=['01'], datatypes=['anat'])
+        self.assertEqual(['sub-01'], [s.name for s in ds.subjects])
+        self.assertEqual(['models'], [f.name for f in ds.folders])
+        self.assertEqual(full.query(scope='models', return_type='files'),
+                         ds.query(scope='models', return_type='files'))
+
+    def test_datatypes_in_derivatives(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ds_dir = os.path.join(tmp, 'synthetic')
+            shutil.copytree(SYNTHETIC_DIR, ds_dir)
+            session_dir = os.path.join(ds_dir, 'derivatives', 'fmriprep', 'sub-02', 'ses-01')
+            for folder, name in [('anat', 'sub-02_ses-01_desc-preproc_T1w.nii.gz'),
+                                 ('figures', 'sub-02_ses-01_desc-summary_bold.svg')]:
+                os.makedirs(os.path.join(session_dir, folder))
+                open(os.path.join(session_dir, folder, name), 'w').close()
+
+            ds = load_dataset(ds_dir, subjects=['02'], datatypes=['func'])
+            session = ds.derivatives.folders[0].get_folder('sub-02').get_folder('ses-01')
+            # datatype folders within derivatives are sliced as well, other folders are kept
+            self.assertEqual(['figures', 'func'], sorted(f.name for f in session.folders))
+            self.assertEqual([], ds.query(scope='all', suffix='T1w'))
+
+            ds = load_dataset(ds_dir, subjects=['02'], datatypes=['anat'])
+            session = ds.derivatives.folders[0].get_folder('sub-02').get_folder('ses-01')
+            self.assertEqual(['anat', 'figures'], sorted(f.name for f in session.folders))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -109,6 +109,191 @@ class QueryTestCase(BaseTestCase):
         file_paths = list(file_paths)
         self.assertEqual(3, len(file_paths))
 
+    def test_query_cache(self):
+        self.assertEqual(0, ancpbids.load_dataset(DS005_DIR).get_query_cache().info().maxsize)
+        ds = ancpbids.load_dataset(DS005_DIR, ancpbids.DatasetOptions(query_cache_size=128))
+        cache = ds.get_query_cache()
+        files = ds.query(sub='01', suffix='bold', return_type='files')
+        files.clear()
+        self.assertEqual(ds.query(sub='01', suffix='bold', return_type='files'),
+                         ds.query(suffix='bold', sub='01', return_type='files'))
+        self.assertEqual(3, len(ds.query(sub='01', suffix='bold', return_type='files')))
+        self.assertEqual([1, 2, 3], ds.query(target='run', sub=['02', '01']))
+        self.assertEqual([1, 2, 3], ds.query(target='run', sub=['01', '02']))
+        info = cache.info()
+        self.assertEqual((4, 2, 2), (info.hits, info.misses, info.currsize))
+        self.assertAlmostEqual(4 / 6, info.hit_rate)
+
+        # modifying the graph drops the cached results
+        func = ds.get_folder('sub-01').get_folder('func')
+        artifact = func.create_artifact()
+        artifact.add_entities(sub='01', task='new')
+        artifact.suffix = 'bold'
+        artifact.extension = '.nii.gz'
+        self.assertEqual(4, len(ds.query(sub='01', suffix='bold', return_type='files')))
+        self.assertEqual(1, cache.info().currsize)
+        func.remove_file(artifact.name)
+        self.assertEqual(3, len(ds.query(sub='01', suffix='bold', return_type='files')))
+
+        # so does assigning the members of files directly
+        bold = ds.query(sub='01', suffix='bold', extension='.nii.gz')[0]
+        bold.name = 'sub-01_task-renamed_bold.nii.gz'
+        self.assertIn(bold.get_absolute_path(), ds.query(sub='01', suffix='bold', return_type='filename'))
+        bold.suffix = 'T1w'
+        self.assertEqual(2, len(ds.query(sub='01', suffix='bold', return_type='files')))
+        next(e for e in bold.entities if e.key == 'sub').value = '02'
+        self.assertEqual(0, len(ds.query(sub='01', suffix='T1w', task='renamed')))
+        bold.entities = []
+        self.assertEqual(1, len(ds.query(suffix='T1w', task=None, sub=None)))
+
+        ds = ancpbids.load_dataset(DS005_DIR, ancpbids.DatasetOptions(query_cache_size=0))
+        ds.query(sub='01')
+        ds.query(sub='01')
+        info = ds.get_query_cache().info()
+        self.assertEqual((0, 2, 0), (info.hits, info.misses, info.currsize))
+
+    def test_entity_folder_pruning(self):
+        ds = ancpbids.load_dataset(SYNTHETIC_DIR)
+        schema = ds.get_schema()
+        expected = sorted(a.get_absolute_path() for a in ds.query(scope='all') if isinstance(a, schema.Artifact)
+                          and a.get_entity('sub') == '02' and a.get_entity('ses') == '01')
+        self.assertTrue(expected)
+        self.assertEqual(expected, sorted(ds.query(scope='all', sub='02', ses='01', return_type='files')))
+
+        # folders of other subjects/sessions are not searched (or even scanned, if loaded lazily)
+        lazy_ds = ancpbids.load_dataset(SYNTHETIC_DIR, ancpbids.DatasetOptions(lazy_subtrees=True))
+        self.assertEqual(expected, sorted(lazy_ds.query(scope='all', sub='02', ses='01', return_type='files')))
+        fmriprep = lazy_ds.derivatives.get_folder('fmriprep')
+        self.assertIn('lazy_loader_', fmriprep.get_folder('sub-01').__dict__)
+        self.assertIn('lazy_loader_', fmriprep.get_folder('sub-02').get_folder('ses-02').__dict__)
+        self.assertNotIn('lazy_loader_', fmriprep.get_folder('sub-02').get_folder('ses-01').__dict__)
+
+        # an artifact within a non-matching session folder is not even evaluated
+        artifact = ds.get_folder('sub-02').get_folder('ses-02').query(scope='all')[0]
+        next(e for e in artifact.entities if e.key == 'ses').value = '01'
+        ds.mark_modified()
+        self.assertEqual(expected, sorted(ds.query(scope='all', sub='02', ses='01', return_type='files')))
+
+    def test_pagination(self):
+        ds = ancpbids.load_dataset(SYNTHETIC_DIR)
+        files = ds.query(scope='all', return_type='files')
+        self.assertEqual(files[:10], ds.query(scope='all', return_type='files', limit=10))
+        self.assertEqual(files[25:35], ds.query(scope='all', return_type='files', limit=10, offset=25))
+        self.assertEqual(files[100:], ds.query(scope='all', return_type='files', offset=100))
+        self.assertEqual([], ds.query(scope='all', return_type='files', offset=len(files)))
+
+        stream = ds.query(scope='all', return_type='files', stream=True)
+        self.assertFalse(isinstance(stream, list))
+        self.assertEqual(files, list(stream))
+        # objects are paged through in the same (name) order as the unpaginated result
+        objects = ds.query(scope='all')
+        self.assertEqual(objects[5:15], ds.query(scope='all', limit=10, offset=5))
+        self.assertEqual(objects[5:15], list(ds.query(scope='all', offset=5, limit=10, stream=True)))
+        self.assertEqual(objects[100:], ds.query(scope='all', offset=100))
+        self.assertEqual(ds.query(sub='02')[:3], ds.query(sub='02', limit=3))
+        self.assertEqual(sorted(ds.query(sub='01'), key=lambda a: a.name),
+                         list(ds.query(sub='01', stream=True, sorter=lambda a: a.name)))
+
+        self.assertEqual([], list(ds.query(scope='unknown', stream=True)))
+        self.assertRaises(ValueError, ds.query, target='sub', limit=10)
+        self.assertRaises(ValueError, ds.query, return_type='dir', stream=True)
+        self.assertRaises(ValueError, ds.query, limit=-1)
+
+    def test_range_predicates(self):
+        ds = ancpbids.load_dataset(DS005_DIR)
+        self.assertEqual(ds.query(run=3, return_type='files'), ds.query(run=ancpbids.gt(2), return_type='files'))
+        self.assertEqual(ds.query(run=[2, 3], return_type='files'),
+                         ds.query(run=ancpbids.ge('02'), return_type='files'))
+        self.assertEqual(ds.query(run=[1, 2], sub='01', suffix='bold', return_type='files'),
+                         ds.query(run=ancpbids.between(1, 2), sub='01', suffix='bold', return_type='files'))
+        self.assertEqual(ds.query(run=[1, 3], return_type='files'),
+                         ds.query(run=[ancpbids.lt(2), ancpbids.gt(2)], return_type='files'))
+        self.assertEqual(ds.query(run=1, sub='01'), ds.query(run=ancpbids.le(1), sub='01'))
+        self.assertEqual([], ds.query(run=ancpbids.gt(3)))
+        # labels are never within a range
+        self.assertEqual([], ds.query(sub=ancpbids.gt(0)))
+        self.assertRaises(ValueError, ancpbids.gt, 'a')
+
+        # the entity index is rebuilt after modifying the graph
+        func = ds.get_folder('sub-01').get_folder('func')
+        artifact = func.create_artifact()
+        artifact.add_entities(sub='01', task='new', run=4)
+        artifact.suffix = 'bold'
+        artifact.extension = '.nii.gz'
+        self.assertEqual([artifact], ds.query(run=ancpbids.gt(3)))
+
+        ds = ancpbids.load_dataset(ENTITIES_DIR)
+        self.assertEqual(3, len(ds.query(run=ancpbids.between(3, 3), return_type='files')))
+
+    def test_index_lookups_lazy_subtrees(self):
+        ds = ancpbids.load_dataset(DS005_DIR)
+        lazy_ds = ancpbids.load_dataset(DS005_DIR, ancpbids.DatasetOptions(lazy_subtrees=True))
+        loaded = lambda: [s.name for s in lazy_ds.subjects if 'lazy_loader_' not in s.__dict__]
+        # subject criteria restrict range predicates and regular expressions to the folders of the subject
+        for query in [dict(sub='02', run=ancpbids.gt(1)), dict(sub='^02$', task='^mixed', regex_search=True),
+                      dict(sub='02', task='^mixed', suffix='bold$', regex_search=True)]:
+            self.assertEqual(ds.query(return_type='files', **query), lazy_ds.query(return_type='files', **query))
+        self.assertEqual(['sub-02'], loaded())
+        self.assertNotIn('entity_index_', lazy_ds.__dict__)
+        # unloaded folders are not indexed, queries searching them traverse (and load) them
+        self.assertEqual(ds.query(run=ancpbids.gt(1), return_type='files'),
+                         lazy_ds.query(run=ancpbids.gt(1), return_type='files'))
+        self.assertEqual(16, len(loaded()))
+        self.assertEqual(ds.query(run=ancpbids.lt(2), return_type='files'),
+                         lazy_ds.query(run=ancpbids.lt(2), return_type='files'))
+        index = lazy_ds.get_entity_index()
+        # unloaded derivatives are not searched by raw queries
+        self.assertTrue(index.unloaded)
+        self.assertTrue(all(isinstance(folder, lazy_ds.get_schema().DerivativeFolder) for folder in index.unloaded))
+        self.assertEqual(ds.query(scope='all', run=ancpbids.lt(2), return_type='files'),
+                         lazy_ds.query(scope='all', run=ancpbids.lt(2), return_type='files'))
+        self.assertIsNot(index, lazy_ds.get_entity_index())
+
+    def test_bulk_regex_search(self):
+        ds = ancpbids.load_dataset(DS005_DIR)
+        index = ds.get_entity_index()
+        artifacts = index.get_artifacts(index.search('sub', ['^0[12]$']))
+        self.assertEqual({'01', '02'}, {a.get_entity('sub') for a in artifacts})
+        self.assertEqual(len(ds.query(scope='all', sub=['01', '02'])), len(artifacts))
+        self.assertEqual(set(), index.search('sub', ['^1$']))
+        self.assertEqual(len(index.artifacts), len(index.search('suffix', [''])))
+        # expressions which could match across values are evaluated value by value
+        self.assertIsNone(index.search('sub', ['(?=0)1']))
+        self.assertIsNone(index.search('sub', ['1\\s*0']))
+
+        self.assertEqual(ds.query(sub=['01', '02'], suffix='bold', run=[1, 3], return_type='files'),
+                         ds.query(sub='^0[12]$', suffix='^bo', run='1|3', regex_search=True, return_type='files'))
+        self.assertEqual(ds.query(sub='01', return_type='files'),
+                         ds.query(sub='\\A01', regex_search=True, return_type='files'))
+        self.assertEqual(ds.query(extension='.tsv', return_type='files'),
+                         ds.query(extension='tsv$', regex_search=True, return_type='files'))
+
+    def test_query_many(self):
+        from unittest import mock
+        from ancpbids.plugins import plugin_schema_patches
+        ds = ancpbids.load_dataset(SYNTHETIC_DIR, ancpbids.DatasetOptions(query_cache_size=0))
+        queries = [dict(sub='01'), dict(sub='02', return_type='files'),
+                   dict(sub='01', suffix='bold', extension='.nii', scope='all'),
+                   dict(scope='derivatives', return_type='files'), dict(return_type='dir'),
+                   dict(target='sub', return_type='id'), dict(run=ancpbids.gt(1), return_type='files'),
+                   dict(limit=3, offset=2), dict(scope='self'), dict(scope='unknown'),
+                   dict(suffix='events', extension=['tsv', '.json']), dict(run=[1, '02'], return_type='files')]
+        self.assertEqual([ds.query(**query, task='nback') for query in queries], ds.query_many(queries, task='nback'))
+
+        # queries searching the same folder are evaluated in a single traversal: each node is expanded at most once
+        queries = [query for query in queries if query.get('scope') != 'derivatives']
+        children = mock.Mock(wraps=plugin_schema_patches.get_children)
+        with mock.patch.object(plugin_schema_patches, 'get_children', children):
+            ds.query_many(queries)
+        expanded = [call[0][0] for call in children.call_args_list]
+        self.assertEqual(len(expanded), len(set(map(id, expanded))))
+
+        self.assertEqual([[], ds.query(sub='01', return_type='files')],
+                         ds.query_many([dict(sub='01', suffix='unknown'), dict(sub='01')], return_type='files'))
+        self.assertEqual([], ds.query_many([]))
+        self.assertRaises(ValueError, ds.query_many, [dict(stream=True)])
+        self.assertRaises(ValueError, ds.query_many, [dict(target='sub', limit=1)])
+
 
 if __name__ == '__main__':
     unittest.main()
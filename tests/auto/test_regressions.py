@@ -20,6 +20,31 @@ class RegressionsTestCase(BaseTestCase):
         entities = dataset.query_entities(scope=None)
         self.assertEqual(['ds', 'type', 'subject', 'task', 'run', 'description'], list(entities.keys()))
 
+    def test_top_level_sidecar_types(self):
+        # every top-level JSON/TSV file is converted, including consecutive ones the former remove/append loop skipped
+        dataset = ancpbids.load_dataset(SYNTHETIC_DIR)
+        schema = dataset.get_schema()
+        types = {file.name: type(file) for file in dataset.files}
+        self.assertEqual(schema.MetadataFile, types['dataset_description.json'])
+        self.assertEqual(schema.TSVArtifact, types['task-nback_events.tsv'])
+        for name in ['task-nback_bold.json', 'task-nback_physio.json', 'task-nback_stim.json',
+                     'task-rest_bold.json', 'task-rest_physio.json']:
+            self.assertEqual(schema.MetadataArtifact, types[name], name)
+
+        dataset = ancpbids.load_dataset(DS005_DIR)
+        schema = dataset.get_schema()
+        types = {file.name: type(file) for file in dataset.files}
+        self.assertEqual(schema.MetadataFile, types['ds005_onsets.json'])
+        self.assertEqual(schema.MetadataArtifact, types['task-mixedgamblestask_bold.json'])
+
+    def test_top_level_sidecar_inheritance(self):
+        layout = ancpbids.BIDSLayout(SYNTHETIC_DIR)
+        metadata = layout.get_metadata('sub-04/ses-01/func/sub-04_ses-01_task-rest_physio.tsv.gz')
+        self.assertEqual({'SamplingFrequency': 10.0, 'StartTime': 0.0, 'Columns': ['respiratory', 'cardiac']},
+                         metadata)
+        metadata = layout.get_metadata('sub-04/ses-01/func/sub-04_ses-01_task-nback_run-01_stim.tsv.gz')
+        self.assertEqual({'SamplingFrequency': 2.0, 'StartTime': 0.0, 'Columns': ['stimA', 'stimB']}, metadata)
+
 
 if __name__ == '__main__':
     unittest.main()
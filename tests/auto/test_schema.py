@@ -1,3 +1,5 @@
+import subprocess
+import sys
 import unittest
 
 from ancpbids import model_v1_8_0, model_latest, load_dataset, load_schema
@@ -49,6 +51,34 @@ class SchemaTestCase(BaseTestCase):
         # in 1.10.0 the mrs modality was added
         self.assertTrue("motion" in [e.name for e in model_v1_10_0.ModalityEnum])
 
+    def test_lazy_schema_import(self):
+        # importing the package must not import any schema module, resolving a schema imports only that one
+        code = "import sys, ancpbids; " \
+               "print(sorted(m for m in sys.modules if m.startswith('ancpbids.model_v'))); " \
+               "ancpbids.load_schema(%r); " \
+               "print(sorted(m for m in sys.modules if m.startswith('ancpbids.model_v')))" % DS005_SMALL_DIR
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(["[]", "['ancpbids.model_v1_8_0']"], out.splitlines())
+
+    def test_lazy_catalog_import(self):
+        code = "import sys, ancpbids; print('ancpbids.catalog' in sys.modules); " \
+               "print(ancpbids.Catalog.__module__, 'ancpbids.catalog' in sys.modules)"
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(["False", "ancpbids.catalog True"], out.splitlines())
+
+    def test_late_schema_plugin(self):
+        # a SchemaPlugin registered after a schema module was patched must still be applied to it
+        code = "import ancpbids\n" \
+               "from ancpbids.plugin import SchemaPlugin, register_plugin\n" \
+               "class MarkerPlugin(SchemaPlugin):\n" \
+               "    def execute(self, schema):\n" \
+               "        schema.patched_by_ = schema.__dict__.get('patched_by_', []) + [self.props['name']]\n" \
+               "latest = ancpbids.model_latest\n" \
+               "register_plugin(MarkerPlugin, name='marker')\n" \
+               "print(latest.patched_by_)\n" \
+               "print(ancpbids.model_v1_8_0.patched_by_)\n"
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(["['marker']", "['marker']"], out.splitlines())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import ancpbids
+from ancpbids.shared_index import export_index, attach_index
+from ..base_test_case import *
+
+
+def _query_in_worker(index):
+    return index.query(sub='02', suffix='bold')
+
+
+class SharedIndexTestCase(BaseTestCase):
+    def _assert_queries(self, ds, index):
+        self.assertEqual(sorted(ds.query(sub='01', suffix='bold', return_type='files')),
+                         sorted(index.query(sub='01', suffix='bold')))
+        self.assertEqual(sorted(ds.query(run=['1', '2'], extension='tsv', return_type='files')),
+                         sorted(index.query(run=['1', '2'], extension='tsv')))
+        self.assertEqual(ds.query(target='run'), index.query(return_type='id', target='run'))
+        self.assertEqual([], index.query(ses='*'))
+        self.assertEqual(sorted(ds.query(sub='02', datatype='func', return_type='files')),
+                         sorted(index.query(sub='02', datatype='func')))
+
+    def test_shared_memory(self):
+        ds = ancpbids.load_dataset(DS005_DIR)
+        index = export_index(ds)
+        try:
+            schema = ds.get_schema()
+            self.assertEqual(len([a for a in ds.query() if isinstance(a, schema.Artifact)]), len(index))
+            self._assert_queries(ds, index)
+            with attach_index(index.name) as attached:
+                self._assert_queries(ds, attached)
+                row = attached.query(sub='01', suffix='T1w', return_type='dict')[0]
+                self.assertEqual({'sub': '01', 'suffix': 'T1w', 'extension': '.nii.gz', 'datatype': 'anat'},
+                                 {k: v for k, v in row.items() if k != 'path'})
+        finally:
+            index.unlink()
+
+    def test_file_and_workers(self):
+        ds = ancpbids.load_dataset(DS005_DIR)
+        with tempfile.TemporaryDirectory() as tmp:
+            index = export_index(ds, path=os.path.join(tmp, 'ds005.idx'))
+            self._assert_queries(ds, index)
+            self._assert_queries(ds, pickle.loads(pickle.dumps(index)))
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                self.assertEqual(sorted(ds.query(sub='02', suffix='bold', return_type='files')),
+                                 sorted(executor.submit(_query_in_worker, index).result()))
+            index.close()
+
+    def test_attach_from_process(self):
+        ds = ancpbids.load_dataset(DS005_DIR)
+        index = export_index(ds)
+        try:
+            code = "from ancpbids.shared_index import attach_index; " \
+                   "index = attach_index(%r); print(len(index.query(sub='02', suffix='bold'))); index.close()" % index.name
+            result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+            self.assertEqual('3', result.stdout.strip())
+            # the exiting process must neither destroy the segment nor report it as leaked
+            self.assertNotIn('leaked', result.stderr)
+            with attach_index(index.name) as attached:
+                self.assertEqual(len(index), len(attached))
+        finally:
+            index.unlink()
+
+    def test_query_semantics(self):
+        from ancpbids.query import gt
+        ds = ancpbids.load_dataset(DS005_DIR)
+        schema = ds.get_schema()
+        # a repeated entity key is matched by its first value only
+        artifact = ds.query(sub='01', run=1, suffix='bold')[0]
+        entity = schema.EntityRef()
+        entity.key = 'run'
+        entity.value = 3
+        artifact.entities.append(entity)
+        ds.mark_modified()
+        index = export_index(ds)
+        try:
+            for criteria in [dict(run=gt(2)), dict(run=[gt(2), '1'], suffix='bold'), dict(run=3)]:
+                expected = ds.query(return_type='files', **criteria)
+                self.assertTrue(expected)
+                self.assertEqual(sorted(expected), sorted(index.query(**criteria)))
+            for target in ['suffixes', 'extensions', 'run']:
+                self.assertEqual(ds.query(return_type='id', target=target),
+                                 index.query(return_type='id', target=target), target)
+            # no artifact has an echo entity
+            self.assertEqual([], ds.query(return_type='id', target='echo'))
+            self.assertEqual([], index.query(return_type='id', target='echo'))
+        finally:
+            index.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
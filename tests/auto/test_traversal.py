@@ -0,0 +1,66 @@
+import unittest
+
+from ancpbids import load_dataset
+from ancpbids.traversal import walk
+from ..base_test_case import *
+
+#       a
+#     / | \
+#    b  e  f
+#   / \     \
+#  c   d     g
+_TREE = {'a': ['b', 'e', 'f'], 'b': ['c', 'd'], 'f': ['g']}
+
+
+def _walk(**kwargs):
+    return ''.join(walk('a', _TREE.get, **kwargs))
+
+
+class TraversalTestCase(BaseTestCase):
+    def test_orders(self):
+        self.assertEqual('abcdefg', _walk())
+        self.assertEqual('cdbegfa', _walk(post_order=True))
+        self.assertEqual('abefcdg', _walk(breadth_first=True))
+        self.assertRaises(ValueError, walk, 'a', _TREE.get, breadth_first=True, post_order=True)
+
+    def test_depth_prune_filter(self):
+        self.assertEqual('', _walk(max_depth=-1))
+        self.assertEqual('a', _walk(max_depth=0))
+        self.assertEqual('abef', _walk(max_depth=1))
+        self.assertEqual('befa', _walk(max_depth=1, post_order=True))
+        self.assertEqual('abef', _walk(max_depth=1, breadth_first=True))
+
+        for kwargs in [{}, dict(post_order=True), dict(breadth_first=True)]:
+            self.assertEqual({'a', 'e', 'f', 'g'}, set(_walk(prune=lambda n: n == 'b', **kwargs)))
+            self.assertEqual({'b', 'c', 'd'}, set(_walk(filter_=lambda n: n in 'bcd', **kwargs)))
+
+    def test_deep_tree(self):
+        ds005 = load_dataset(DS005_DIR)
+        schema = ds005.get_schema()
+        root = folder = schema.Folder(name='root')
+        # deeper than the recursion limit
+        for i in range(5000):
+            folder.folders.append(schema.Folder(name='folder%d' % i))
+            folder = folder.folders[0]
+        self.assertEqual(5001, len(list(root.to_generator(depth=10000))))
+        self.assertEqual('folder4999', next(root.to_generator(depth_first=True, depth=10000)).name)
+        self.assertEqual(11, len(list(root.to_generator(depth=10))))
+
+    def test_model_traversal(self):
+        ds005 = load_dataset(DS005_DIR)
+        schema = ds005.get_schema()
+        nodes = list(ds005.to_generator())
+        self.assertEqual(set(map(id, nodes)), set(map(id, ds005.to_generator(depth_first=True))))
+        self.assertEqual(set(map(id, nodes)), set(map(id, ds005.to_generator(breadth_first=True))))
+        # in pre-order, nodes not matching the filter are pruned including their subtrees
+        pruned = list(ds005.to_generator(filter_=lambda n: not isinstance(n, schema.Subject)))
+        self.assertFalse(any(isinstance(n, (schema.Subject, schema.DatatypeFolder)) for n in pruned))
+        self.assertTrue(any(isinstance(n, schema.Artifact) for n in pruned))
+        children = list(ds005.to_generator(breadth_first=True, depth=1))
+        self.assertIs(ds005, children[0])
+        self.assertEqual(16, len([n for n in children if isinstance(n, schema.Subject)]))
+        self.assertEqual(0, len(list(ds005.to_generator(prune=lambda n: n is ds005))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import glob
+import os
+import pickle
+import shutil
+import tempfile
+
+from ancpbids.plugins.plugin_files_handlers import read_tsv
+from ancpbids.tsv_cache import TSVCache
+from ..base_test_case import *
+
+
+class TSVCacheTestCase(BaseTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = TSVCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_same_as_csv(self):
+        tsv_files = glob.glob(os.path.join(RESOURCES_FOLDER, '**', '*.tsv'), recursive=True)
+        self.assertTrue(tsv_files)
+        for tsv_file in tsv_files:
+            # first call populates the cache, second call reads from it
+            self.assertEqual(read_tsv(tsv_file), self.cache.load(tsv_file))
+            self.assertEqual(read_tsv(tsv_file), self.cache.load(tsv_file))
+
+        participants = os.path.join(DS005_DIR, 'participants.tsv')
+        columns = self.cache.load_columns(participants)
+        self.assertEqual(['participant_id', 'sex', 'age'], list(columns.keys()))
+        self.assertEqual('sub-01', columns['participant_id'][0])
+
+    def test_invalidation(self):
+        tsv_file = os.path.join(self.cache_dir, 'events.tsv')
+        with open(tsv_file, 'w') as f:
+            f.write('onset\tduration\ttrial_type\n1.0\t0.5\tgo\n2.0\t0.5\n')
+        self.assertEqual([{'onset': '1.0', 'duration': '0.5', 'trial_type': 'go'},
+                          {'onset': '2.0', 'duration': '0.5', 'trial_type': None}], self.cache.load(tsv_file))
+        first_entry = self.cache.get_cache_path(tsv_file)
+        self.assertTrue(os.path.exists(first_entry))
+
+        with open(tsv_file, 'a') as f:
+            f.write('3.0\t0.5\tstop\n')
+        self.assertNotEqual(first_entry, self.cache.get_cache_path(tsv_file))
+        self.assertEqual(3, len(self.cache.load(tsv_file)))
+
+        # rows having more cells than the header cannot be cached, fall back to the plain reader
+        with open(tsv_file, 'w') as f:
+            f.write('onset\tduration\n1.0\t0.5\textra\n')
+        self.assertIsNone(self.cache.ensure(tsv_file))
+        self.assertEqual(read_tsv(tsv_file), self.cache.load(tsv_file))
+
+    def test_lazy_views(self):
+        tsv_file = os.path.join(self.cache_dir, 'events.tsv')
+        with open(tsv_file, 'w', encoding='utf-8') as f:
+            f.write('onset\tduration\ttrial_type\n1.0\t0.5\tgö\n2.0\t0.5\n3.0\t\tstop\n')
+        expected = read_tsv(tsv_file)
+        self.cache.load(tsv_file)
+        rows = self.cache.load(tsv_file)
+        self.assertFalse(isinstance(rows, list))
+        self.assertEqual(3, len(rows))
+        self.assertEqual(expected[0], rows[0])
+        self.assertEqual(expected[-1], rows[-1])
+        self.assertEqual(expected[1:], rows[1:])
+        self.assertEqual(expected, list(rows))
+        self.assertRaises(IndexError, rows.__getitem__, 3)
+
+        columns = self.cache.load_columns(tsv_file)
+        self.assertEqual(['gö', None, 'stop'], columns['trial_type'])
+        self.assertEqual('', columns['duration'][2])
+        self.assertEqual(['1.0', '2.0'], columns['onset'][:2])
+
+        # views are pickled as plain lists, for example when passed between processes
+        self.assertEqual(expected, pickle.loads(pickle.dumps(rows)))
+        self.assertTrue(isinstance(pickle.loads(pickle.dumps(columns['onset'])), list))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import fnmatch
+import random
+import timeit
+
+from ancpbids.utils import compile_ignore_patterns
+from ..base_test_case import *
+
+
+def _create_patterns(num_patterns):
+    rnd = random.Random(42)
+    patterns = ['# generated patterns', '']
+    for i in range(num_patterns):
+        kind = i % 5
+        if kind == 0:
+            patterns.append('*_acq-%d_*.nii.gz' % i)
+        elif kind == 1:
+            patterns.append('/derivatives/pipeline-%d/' % i)
+        elif kind == 2:
+            patterns.append('**/sub-%02d_task-%d_*' % (rnd.randint(0, 99), i))
+        elif kind == 3:
+            patterns.append('sourcedata/sub-%02d/**' % rnd.randint(0, 99))
+        else:
+            patterns.append('extra-%d' % i)
+    return patterns
+
+
+def _create_paths(num_paths):
+    rnd = random.Random(42)
+    paths = []
+    for i in range(num_paths):
+        sub = 'sub-%02d' % rnd.randint(0, 99)
+        name = '%s_task-%d_acq-%d_run-%d_bold.nii.gz' % (sub, rnd.randint(0, 200), rnd.randint(0, 200), i)
+        paths.append('/'.join([sub, rnd.choice(['anat', 'func', 'dwi']), name]))
+    return paths
+
+
+class BidsIgnoreBenchmarkTestCase(BaseTestCase):
+    def test_bidsignore_matching(self):
+        patterns = _create_patterns(200)
+        paths = _create_paths(100000)
+
+        stripped = [pattern.strip() for pattern in patterns]
+        # the matcher as previously used by the loader: one fnmatch call per pattern and path
+        fnmatch_matcher = lambda relative_path: next(
+            filter(lambda pattern: fnmatch.fnmatch(relative_path, pattern), stripped), False)
+        compiled_matcher = compile_ignore_patterns(patterns)
+
+        fnmatch_time = timeit.timeit(lambda: [fnmatch_matcher(path) for path in paths], number=1)
+        compiled_time = timeit.timeit(lambda: [compiled_matcher(path) for path in paths], number=1)
+        ignored = sum(compiled_matcher(path) for path in paths)
+        print('\n%d patterns, %d paths (%d ignored): fnmatch %.2f s, compiled %.2f s' % (
+            len(patterns), len(paths), ignored, fnmatch_time, compiled_time))
+        self.assertLess(compiled_time, fnmatch_time)
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+import timeit
+
+from ..base_test_case import *
+
+# cold start of the package only vs. the former eager behaviour of importing/patching all schema versions
+LAZY_IMPORT = "import ancpbids"
+EAGER_IMPORT = "import ancpbids; [getattr(ancpbids, m) for m in ancpbids.SCHEMA_MODULES]"
+
+
+class ImportTimeTestCase(BaseTestCase):
+    def _measure(self, code, repeat=10):
+        timer = timeit.Timer(lambda: subprocess.run([sys.executable, '-c', code], check=True))
+        return min(timer.repeat(repeat=repeat, number=1))
+
+    def test_cold_start(self):
+        lazy = self._measure(LAZY_IMPORT)
+        eager = self._measure(EAGER_IMPORT)
+        print('import ancpbids (lazy schemas): %.1f ms, all schemas: %.1f ms' % (lazy * 1000, eager * 1000))
+        self.assertLess(lazy, eager)
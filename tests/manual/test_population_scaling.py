@@ -0,0 +1,187 @@
+import json
+import shutil
+import tempfile
+import time
+
+import ancpbids
+from ..base_test_case import *
+
+
+def _create_flat_dataset(num_files):
+    """Creates a dataset with a single (flat) derivative folder containing `num_files` JSON sidecars."""
+    ds_dir = tempfile.mkdtemp()
+    with open(os.path.join(ds_dir, 'dataset_description.json'), 'w') as f:
+        json.dump({'Name': 'flat', 'BIDSVersion': '1.8.0'}, f)
+    flat_dir = os.path.join(ds_dir, 'derivatives', 'flat')
+    os.makedirs(flat_dir)
+    for i in range(num_files):
+        open(os.path.join(flat_dir, 'sub-%05d_task-rest_bold.json' % i), 'w').close()
+    return ds_dir
+
+
+def _create_cohort_dataset(num_subjects, files_per_subject=20):
+    """Creates a raw dataset of `num_subjects` subjects each having a func folder with `files_per_subject` files."""
+    ds_dir = tempfile.mkdtemp()
+    with open(os.path.join(ds_dir, 'dataset_description.json'), 'w') as f:
+        json.dump({'Name': 'cohort', 'BIDSVersion': '1.8.0'}, f)
+    for s in range(num_subjects):
+        func_dir = os.path.join(ds_dir, 'sub-%04d' % s, 'func')
+        os.makedirs(func_dir)
+        for r in range(files_per_subject):
+            open(os.path.join(func_dir, 'sub-%04d_task-rest_run-%02d_bold.nii.gz' % (s, r)), 'w').close()
+    return ds_dir
+
+
+class PopulationScalingTestCase(BaseTestCase):
+    def test_linear_scaling(self):
+        timings = {}
+        for num_files in [12500, 25000, 50000]:
+            ds_dir = _create_flat_dataset(num_files)
+            try:
+                start = time.perf_counter()
+                ds = ancpbids.load_dataset(ds_dir)
+                timings[num_files] = time.perf_counter() - start
+                flat = ds.derivatives.get_folder('flat')
+                self.assertEqual(num_files, len(flat.files))
+                self.assertTrue(all(isinstance(f, ds.get_schema().MetadataArtifact) for f in flat.files))
+            finally:
+                shutil.rmtree(ds_dir)
+            print('%6d JSON files: %.2f s (%.1f us/file)' % (
+                num_files, timings[num_files], timings[num_files] / num_files * 1e6))
+        # 4x the files should take about 4x the time, allow for some noise
+        self.assertLess(timings[50000] / timings[12500], 8)
+
+    def test_lazy_subtrees(self):
+        for num_subjects in [250, 1000, 4000]:
+            ds_dir = _create_cohort_dataset(num_subjects)
+            try:
+                start = time.perf_counter()
+                ds = ancpbids.load_dataset(ds_dir)
+                files = ds.query(sub='0042', return_type='files')
+                eager = time.perf_counter() - start
+
+                start = time.perf_counter()
+                ds = ancpbids.load_dataset(ds_dir, ancpbids.DatasetOptions(lazy_subtrees=True))
+                lazy_files = ds.query(sub='0042', return_type='files')
+                lazy = time.perf_counter() - start
+                self.assertEqual(files, lazy_files)
+            finally:
+                shutil.rmtree(ds_dir)
+            print('%5d subjects, load + query sub-0042: eager %.3f s, lazy %.3f s' % (num_subjects, eager, lazy))
+
+    def test_subject_lookup(self):
+        timings = {}
+        for num_subjects in [1, 2000]:
+            ds_dir = _create_cohort_dataset(num_subjects)
+            try:
+                ds = ancpbids.load_dataset(ds_dir, ancpbids.DatasetOptions(query_cache_size=0))
+                start = time.perf_counter()
+                for _ in range(100):
+                    files = ds.query(sub='0000', run='01', return_type='files')
+                timings[num_subjects] = (time.perf_counter() - start) / 100
+                self.assertEqual(1, len(files))
+            finally:
+                shutil.rmtree(ds_dir)
+            print('%5d subjects, query sub-0000: %.2f ms' % (num_subjects, timings[num_subjects] * 1e3))
+        # folders of other subjects are pruned, only their names are checked
+        self.assertLess(timings[2000] / timings[1], 50)
+
+    def test_paginated_query(self):
+        import tracemalloc
+        ds_dir = _create_cohort_dataset(2000)
+        try:
+            ds = ancpbids.load_dataset(ds_dir, ancpbids.DatasetOptions(query_cache_size=0))
+            start = time.perf_counter()
+            files = ds.query(suffix='bold', return_type='files')
+            full = time.perf_counter() - start
+            start = time.perf_counter()
+            page = ds.query(suffix='bold', return_type='files', limit=100)
+            first_page = time.perf_counter() - start
+            self.assertEqual(files[:100], page)
+
+            tracemalloc.start()
+            count = sum(1 for _ in ds.query(suffix='bold', stream=True))
+            _, streamed_peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            objects = ds.query(suffix='bold')
+            _, list_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.assertEqual(len(objects), count)
+        finally:
+            shutil.rmtree(ds_dir)
+        print('%d files: full query %.1f ms, first page %.1f ms' % (len(files), full * 1e3, first_page * 1e3))
+        print('peak memory: streamed %.1f KiB, list %.1f KiB' % (streamed_peak / 1024, list_peak / 1024))
+        self.assertLess(first_page, full)
+
+    def test_range_query(self):
+        ds_dir = _create_cohort_dataset(2000)
+        try:
+            ds = ancpbids.load_dataset(ds_dir, ancpbids.DatasetOptions(query_cache_size=0))
+            start = time.perf_counter()
+            ds.get_entity_index()
+            build = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(10):
+                files = ds.query(run=ancpbids.gt(17), return_type='files')
+            indexed = (time.perf_counter() - start) / 10
+            start = time.perf_counter()
+            scanned_files = ds.query(run=['18', '19'], return_type='files')
+            scanned = time.perf_counter() - start
+            self.assertEqual(scanned_files, files)
+        finally:
+            shutil.rmtree(ds_dir)
+        print('%d files in range: index build %.1f ms, range query %.1f ms, scan %.1f ms' % (
+            len(files), build * 1e3, indexed * 1e3, scanned * 1e3))
+        self.assertLess(indexed, scanned)
+
+    def test_regex_query(self):
+        from ancpbids.query import EntityIndex
+        ds_dir = _create_cohort_dataset(2000)
+        try:
+            ds = ancpbids.load_dataset(ds_dir, ancpbids.DatasetOptions(query_cache_size=0))
+            index = ds.get_entity_index()
+            start = time.perf_counter()
+            positions = index.search('run', ['^1[5-9]$'])
+            first_search = time.perf_counter() - start
+            start = time.perf_counter()
+            index.search('run', ['^1[5-9]$'])
+            search = time.perf_counter() - start
+            start = time.perf_counter()
+            files = ds.query(run='^1[5-9]$', regex_search=True, return_type='files')
+            bulk = time.perf_counter() - start
+
+            search_method = EntityIndex.search
+            EntityIndex.search = lambda *args: None
+            try:
+                start = time.perf_counter()
+                scanned_files = ds.query(run='^1[5-9]$', regex_search=True, return_type='files')
+                scanned = time.perf_counter() - start
+            finally:
+                EntityIndex.search = search_method
+            self.assertEqual(scanned_files, files)
+            self.assertEqual(2000 * 5, len(positions))
+        finally:
+            shutil.rmtree(ds_dir)
+        print('%d of %d values matched: buffer search %.1f ms (%.1f ms including joining the buffer)' % (
+            len(positions), len(index.artifacts), search * 1e3, first_search * 1e3))
+        print('regex query: %.1f ms, value by value %.1f ms' % (bulk * 1e3, scanned * 1e3))
+        self.assertLess(bulk, scanned)
+
+    def test_query_many(self):
+        ds_dir = _create_cohort_dataset(2000)
+        try:
+            ds = ancpbids.load_dataset(ds_dir, ancpbids.DatasetOptions(query_cache_size=0))
+            for label, queries in [('per run', [dict(run=r) for r in range(20)]),
+                                   ('per subject', [dict(sub='%04d' % s) for s in range(0, 2000, 100)])]:
+                start = time.perf_counter()
+                results = [ds.query(return_type='files', **query) for query in queries]
+                sequential = time.perf_counter() - start
+                start = time.perf_counter()
+                batched = ds.query_many(queries, return_type='files')
+                single_traversal = time.perf_counter() - start
+                self.assertEqual(results, batched)
+                print('%d queries %s: one by one %.1f ms, query_many %.1f ms' % (
+                    len(queries), label, sequential * 1e3, single_traversal * 1e3))
+                self.assertLess(single_traversal, sequential)
+        finally:
+            shutil.rmtree(ds_dir)
@@ -0,0 +1,81 @@
+import sys
+import time
+
+import ancpbids
+from ancpbids.model_base import Model
+from ..base_test_case import *
+
+
+def _recursive_generator(source, depth):
+    # the former recursive implementation of to_generator(), one generator frame per tree level
+    yield source
+    if depth > 0:
+        for value in source.values():
+            if isinstance(value, Model):
+                yield from _recursive_generator(value, depth - 1)
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, Model):
+                        yield from _recursive_generator(item, depth - 1)
+
+
+def _create_deep_tree(schema, depth, files_per_folder=1):
+    root = folder = schema.Folder(name='root')
+    for i in range(depth):
+        folder.files.extend(schema.File(name='file%d' % j) for j in range(files_per_folder))
+        folder.folders.append(schema.Folder(name='folder%d' % i))
+        folder = folder.folders[0]
+    return root
+
+
+def _create_wide_tree(schema, num_folders, files_per_folder):
+    root = schema.Folder(name='root')
+    for i in range(num_folders):
+        folder = schema.Folder(name='folder%d' % i)
+        folder.files.extend(schema.File(name='file%d' % j) for j in range(files_per_folder))
+        root.folders.append(folder)
+    return root
+
+
+def _measure(generator_factory, repeat=5):
+    best = None
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in generator_factory())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+class TraversalBenchmarkTestCase(BaseTestCase):
+    def _compare(self, label, root, depth):
+        count, iterative = _measure(lambda: root.to_generator(depth=depth))
+        _, recursive = _measure(lambda: _recursive_generator(root, depth))
+        print('%-32s %7d nodes: iterative %.1f us/node, recursive %.1f us/node' % (
+            label, count, iterative / count * 1e6, recursive / count * 1e6))
+        return count
+
+    def test_deep_trees(self):
+        schema = ancpbids.load_dataset(DS005_DIR).get_schema()
+        limit = sys.getrecursionlimit()
+        for depth in [10, 100, 500]:
+            root = _create_deep_tree(schema, depth, files_per_folder=10)
+            self.assertEqual(depth * 11 + 1, self._compare('deep tree (depth=%d)' % depth, root, limit))
+        # too deep for the recursive implementation
+        root = _create_deep_tree(schema, limit * 2)
+        count, elapsed = _measure(lambda: root.to_generator(depth=limit * 4))
+        self.assertEqual(limit * 4 + 1, count)
+        print('%-32s %7d nodes: iterative %.1f us/node' % ('deep tree (depth=%d)' % (limit * 2), count,
+                                                           elapsed / count * 1e6))
+
+    def test_wide_trees(self):
+        schema = ancpbids.load_dataset(DS005_DIR).get_schema()
+        for num_folders, files_per_folder in [(10, 10000), (1000, 100), (100000, 1)]:
+            root = _create_wide_tree(schema, num_folders, files_per_folder)
+            count = self._compare('wide tree (%dx%d)' % (num_folders, files_per_folder), root, 1000)
+            self.assertEqual(num_folders * (files_per_folder + 1) + 1, count)
+
+    def test_dataset(self):
+        dataset = ancpbids.load_dataset(DS005_DIR)
+        self._compare('ds005', dataset, 1000)
@@ -2,7 +2,7 @@ from typing import List, Dict
 
 import torch
 
-from ancpbids.torch import TorchDataset
+from ancpbids.torch import TorchDataset, TorchIterableDataset
 from ..base_test_case import *
 
 
@@ -21,6 +21,33 @@ class BasicTestCase(BaseTestCase):
         assert os.path.exists(file_path[0])
         assert isinstance(onset_events, list)
 
+    def test_torch_dataset_events_cache(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as cache_dir:
+            torch_ds = TorchDataset(DS005_DIR, suffix="bold")
+            cached_ds = TorchDataset(DS005_DIR, suffix="bold", events_cache_dir=cache_dir)
+            assert len(torch_ds) == len(cached_ds)
+            for i in range(len(torch_ds)):
+                assert torch_ds[i] == cached_ds[i]
+
+    def test_torch_iterable_dataset(self):
+        torch_ds = TorchIterableDataset(DS005_DIR, suffix="bold", prefetch=4)
+        items = list(torch_ds)
+        assert len(items) == 49
+        file_path, onset_events = items[0]
+        assert os.path.exists(file_path)
+        assert isinstance(onset_events, list)
+
+        # shards of all ranks are disjoint and cover all files
+        shards = [[path for path, _ in TorchIterableDataset(DS005_DIR, suffix="bold", rank=rank, world_size=3)]
+                  for rank in range(3)]
+        assert [17, 16, 16] == [len(shard) for shard in shards]
+        assert sorted(path for shard in shards for path in shard) == sorted(path for path, _ in items)
+
+        # each worker of the data loader consumes its own shard
+        train_dl = torch.utils.data.DataLoader(torch_ds, num_workers=2, batch_size=None)
+        assert sorted(path for path, _ in train_dl) == sorted(path for path, _ in items)
+
 
 if __name__ == '__main__':
     unittest.main()